@@ -0,0 +1,249 @@
+"""Columnar storage of extracted DICOM metadata as a partitioned Parquet dataset.
+
+Tags which are used to summarize, select and group DICOMs are stored in typed
+columns (dates, integers and strings) so that they can be read without
+parsing any other column. All remaining metadata is kept as a JSON string in
+the 'other_metadata' column. Requires pyarrow.
+"""
+
+import datetime
+import json
+import os
+import uuid
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+DATE_COLUMNS = ['StudyDate', 'SeriesDate', 'AcquisitionDate', 'ContentDate', 'PatientBirthDate']
+INTEGER_COLUMNS = ['Rows', 'Columns', 'BitsAllocated', 'BitsStored', 'SamplesPerPixel', 'NumberOfFrames',
+                   'SeriesNumber', 'InstanceNumber', 'AcquisitionNumber']
+STRING_COLUMNS = ['AccessionNumber', 'PatientID', 'StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID',
+                  'SOPClassUID', 'Modality', 'Manufacturer', 'ManufacturerModelName', 'StudyDescription',
+                  'SeriesDescription', 'ViewPosition', 'ImageLaterality', 'Laterality', 'PhotometricInterpretation',
+                  'PixelIntensityRelationship']
+METADATA_COLUMNS = DATE_COLUMNS + INTEGER_COLUMNS + STRING_COLUMNS
+
+ACCESSION_PREFIX_LENGTH = 2
+DEFAULT_BATCH_SIZE = 100000
+
+NO_PARTITION_ERR = 'Partition {} not in PARTITIONS! Available partitions are {}.'
+
+
+def get_year_partition(dicom_metadata):
+    """Partitions by the year of the StudyDate."""
+
+    study_date = dicom_metadata.get('StudyDate', None)
+    return study_date[:4] if study_date else 'None'
+
+
+def get_accession_prefix_partition(dicom_metadata):
+    """Partitions by the first characters of the AccessionNumber."""
+
+    accession = dicom_metadata.get('AccessionNumber', None)
+    return accession[:ACCESSION_PREFIX_LENGTH] if accession else 'None'
+
+
+PARTITIONS = {'year': get_year_partition,
+              'accession_prefix': get_accession_prefix_partition}
+
+
+def check_pyarrow():
+    if pa is None:
+        raise ImportError('pyarrow must be installed to read and write columnar metadata.')
+
+
+def get_schema(partition_by):
+    """Gets the schema of a columnar metadata table.
+
+    Arguments:
+        partition_by(str): The name of the partition column.
+    Returns:
+        A pyarrow schema.
+    """
+
+    check_pyarrow()
+
+    fields = [
+        pa.field('dicom_path', pa.string()),
+        pa.field('slice_count', pa.int64()),
+        pa.field('slice_count_strategy', pa.string()),
+        pa.field('errors', pa.list_(pa.string()))
+    ]
+    fields.extend([pa.field(column, pa.date32()) for column in DATE_COLUMNS])
+    fields.extend([pa.field(column, pa.int64()) for column in INTEGER_COLUMNS])
+    fields.extend([pa.field(column, pa.string()) for column in STRING_COLUMNS])
+    fields.append(pa.field('other_metadata', pa.string()))
+    fields.append(pa.field(partition_by, pa.string()))
+
+    return pa.schema(fields)
+
+
+def parse_date(value):
+    """Parses a DICOM DA value (YYYYMMDD), returning None if it is invalid."""
+
+    try:
+        return datetime.date(int(value[:4]), int(value[4:6]), int(value[6:8]))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_integer(value):
+    """Parses a DICOM IS or US value, returning None if it is invalid."""
+
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def rows_to_table(rows, partition_by='year'):
+    """Converts metadata rows to a typed columnar table.
+
+    Arguments:
+        rows(list): Rows as produced by get_dicom_metadata_and_slice_counts.
+        partition_by(str): The name of a partition in PARTITIONS.
+    Returns:
+        A pyarrow Table.
+    """
+
+    if partition_by not in PARTITIONS:
+        raise Exception(NO_PARTITION_ERR.format(partition_by, PARTITIONS.keys()))
+    get_partition = PARTITIONS[partition_by]
+
+    schema = get_schema(partition_by)
+    columns = {name: [] for name in schema.names}
+
+    for row in rows:
+        dicom_metadata = row.get('dicom_metadata', {})
+        columns['dicom_path'].append(row['dicom_path'])
+        columns['slice_count'].append(row.get('slice_count', None))
+        columns['slice_count_strategy'].append(row.get('slice_count_strategy', None))
+        columns['errors'].append(row.get('errors', []))
+        for column in DATE_COLUMNS:
+            columns[column].append(parse_date(dicom_metadata.get(column, None)))
+        for column in INTEGER_COLUMNS:
+            columns[column].append(parse_integer(dicom_metadata.get(column, None)))
+        for column in STRING_COLUMNS:
+            columns[column].append(dicom_metadata.get(column, None))
+        other_metadata = {key: value for key, value in dicom_metadata.items() if key not in METADATA_COLUMNS}
+        columns['other_metadata'].append(json.dumps(other_metadata, sort_keys=True))
+        columns[partition_by].append(get_partition(dicom_metadata))
+
+    return pa.table(columns, schema=schema)
+
+
+def write_columnar(rows, dataset_dir, partition_by='year', batch_size=DEFAULT_BATCH_SIZE):
+    """Writes metadata rows to a partitioned Parquet dataset in batches.
+
+    Only one batch of rows is held in memory at a time. Each batch is
+    written to new files so the dataset can be appended to.
+
+    Arguments:
+        rows(iterable): Rows as produced by get_dicom_metadata_and_slice_counts.
+        dataset_dir(str): Directory of the Parquet dataset.
+        partition_by(str): The name of a partition in PARTITIONS.
+        batch_size(int): Number of rows per batch.
+    Returns:
+        The number of rows written.
+    """
+
+    check_pyarrow()
+
+    num_rows = 0
+    batch = []
+
+    def write_batch():
+        table = rows_to_table(batch, partition_by)
+        pq.write_to_dataset(table, dataset_dir, partition_cols=[partition_by],
+                            basename_template='part-{}-{{i}}.parquet'.format(uuid.uuid4().hex))
+
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            write_batch()
+            num_rows += len(batch)
+            batch = []
+    if len(batch) > 0:
+        write_batch()
+        num_rows += len(batch)
+
+    return num_rows
+
+
+def get_partitioning(dataset_dir):
+    """Gets the partitioning of a dataset, with the partition column read as a string.
+
+    Arguments:
+        dataset_dir(str): Directory of the Parquet dataset.
+    Returns:
+        A pyarrow.dataset Partitioning, or None if the dataset is not partitioned.
+    """
+
+    for name in os.listdir(dataset_dir):
+        if '=' in name and os.path.isdir(os.path.join(dataset_dir, name)):
+            partition_by = name.split('=', 1)[0]
+            return ds.partitioning(pa.schema([(partition_by, pa.string())]), flavor='hive')
+
+    return None
+
+
+def read_columnar(dataset_dir, columns=None, filter=None):
+    """Reads selected columns of a Parquet metadata dataset.
+
+    Only the requested columns are read from disk.
+
+    Arguments:
+        dataset_dir(str): Directory of the Parquet dataset.
+        columns(list): Names of the columns to read, or None for all columns.
+        filter(Expression): An optional pyarrow.dataset filter expression on
+            the columns, including the partition column.
+    Returns:
+        A pandas DataFrame.
+    """
+
+    check_pyarrow()
+
+    dataset = ds.dataset(dataset_dir, format='parquet', partitioning=get_partitioning(dataset_dir))
+    table = dataset.to_table(columns=columns, filter=filter)
+
+    return table.to_pandas()
+
+
+def get_columnar_fragments(dataset_dir):
+    """Gets the paths of the Parquet files of a metadata dataset.
+
+    Arguments:
+        dataset_dir(str): Directory of the Parquet dataset.
+    Returns:
+        A sorted list of Parquet file paths.
+    """
+
+    check_pyarrow()
+
+    dataset = ds.dataset(dataset_dir, format='parquet', partitioning=get_partitioning(dataset_dir))
+
+    return sorted(dataset.files)
+
+
+def read_columnar_fragment(fragment_path, columns=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Reads selected columns of one Parquet file of a metadata dataset one batch at a time.
+
+    The partition column is not stored in the file, so it cannot be read.
+
+    Arguments:
+        fragment_path(str): Path to a Parquet file, as returned by get_columnar_fragments.
+        columns(list): Names of the columns to read, or None for all columns.
+        batch_size(int): Maximum number of rows per batch.
+    Returns:
+        A generator of pandas DataFrames.
+    """
+
+    check_pyarrow()
+
+    parquet_file = pq.ParquetFile(fragment_path)
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        yield batch.to_pandas()
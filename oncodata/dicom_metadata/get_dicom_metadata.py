@@ -1,5 +1,8 @@
 import pydicom
 
+from oncodata.dicom_to_png.get_slice_count import resolve_slice_count
+from oncodata.utils.parallel import time_limit
+
 def get_dicom_metadata(dicom_path):
     """Extracts metadata from a dicom file.
 
@@ -18,3 +21,41 @@ def get_dicom_metadata(dicom_path):
     dicom_metadata = {key: str(dicom_data.get(key)) for key in dicom_keys}
 
     return dicom_metadata
+
+def get_dicom_metadata_and_slice_counts(dicom_path, timeout=None):
+    """Gets DICOM metadata and slice counts.
+
+    Arguments:
+        dicom_path(str): Path to a DICOM file.
+        timeout(float): Seconds after which each step is abandoned
+            and recorded as an error, or None for no limit.
+    Returns:
+        A dictionary containing the DICOM path,
+        metadata, slice count, and a list of any
+        errors encountered while extracting this
+        information. 'slice_count_strategy' records
+        how the slice count was determined.
+    """
+    row = {
+        'dicom_path': dicom_path,
+        'dicom_metadata': {},
+        'slice_count': None,
+        'slice_count_strategy': None,
+        'errors': []
+    }
+
+    # Get metadata
+    try:
+        with time_limit(timeout):
+            row['dicom_metadata'] = get_dicom_metadata(dicom_path)
+    except Exception as e:
+        row['errors'].append(str(e))
+
+    # Get slice count
+    try:
+        with time_limit(timeout):
+            row['slice_count'], row['slice_count_strategy'] = resolve_slice_count(dicom_path)
+    except Exception as e:
+        row['errors'].append(str(e))
+
+    return row
@@ -0,0 +1,306 @@
+"""Reading and writing DICOM metadata as JSON Lines, optionally gzip or zstd compressed.
+
+Each line holds one row as produced by dicom_metadata_to_json.py. Rows can be
+appended as soon as they are extracted, so a crashed run loses at most the
+line being written and can be resumed. A compressed file truncated by a
+crash cannot be appended to, since the data after the truncated gzip member
+or zstd frame would not be readable, so it is first rewritten with its
+complete lines. Files ending in '.json' are read as the original format, a
+single JSON list of rows.
+"""
+
+import gzip
+import io
+import json
+import os
+import zlib
+
+from oncodata.utils.files import atomic_output_path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+READ_BLOCK_SIZE = 2 ** 20
+# Errors raised when reading a compressed stream truncated by a crash
+TRUNCATION_ERRORS = (EOFError, OSError, zlib.error) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+def is_json_lines(path):
+    """Checks if a path refers to a JSON Lines file rather than a single JSON list.
+
+    Arguments:
+        path(str): Path to a metadata file.
+    Returns:
+        True unless the path ends in '.json'.
+    """
+
+    return not path.endswith('.json')
+
+
+def is_compressed(path):
+    """Checks if a metadata file is gzip or zstd compressed, from its extension."""
+
+    return path.endswith('.gz') or path.endswith('.zst')
+
+
+def open_metadata_bytes(path, mode='r'):
+    """Opens a metadata file as bytes, compressing based on the extension.
+
+    Arguments:
+        path(str): Path to a metadata file. Paths ending in '.gz' are gzip
+            compressed and paths ending in '.zst' are zstd compressed.
+        mode(str): 'r' to read, 'w' to write or 'a' to append.
+    Returns:
+        A binary file object.
+    Raises:
+        ImportError if the path ends in '.zst' and zstandard is not installed.
+    """
+
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 'b')
+
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError('zstandard must be installed to read and write .zst metadata files.')
+        metadata_file = zstandard.open(path, mode + 'b')
+        # The zstd reader cannot iterate over lines by itself
+        return io.BufferedReader(metadata_file) if mode == 'r' else metadata_file
+
+    return open(path, mode + 'b')
+
+
+def open_metadata_file(path, mode='r'):
+    """Opens a metadata file as text, compressing based on the extension.
+
+    Arguments:
+        path(str): Path to a metadata file. Paths ending in '.gz' are gzip
+            compressed and paths ending in '.zst' are zstd compressed.
+        mode(str): 'r' to read, 'w' to write or 'a' to append.
+    Returns:
+        A text file object.
+    Raises:
+        ImportError if the path ends in '.zst' and zstandard is not installed.
+    """
+
+    if is_compressed(path):
+        return io.TextIOWrapper(open_metadata_bytes(path, mode), encoding='utf-8')
+
+    return open(path, mode, encoding='utf-8')
+
+
+def is_zstd_truncated(path):
+    """Checks if the last zstd frame of a file is incomplete.
+
+    The zstd reader returns the data of a truncated frame without an error,
+    so the frames are walked with a decompressor which tells where each ends.
+
+    Arguments:
+        path(str): Path to a zstd compressed file.
+    Returns:
+        True if the file ends within a frame.
+    """
+
+    decompressor = zstandard.ZstdDecompressor()
+    frame = None
+    with open(path, 'rb') as compressed_file:
+        for block in iter(lambda: compressed_file.read(READ_BLOCK_SIZE), b''):
+            while block:
+                frame = frame or decompressor.decompressobj()
+                frame.decompress(block)
+                block = b''
+                if frame.eof:
+                    block, frame = frame.unused_data, None
+
+    return frame is not None
+
+
+def read_complete_lines(path):
+    """Reads the lines of a metadata file which end with a newline, up to a truncated end.
+
+    Arguments:
+        path(str): Path to a JSON Lines metadata file.
+    Returns:
+        A tuple of the list of complete lines, as bytes, and True if the file
+        ended with a truncated line or compressed stream.
+    """
+
+    lines = []
+    try:
+        with open_metadata_bytes(path) as metadata_file:
+            for line in metadata_file:
+                if not line.endswith(b'\n'):
+                    return lines, True
+                lines.append(line)
+        if path.endswith('.zst'):
+            return lines, is_zstd_truncated(path)
+    except TRUNCATION_ERRORS:
+        return lines, True
+
+    return lines, False
+
+
+def repair_compressed_metadata(path):
+    """Rewrites a compressed metadata file truncated by a crash with its complete lines.
+
+    Arguments:
+        path(str): Path to a gzip or zstd compressed JSON Lines metadata file.
+    Returns:
+        True if the file was truncated and rewritten.
+    """
+
+    lines, truncated = read_complete_lines(path)
+    if not truncated:
+        return False
+
+    with atomic_output_path(path) as temp_path:
+        with open_metadata_bytes(temp_path, 'w') as metadata_file:
+            for line in lines:
+                metadata_file.write(line)
+
+    return True
+
+
+def read_metadata(path):
+    """Reads metadata rows one at a time.
+
+    Lines which cannot be decoded, such as a final line truncated by a
+    crash, are skipped, and reading stops at the end of a truncated
+    compressed stream.
+
+    Arguments:
+        path(str): Path to a JSON Lines metadata file or to a JSON list of rows.
+    Returns:
+        A generator of metadata rows.
+    """
+
+    if not is_json_lines(path):
+        with open(path, 'r') as metadata_file:
+            for row in json.load(metadata_file):
+                yield row
+        return
+
+    with open_metadata_file(path, 'r') as metadata_file:
+        try:
+            for line in metadata_file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+        except TRUNCATION_ERRORS + (UnicodeDecodeError,):
+            # Compressed stream truncated by a crash
+            return
+
+
+def get_json_lines_ranges(path, range_size):
+    """Splits an uncompressed JSON Lines file into byte ranges.
+
+    Ranges need not start or end at line boundaries; read_metadata_range
+    assigns each line to the range containing its first byte.
+
+    Arguments:
+        path(str): Path to an uncompressed JSON Lines metadata file.
+        range_size(int): Number of bytes per range.
+    Returns:
+        A list of (start, end) byte offsets covering the file.
+    """
+
+    size = os.path.getsize(path)
+
+    return [(start, min(start + range_size, size)) for start in range(0, size, range_size)]
+
+
+def read_metadata_range(path, start, end):
+    """Reads the metadata rows of the lines which start within a byte range.
+
+    Arguments:
+        path(str): Path to an uncompressed JSON Lines metadata file.
+        start(int): Offset of the first byte of the range.
+        end(int): Offset after the last byte of the range.
+    Returns:
+        A generator of metadata rows.
+    """
+
+    with open(path, 'rb') as metadata_file:
+        if start > 0:
+            # Skip the rest of a line which started in the previous range
+            metadata_file.seek(start - 1)
+            metadata_file.readline()
+        while metadata_file.tell() < end:
+            line = metadata_file.readline()
+            if not line:
+                break
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def read_dicom_paths(path):
+    """Reads the set of DICOM paths already present in a metadata file.
+
+    Arguments:
+        path(str): Path to a metadata file.
+    Returns:
+        A set of DICOM paths.
+    """
+
+    return set(row['dicom_path'] for row in read_metadata(path))
+
+
+class MetadataWriter(object):
+    """Writes metadata rows to a JSON Lines file as they are produced:
+
+        with MetadataWriter(results_path, append=True) as writer:
+            for row in rows:
+                writer.write(row)
+    """
+
+    def __init__(self, path, append=False, flush_every=1000):
+        """Opens a JSON Lines metadata file for writing.
+
+        Arguments:
+            path(str): Path to the metadata file.
+            append(bool): True to append to an existing file instead of
+                overwriting it, after repairing a line or compressed
+                stream left unfinished by a crash.
+            flush_every(int): Number of rows between flushes to disk.
+        """
+
+        if append and is_compressed(path) and os.path.exists(path):
+            repair_compressed_metadata(path)
+        elif append:
+            # Terminate a line left unfinished by a crash so it is skipped when reading
+            with open(path, 'ab+') as metadata_file:
+                if metadata_file.tell() > 0:
+                    metadata_file.seek(-1, io.SEEK_END)
+                    if metadata_file.read(1) != b'\n':
+                        metadata_file.write(b'\n')
+
+        self.metadata_file = open_metadata_file(path, 'a' if append else 'w')
+        self.flush_every = flush_every
+        self.num_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, row):
+        """Writes one row.
+
+        Arguments:
+            row(dict): A JSON serializable metadata row.
+        """
+
+        self.metadata_file.write(json.dumps(row, sort_keys=True) + '\n')
+        self.num_rows += 1
+        if self.num_rows % self.flush_every == 0:
+            self.metadata_file.flush()
+
+    def close(self):
+        """Flushes and closes the file."""
+
+        self.metadata_file.close()
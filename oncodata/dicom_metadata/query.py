@@ -0,0 +1,144 @@
+"""Selection of DICOMs from indexed metadata in a SQL database, without reading any DICOM.
+
+Selection criteria, as in DICOM_TYPES, are translated into a query on the
+metadata tables written by SqlMetadataWriter. Tags which are typed columns of
+the dicoms table are compared through their indexes (SOPClassUID, Modality,
+SeriesDescription, Manufacturer, StudyDate and AccessionNumber are indexed),
+and any other tag is looked up in the dicom_tags table by its primary key.
+Values are compared as strings, as select_dicom compares header values, and
+a value which names a UID also matches the dotted UID, so both select the
+same DICOMs from the same metadata.
+"""
+
+import contextlib
+import os
+
+from oncodata.dicom_metadata.columnar import DATE_COLUMNS, INTEGER_COLUMNS, parse_date, parse_integer
+from oncodata.dicom_metadata.sql import DIALECTS, DICOM_COLUMNS, connect, get_dialect, get_sqlite_path
+from oncodata.dicom_to_png.selection import get_criterion_values
+
+
+def get_condition(key, value, dialect):
+    """Gets the SQL condition of one key:value selection criterion on the dicoms table.
+
+    Arguments:
+        key(str): A DICOM keyword.
+        value(str): The value the tag must have.
+        dialect(dict): An entry of DIALECTS.
+    Returns:
+        A tuple of the condition and its list of parameters.
+    """
+
+    quote = dialect['quote'].format
+    placeholder = dialect['placeholder']
+
+    values = get_criterion_values(value)
+    placeholders = ', '.join([placeholder] * len(values))
+
+    if key not in DICOM_COLUMNS:
+        condition = ('EXISTS (SELECT 1 FROM {tags} WHERE {tags}.{path} = {dicoms}.{path} AND {name} = {p} '
+                     'AND {value} IN ({values}))')
+        return condition.format(tags=quote('dicom_tags'), dicoms=quote('dicoms'), path=quote('dicom_path'),
+                                name=quote('name'), value=quote('value'), p=placeholder,
+                                values=placeholders), [key] + values
+
+    # Typed columns hold parsed values, which match if the value parses the same way
+    if key in DATE_COLUMNS:
+        value = parse_date(value)
+        value = value.isoformat() if value is not None else None
+    elif key in INTEGER_COLUMNS:
+        value = parse_integer(value)
+    else:
+        return '{} IN ({})'.format(quote(key), placeholders), values
+    if value is None:
+        return '1 = 0', []
+
+    return '{} = {}'.format(quote(key), placeholder), [value]
+
+
+def get_selection_query(selection_criteria, dialect, start_date=None, end_date=None, columns=('dicom_path',)):
+    """Gets the query of the columns of the DICOMs which fit at least one set of selection criteria.
+
+    Arguments:
+        selection_criteria(list or tuple): list or tuple of dictionaries where each dictionary describes a set of key:value selection criteria.
+        dialect(dict): An entry of DIALECTS.
+        start_date(str): Optional first StudyDate (YYYYMMDD) of the selected DICOMs.
+        end_date(str): Optional last StudyDate (YYYYMMDD) of the selected DICOMs.
+        columns(list): Columns of the dicoms table to select.
+    Returns:
+        A tuple of the query and its list of parameters.
+    """
+
+    quote = dialect['quote'].format
+    placeholder = dialect['placeholder']
+
+    clauses = []
+    parameters = []
+    for criteria in selection_criteria:
+        conditions = []
+        for key, value in criteria.items():
+            condition, condition_parameters = get_condition(key, value, dialect)
+            conditions.append(condition)
+            parameters.extend(condition_parameters)
+        clauses.append('({})'.format(' AND '.join(conditions) or '1 = 1'))
+
+    where = ['({})'.format(' OR '.join(clauses))] if clauses else []
+    for operator, date in [('>=', start_date), ('<=', end_date)]:
+        if date is not None:
+            where.append('{} {} {}'.format(quote('StudyDate'), operator, placeholder))
+            parameters.append(parse_date(date).isoformat())
+
+    query = 'SELECT {} FROM {}'.format(', '.join(quote(column) for column in columns), quote('dicoms'))
+    if where:
+        query += ' WHERE ' + ' AND '.join(where)
+
+    return query + ' ORDER BY {}'.format(quote('dicom_path')), parameters
+
+
+def select_rows(database, selection_criteria, start_date=None, end_date=None, columns=('dicom_path',)):
+    """Selects columns of the DICOMs whose metadata fits at least one set of selection criteria.
+
+    The database is only read. Metadata written before an index was added is
+    indexed by writing to it again or by dicom_metadata_to_sql.py --migrate.
+
+    Arguments:
+        database(str): Path to a SQLite file or a mssql:// URL of metadata
+            written by SqlMetadataWriter.
+        selection_criteria(list or tuple): list or tuple of dictionaries where each dictionary describes a set of key:value selection criteria.
+            Every DICOM is selected if no selection criteria is provided.
+        start_date(str): Optional first StudyDate (YYYYMMDD) of the selected DICOMs.
+        end_date(str): Optional last StudyDate (YYYYMMDD) of the selected DICOMs.
+        columns(list): Columns of the dicoms table to select.
+    Returns:
+        A list of dictionaries from column to value, sorted by DICOM path.
+    Raises:
+        FileNotFoundError if the database is a SQLite file which does not exist.
+    """
+
+    dialect_name = get_dialect(database)
+    if dialect_name == 'sqlite' and not os.path.exists(get_sqlite_path(database)):
+        raise FileNotFoundError('Metadata database {} does not exist.'.format(database))
+
+    query, parameters = get_selection_query(selection_criteria, DIALECTS[dialect_name], start_date, end_date, columns)
+
+    with contextlib.closing(connect(database)) as connection:
+        cursor = connection.cursor()
+        cursor.execute(query, parameters)
+
+        return [dict(zip(columns, values)) for values in cursor.fetchall()]
+
+
+def select_paths(database, selection_criteria, start_date=None, end_date=None):
+    """Selects the paths of the DICOMs whose metadata fits at least one set of selection criteria.
+
+    Arguments:
+        database(str): Path to a SQLite file or a mssql:// URL of metadata
+            written by SqlMetadataWriter.
+        selection_criteria(list or tuple): list or tuple of dictionaries where each dictionary describes a set of key:value selection criteria.
+        start_date(str): Optional first StudyDate (YYYYMMDD) of the selected DICOMs.
+        end_date(str): Optional last StudyDate (YYYYMMDD) of the selected DICOMs.
+    Returns:
+        A sorted list of DICOM paths.
+    """
+
+    return [row['dicom_path'] for row in select_rows(database, selection_criteria, start_date, end_date)]
@@ -1,6 +1,28 @@
-"""Methods used to generate summary statistics for DICOM metadata."""
+"""Methods used to generate summary statistics for DICOM metadata.
+
+Each summary statistic is registered in STATISTIC_REGISTRY with
+RegisterStatistic and declares how to initialize, update and merge
+a partial aggregate and how to turn it into the final statistic.
+All registered statistics are computed in a single pass, and partial
+aggregates of shards of the metadata can be computed in parallel and
+merged.
+"""
 
 from collections import Counter
+import os
+
+import pandas as pd
+from p_tqdm import p_umap
+
+from oncodata.dicom_metadata.columnar import get_columnar_fragments, read_columnar_fragment
+from oncodata.dicom_metadata.jsonl import get_json_lines_ranges, read_metadata, read_metadata_range
+
+STATISTIC_REGISTRY = {}
+
+NO_STATISTIC_ERR = 'Statistic {} not in STATISTIC_REGISTRY! Available statistics are {}.'
+
+# Approximate number of bytes of uncompressed JSON Lines metadata per shard
+DEFAULT_SHARD_SIZE = 64 * 2 ** 20
 
 def get_count(dicom_metadata, key):
     """Creates a mapping from values to counts for a DICOM metadata key.
@@ -51,14 +73,238 @@ def get_years(dicom_metadata):
 
     return dict(year_counts)
 
+def RegisterStatistic(statistic_name):
+    """Registers a statistic class. The class is instantiated without arguments."""
+
+    def decorator(cls):
+        STATISTIC_REGISTRY[statistic_name] = cls()
+        return cls
+
+    return decorator
+
+def get_statistic(statistic_name):
+    if not statistic_name in STATISTIC_REGISTRY:
+        raise Exception(
+            NO_STATISTIC_ERR.format(
+                statistic_name, STATISTIC_REGISTRY.keys()))
+
+    return STATISTIC_REGISTRY[statistic_name]
+
+def count_column(column):
+    """Counts the values of a column, counting missing values as "None".
+
+    Arguments:
+        column(pd.Series): A column of a DICOM metadata DataFrame.
+    Returns:
+        A Counter mapping values to counts.
+    """
+
+    counts = column.fillna('None').value_counts()
+
+    return Counter({value: int(count) for value, count in counts.items()})
+
+class Statistic(object):
+    """A summary statistic computed from a mergeable partial aggregate.
+
+    Subclasses set columns, the columns of a columnar metadata dataset
+    the statistic needs, and implement update, update_columns and,
+    if needed, init, merge and finalize. The default aggregate is
+    a Counter.
+    """
+
+    columns = []
+
+    def init(self):
+        """Returns an empty partial aggregate."""
+
+        return Counter()
+
+    def update(self, aggregate, dicom_metadata):
+        """Updates a partial aggregate with the metadata of one DICOM.
+
+        Arguments:
+            aggregate: A partial aggregate as returned by init.
+            dicom_metadata(dict): The metadata of one DICOM.
+        """
+
+        raise NotImplementedError
+
+    def update_columns(self, aggregate, metadata_frame):
+        """Updates a partial aggregate with a batch of columnar metadata.
+
+        Arguments:
+            aggregate: A partial aggregate as returned by init.
+            metadata_frame(pd.DataFrame): DICOM metadata with (at least) the columns.
+        """
+
+        raise NotImplementedError
+
+    def merge(self, aggregate, other_aggregate):
+        """Adds other_aggregate to aggregate and returns aggregate."""
+
+        aggregate.update(other_aggregate)
+
+        return aggregate
+
+    def finalize(self, aggregate):
+        """Converts a partial aggregate into the JSON serializable statistic."""
+
+        return dict(aggregate)
+
+class CountStatistic(Statistic):
+    """Counts the values of one DICOM metadata key, counting missing values as "None"."""
+
+    key = None
+
+    @property
+    def columns(self):
+        return [self.key]
+
+    def update(self, aggregate, dicom_metadata):
+        aggregate[dicom_metadata.get(self.key, 'None')] += 1
+
+    def update_columns(self, aggregate, metadata_frame):
+        aggregate.update(count_column(metadata_frame[self.key]))
+
+@RegisterStatistic('num_dicoms_to_count')
+class NumDicomsToCount(CountStatistic):
+    """Maps number of DICOMs to the number of accessions containing that many DICOMs.
+
+    The aggregate counts DICOMs per accession, since accessions may be
+    split across shards.
+    """
+
+    key = 'AccessionNumber'
+
+    def finalize(self, aggregate):
+        accession_to_num_dicoms = dict(aggregate)
+        accession_to_num_dicoms.pop('None', None) # Ignore DICOMs with no AccessionNumber
+
+        return dict(Counter(accession_to_num_dicoms.values()))
+
+@RegisterStatistic('pixel_intensity_relationships')
+class PixelIntensityRelationships(CountStatistic):
+    key = 'PixelIntensityRelationship'
+
+@RegisterStatistic('years')
+class Years(Statistic):
+    """Maps year or "None" to the number of DICOMs from that year."""
+
+    columns = ['StudyDate']
+
+    def update(self, aggregate, dicom_metadata):
+        study_date = dicom_metadata.get('StudyDate', None)
+        aggregate[study_date[:4] if study_date else 'None'] += 1
+
+    def update_columns(self, aggregate, metadata_frame):
+        years = pd.to_datetime(metadata_frame['StudyDate']).dt.year
+        years = years.map(lambda year: 'None' if pd.isnull(year) else str(int(year)))
+        aggregate.update(count_column(years))
+
+@RegisterStatistic('sop_class_uids')
+class SOPClassUIDs(CountStatistic):
+    key = 'SOPClassUID'
+
+@RegisterStatistic('modality')
+class Modality(CountStatistic):
+    key = 'Modality'
+
+@RegisterStatistic('study_description')
+class StudyDescription(CountStatistic):
+    key = 'StudyDescription'
+
+@RegisterStatistic('manufacturer')
+class Manufacturer(CountStatistic):
+    key = 'Manufacturer'
+
+@RegisterStatistic('view_position')
+class ViewPosition(CountStatistic):
+    key = 'ViewPosition'
+
+@RegisterStatistic('laterality')
+class ImageLaterality(CountStatistic):
+    key = 'ImageLaterality'
+
+# Columns of a columnar metadata dataset needed by summarize
+SUMMARY_COLUMNS = sorted(set(column for statistic in STATISTIC_REGISTRY.values() for column in statistic.columns))
+
+def init_summary():
+    """Creates an empty partial summary.
+
+    A partial summary holds the partial aggregate of every registered
+    statistic. It can be updated one row or one batch of columns at a
+    time and merged with other partial summaries. Its size depends on
+    the number of distinct values and accessions, not on the number of rows.
+
+    Returns:
+        A dictionary mapping statistic name to partial aggregate.
+    """
+
+    return {name: statistic.init() for name, statistic in STATISTIC_REGISTRY.items()}
+
+def update_summary(partial_summary, dicom_metadata):
+    """Updates a partial summary with the metadata of one DICOM.
+
+    Arguments:
+        partial_summary(dict): A partial summary as returned by init_summary.
+        dicom_metadata(dict): The metadata of one DICOM.
+    """
+
+    for name, statistic in STATISTIC_REGISTRY.items():
+        statistic.update(partial_summary[name], dicom_metadata)
+
+def update_summary_columns(partial_summary, metadata_frame):
+    """Updates a partial summary column-wise with a batch of columnar metadata.
+
+    Arguments:
+        partial_summary(dict): A partial summary as returned by init_summary.
+        metadata_frame(pd.DataFrame): DICOM metadata with (at least) the
+            SUMMARY_COLUMNS, as returned by read_columnar.
+    """
+
+    for name, statistic in STATISTIC_REGISTRY.items():
+        statistic.update_columns(partial_summary[name], metadata_frame)
+
+def merge_summaries(partial_summary, other_partial_summary):
+    """Merges one partial summary into another.
+
+    Arguments:
+        partial_summary(dict): The partial summary to update.
+        other_partial_summary(dict): The partial summary to add.
+    Returns:
+        The updated partial_summary.
+    """
+
+    for name, statistic in STATISTIC_REGISTRY.items():
+        partial_summary[name] = statistic.merge(partial_summary[name], other_partial_summary[name])
+
+    return partial_summary
+
+def finalize_summary(partial_summary):
+    """Converts a partial summary into summary statistics.
+
+    Arguments:
+        partial_summary(dict): A partial summary as returned by init_summary.
+    Returns:
+        A dictionary of summary statistics as returned by summarize.
+    """
+
+    return {name: statistic.finalize(partial_summary[name]) for name, statistic in STATISTIC_REGISTRY.items()}
+
 def summarize(metadata):
     """Generates summary statistics for DICOM metadata.
 
+    Makes a single pass over the metadata, so metadata can be
+    any iterable of rows, such as a generator streaming rows
+    from disk.
+
     Arguments:
-        metadata(list): An array of metadata containing
-            DICOM metadata.
+        metadata(iterable or pd.DataFrame): An iterable of metadata
+            containing DICOM metadata, or a DataFrame of columnar
+            DICOM metadata which is summarized column-wise.
     Returns:
-        A dictionary of summary statistics containing:
+        A dictionary mapping the name of each statistic in
+        STATISTIC_REGISTRY to its value, including:
         'years': A dictionary mapping year to number of
             DICOMs from that year.
         'num_dicoms_to_count': A dictionary mapping n,
@@ -66,15 +312,88 @@ def summarize(metadata):
             which contain n DICOMs.
     """
 
-    dicom_metadata = [row['dicom_metadata'] for row in metadata]
+    partial_summary = init_summary()
+
+    if isinstance(metadata, pd.DataFrame):
+        update_summary_columns(partial_summary, metadata)
+    else:
+        for row in metadata:
+            update_summary(partial_summary, row['dicom_metadata'])
+
+    return finalize_summary(partial_summary)
+
+def get_summary_shards(metadata_paths, shard_size=DEFAULT_SHARD_SIZE):
+    """Splits metadata into shards which can be summarized independently.
+
+    Uncompressed JSON Lines files are split into byte ranges of about
+    shard_size bytes, columnar datasets into their Parquet files and
+    other files (JSON lists and compressed JSON Lines) are one shard each.
+
+    Arguments:
+        metadata_paths(list): Paths to DICOM metadata JSON or JSON Lines
+            files or to columnar (Parquet) metadata directories.
+        shard_size(int): Approximate number of bytes per JSON Lines shard.
+    Returns:
+        A list of shards, tuples of (path, start, end) where start and end
+        are byte offsets for JSON Lines ranges and None otherwise.
+    """
+
+    shards = []
+    for metadata_path in metadata_paths:
+        if os.path.isdir(metadata_path):
+            shards.extend((fragment_path, None, None) for fragment_path in get_columnar_fragments(metadata_path))
+        elif metadata_path.endswith('.jsonl'):
+            shards.extend((metadata_path, start, end) for start, end in get_json_lines_ranges(metadata_path, shard_size))
+        else:
+            shards.append((metadata_path, None, None))
+
+    return shards
+
+def summarize_shard(shard):
+    """Computes the partial summary of one shard.
+
+    Rows are streamed from disk and Parquet files are read in batches,
+    so only the partial summary is held in memory.
+
+    Arguments:
+        shard(tuple): A shard as returned by get_summary_shards.
+    Returns:
+        A partial summary as returned by init_summary.
+    """
+
+    path, start, end = shard
+    partial_summary = init_summary()
+
+    if path.endswith('.parquet'):
+        for metadata_frame in read_columnar_fragment(path, columns=SUMMARY_COLUMNS):
+            update_summary_columns(partial_summary, metadata_frame)
+    else:
+        rows = read_metadata(path) if start is None else read_metadata_range(path, start, end)
+        for row in rows:
+            update_summary(partial_summary, row['dicom_metadata'])
+
+    return partial_summary
+
+def summarize_paths(metadata_paths, shard_size=DEFAULT_SHARD_SIZE, num_cpus=None):
+    """Generates summary statistics for metadata files using a process pool.
+
+    The metadata is split into shards whose partial summaries are
+    computed in parallel and merged.
+
+    Arguments:
+        metadata_paths(list): Paths to DICOM metadata JSON or JSON Lines
+            files or to columnar (Parquet) metadata directories.
+        shard_size(int): Approximate number of bytes per JSON Lines shard.
+        num_cpus(int): Number of worker processes. Defaults to the number of CPUs.
+    Returns:
+        A dictionary of summary statistics as returned by summarize.
+    """
+
+    shards = get_summary_shards(metadata_paths, shard_size)
+    kwargs = {} if num_cpus is None else {'num_cpus': num_cpus}
 
-    summary = {
-        'num_dicoms_to_count': get_num_dicoms_to_count(dicom_metadata),
-        'pixel_intensity_relationships': get_count(dicom_metadata, 'PixelIntensityRelationship'),
-        'years': get_years(dicom_metadata),
-        'sop_class_uids': get_count(dicom_metadata, 'SOPClassUID'),
-        'modality': get_count(dicom_metadata, 'Modality'),
-        'study_description': get_count(dicom_metadata, 'StudyDescription')
-    }
+    partial_summary = init_summary()
+    for other_partial_summary in p_umap(summarize_shard, shards, **kwargs):
+        merge_summaries(partial_summary, other_partial_summary)
 
-    return summary
+    return finalize_summary(partial_summary)
@@ -0,0 +1,149 @@
+"""Detection of DICOMs which are copies of the same instance, so that each instance is converted once.
+
+Archives hold the same instance under several paths after re-exports and
+copies. Every DICOM is keyed by its SOPInstanceUID, which is read from the
+first few kilobytes of the file, or, if it has none, by a streaming hash of
+its raw pixel data bytes, which are never decoded. With verify_pixels the
+pixel hash is added to every key, so that different images which share a
+SOPInstanceUID are not merged. The DICOMs with the same key are duplicates:
+the first path in sorted order is the canonical source of the instance and
+the duplicate map sends every other path to it.
+
+Duplicates are not converted. They get the outputs of their canonical DICOM,
+and if the canonical DICOM was not converted they are reported with its
+outcome.
+"""
+
+import json
+import os
+
+from pydicom.datadict import tag_for_keyword
+
+from oncodata.dicom_to_png.dicom_file import DicomFile
+from oncodata.dicom_to_png.manifest import FAILED, NOT_SELECTED
+from oncodata.dicom_to_png.pyramid import get_pyramid_names, get_pyramid_path
+from oncodata.dicom_to_png.selection import read_tags
+
+DUPLICATE_MAP_SUFFIX = '.duplicates.json'
+SOP_INSTANCE_UID_TAGS = [tag_for_keyword('SOPInstanceUID')]
+
+
+def get_instance_key(dicom_path, verify_pixels=False):
+    """Gets the key which identifies the instance stored in a DICOM.
+
+    Arguments:
+        dicom_path(str): The path to a dicom file.
+        verify_pixels(bool): True to also hash the pixel data of DICOMs which
+            have a SOPInstanceUID.
+    Returns:
+        A dictionary with the 'dicom_path', its 'key', e.g. 'uid:1.2.3' or
+        'pixels:<sha1>', or None if it could not be read, and the 'error' if
+        it could not be read.
+    """
+
+    row = {'dicom_path': dicom_path, 'key': None, 'error': None}
+
+    try:
+        sop_instance_uid = str(read_tags(dicom_path, SOP_INSTANCE_UID_TAGS).get('SOPInstanceUID', '') or '')
+        if sop_instance_uid and not verify_pixels:
+            row['key'] = 'uid:{}'.format(sop_instance_uid)
+        else:
+            with DicomFile(dicom_path) as dicom_file:
+                pixels_key = 'pixels:{}'.format(dicom_file.hash_pixel_data())
+            row['key'] = 'uid:{}:{}'.format(sop_instance_uid, pixels_key) if sop_instance_uid else pixels_key
+    except Exception as e:
+        row['error'] = str(e)
+
+    return row
+
+
+def find_duplicates(rows):
+    """Finds the DICOMs which are duplicates of another DICOM.
+
+    Arguments:
+        rows(iterable): Rows returned by get_instance_key. DICOMs which could
+            not be read are never duplicates.
+    Returns:
+        A dictionary from the path of every duplicate DICOM to the path of the
+        canonical DICOM of its instance.
+    """
+
+    paths_by_key = {}
+    for row in rows:
+        if row['key'] is not None:
+            paths_by_key.setdefault(row['key'], []).append(row['dicom_path'])
+
+    duplicate_map = {}
+    for dicom_paths in paths_by_key.values():
+        canonical_path, *duplicate_paths = sorted(dicom_paths)
+        for duplicate_path in duplicate_paths:
+            duplicate_map[duplicate_path] = canonical_path
+
+    return duplicate_map
+
+
+def write_duplicate_map(duplicate_map, map_path):
+    """Saves a duplicate map as JSON, sorted by duplicate path."""
+
+    with open(map_path, 'w') as map_file:
+        json.dump(duplicate_map, map_file, indent=4, sort_keys=True)
+
+
+def read_duplicate_map(map_path):
+    """Loads a duplicate map saved by write_duplicate_map."""
+
+    with open(map_path, 'r') as map_file:
+        return json.load(map_file)
+
+
+def get_output_pairs(source_path, dest_path, pyramid=None):
+    """Gets the outputs of a canonical DICOM and the paths of the same outputs of a duplicate.
+
+    Arguments:
+        source_path(str): The output of the canonical DICOM: an image, or a
+            directory of frames.
+        dest_path(str): The output of the duplicate DICOM.
+        pyramid(dict): Optional downsampling 'factors' and 'thumbnail_sizes'
+            of the levels saved next to each image.
+    Returns:
+        A list of (source, dest) path tuples of every file which exists, i.e.
+        the image and its pyramid levels or every frame, or an empty list if
+        the canonical DICOM has no output.
+    """
+
+    if os.path.isdir(source_path):
+        return [(os.path.join(source_path, name), os.path.join(dest_path, name))
+                for name in sorted(os.listdir(source_path))]
+    if not os.path.isfile(source_path):
+        return []
+
+    pairs = [(source_path, dest_path)]
+    for name in get_pyramid_names(**(pyramid or {})):
+        level_path = get_pyramid_path(source_path, name)
+        if os.path.isfile(level_path):
+            pairs.append((level_path, get_pyramid_path(dest_path, name)))
+
+    return pairs
+
+
+def report_duplicates(rows, duplicate_map):
+    """Adds a row for every duplicate of a DICOM which was not converted, with the outcome of that DICOM.
+
+    Arguments:
+        rows(iterable): Rows returned by convert_and_record.
+        duplicate_map(dict): A dictionary from duplicate to canonical DICOM path.
+    Returns:
+        A generator of the rows and, after the row of each canonical DICOM
+        which was rejected or failed, a row for each of its duplicates.
+    """
+
+    duplicates = {}
+    for duplicate_path, canonical_path in duplicate_map.items():
+        duplicates.setdefault(canonical_path, []).append(duplicate_path)
+
+    for row in rows:
+        yield row
+        if row['status'] in (NOT_SELECTED, FAILED):
+            for duplicate_path in sorted(duplicates.get(row['source_path'], [])):
+                yield dict(row, source_path=duplicate_path, image_path=None,
+                           error='Duplicate of {}: {}'.format(row['source_path'], row['error'] or row['reason']))
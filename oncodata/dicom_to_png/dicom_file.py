@@ -0,0 +1,175 @@
+"""A DICOM file whose header is parsed once and whose pixel data is read lazily."""
+
+import hashlib
+import io
+
+import pydicom
+from pydicom.filereader import read_dataset
+from pydicom.uid import DeflatedExplicitVRLittleEndian
+
+try:
+    from pydicom.pixels import iter_pixels
+except ImportError:
+    iter_pixels = None
+
+HASH_BLOCK_SIZE = 2 ** 20
+
+
+class CountingFileIO(io.FileIO):
+    """A raw file which counts the number of bytes read from disk."""
+
+    bytes_read = 0
+
+    def readinto(self, buffer):
+        num_bytes = super().readinto(buffer)
+        self.bytes_read += num_bytes or 0
+        return num_bytes
+
+    def readall(self):
+        data = super().readall()
+        self.bytes_read += len(data)
+        return data
+
+
+class DicomFile(object):
+    """Parses the header of a DICOM once and loads its pixel data only when needed.
+
+    The header is read with stop_before_pixels=True and can be shared by
+    selection, routing and conversion. Accessing dicom_data reads the
+    remaining elements (including the pixel data) continuing from where
+    the header ended, so no byte of the file is read twice.
+
+    Use as a context manager so that the underlying file is closed:
+
+        with DicomFile(dicom_path) as dicom_file:
+            if is_selected_dicom_file(dicom_file, selection_criteria):
+                pixels = dicom_file.dicom_data.pixel_array
+    """
+
+    def __init__(self, dicom_path):
+        """Creates a DICOM file without opening or reading it.
+
+        Arguments:
+            dicom_path(str): The path to a dicom file.
+        """
+
+        self.dicom_path = dicom_path
+        self._raw_file = None
+        self._file = None
+        self._header = None
+        self._has_pixels = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Closes the underlying file."""
+
+        if self._file is not None:
+            self._file.close()
+
+    @property
+    def bytes_read(self):
+        """The number of bytes read from disk so far."""
+
+        return self._raw_file.bytes_read if self._raw_file is not None else 0
+
+    @property
+    def header(self):
+        """The dataset without pixel data, read on first access.
+
+        Raises:
+            OSError if the file cannot be opened.
+            InvalidDicomError if the dicom file cannot be read.
+        """
+
+        if self._header is None:
+            self._raw_file = CountingFileIO(self.dicom_path, 'rb')
+            self._file = io.BufferedReader(self._raw_file)
+            self._header = pydicom.dcmread(self._file, stop_before_pixels=True)
+
+        return self._header
+
+    @property
+    def dicom_data(self):
+        """The full dataset including pixel data, read on first access.
+
+        Raises:
+            InvalidDicomError if the dicom file cannot be read.
+        """
+
+        header = self.header
+        if self._has_pixels:
+            return header
+
+        transfer_syntax = header.file_meta.get('TransferSyntaxUID', None)
+        if transfer_syntax is None or transfer_syntax == DeflatedExplicitVRLittleEndian:
+            # The dataset is not stored as plain elements after the header, so start over
+            self._file.seek(0)
+            self._header = header = pydicom.dcmread(self._file)
+        else:
+            # dcmread leaves the file positioned at the start of the pixel data element
+            remaining_data = read_dataset(self._file, transfer_syntax.is_implicit_VR, transfer_syntax.is_little_endian)
+            for data_element in remaining_data:
+                header[data_element.tag] = data_element
+        self._has_pixels = True
+
+        return header
+
+    def iter_frames(self, indices=None):
+        """Decodes the frames of the pixel data one at a time.
+
+        With pydicom 3 only the bytes of each requested frame are read and
+        decoded, so at most one frame is held in memory even for volumes of
+        several GB. Older versions of pydicom decode the whole pixel data first.
+
+        Arguments:
+            indices(iterable): Indices of the frames to decode, or None for all frames.
+        Returns:
+            A generator of (index, frame) tuples where each frame is a 2D array
+            of stored pixel values.
+        Raises:
+            InvalidDicomError if the dicom file cannot be read.
+        """
+
+        header = self.header
+        num_frames = int(header.get('NumberOfFrames', 1) or 1)
+        indices = list(range(num_frames)) if indices is None else [i for i in indices if 0 <= i < num_frames]
+
+        if iter_pixels is None or self._has_pixels:
+            pixels = self.dicom_data.pixel_array
+            for index in indices:
+                yield index, pixels if num_frames == 1 else pixels[index]
+            return
+
+        self._file.seek(0)
+        for index, frame in zip(indices, iter_pixels(self._file, indices=indices)):
+            yield index, frame
+
+    def hash_pixel_data(self):
+        """Hashes the raw bytes of the pixel data, streamed in blocks without decoding them.
+
+        The hash covers every byte after the header, i.e. the pixel data element
+        and any element after it, so copies of an instance with edited headers
+        have the same hash. DICOMs whose dataset is deflated are hashed whole.
+        The file is read to its end, so dicom_data cannot be read afterwards.
+
+        Returns:
+            The hex digest of the SHA-1 hash.
+        Raises:
+            InvalidDicomError if the dicom file cannot be read.
+        """
+
+        header = self.header
+        transfer_syntax = header.file_meta.get('TransferSyntaxUID', None)
+        if self._has_pixels or transfer_syntax is None or transfer_syntax == DeflatedExplicitVRLittleEndian:
+            self._file.seek(0)
+
+        sha1 = hashlib.sha1()
+        for block in iter(lambda: self._file.read(HASH_BLOCK_SIZE), b''):
+            sha1.update(block)
+
+        return sha1.hexdigest()
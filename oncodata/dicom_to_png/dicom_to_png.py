@@ -1,18 +1,41 @@
-"""Functions to confirm DICOM image correctness and then convert DICOMs to 16-bit PNGs using either dcmtk or Matlab."""
+"""Functions to confirm DICOM image correctness and then convert DICOMs to 16-bit PNGs using either dcmtk, NumPy or Matlab."""
 
+from functools import partial
 import os
 from subprocess import Popen, CalledProcessError, check_output
 from tempfile import NamedTemporaryFile
-import pydicom
 
 import numpy as np
 from p_tqdm import p_map, p_umap
 
+from oncodata.dicom_to_png.dicom_file import DicomFile
 from oncodata.dicom_to_png.get_slice_count import get_slice_count
+from oncodata.utils.files import atomic_output_dir, atomic_output_path
+from oncodata.dicom_to_png.png import encode_png
+from oncodata.dicom_to_png.pyramid import get_pyramid_path, iter_pyramid
+from oncodata.dicom_to_png.selection import get_rejection_reason, get_selection_tags, read_tags, select_dicom
+from oncodata.dicom_to_png import windowing
+from oncodata.utils.timing import add_stage, stage
 
 DEFAULT_WINDOW_LEVEL = '540'
 DEFAULT_WINDOW_WIDTH = '580'
 
+
+class DicomRejectedError(Exception):
+    """Raised by the converters when a dicom is not converted because it does
+    not fit the selection criteria, has several slices or cannot be read.
+
+    Attributes:
+        reason(str): A short machine readable reason, such as 'wrong_Modality'.
+        detail(str): A human readable explanation.
+    """
+
+    def __init__(self, reason, detail=''):
+        super(DicomRejectedError, self).__init__('{}: {}'.format(reason, detail))
+        self.reason = reason
+        self.detail = detail
+
+
 def has_one_slice(dicom_path):
     '''Checks if dicom has one splice.
 
@@ -20,21 +43,17 @@ def has_one_slice(dicom_path):
         dicom_path(str): The path to a dicom files.
 
     Returns:
-        True if mammogram has one slice, false otherwise.
+        True if mammogram has one slice, false otherwise (including
+        if the number of slices cannot be determined).
     '''
     try:
-        if get_slice_count(dicom_path) != 1:
-            print('Mammogram must only have one slice.')
-            return False
-    except Exception as e:
-        print(e)
+        return get_slice_count(dicom_path) == 1
+    except Exception:
         return False
 
-    return True
-
 
 def is_selected_dicom(dicom_path, selection_criteria):
-    '''Checks if dicom fits the selection criteria.
+    '''Checks if dicom fits the selection criteria, reading only the tags named in the criteria.
 
     Arguments:
         dicom_path(str): The path to a dicom files.
@@ -45,26 +64,76 @@ def is_selected_dicom(dicom_path, selection_criteria):
         is provided, returns true for all readable dicoms.
     '''
 
+    return select_dicom(dicom_path, selection_criteria, verbose=False)
+
+
+def is_convertible_dicom(dicom_path, selection_criteria):
+    '''Checks if dicom fits the selection criteria and has one slice.
+
+    Arguments:
+        dicom_path(str): The path to a dicom files.
+        selection_criteria (set): set of dictionaries where each dictionary describes a set of key:value selection criteria.
+
+    Returns:
+        True if the dicom can be converted.
+    '''
+
+    return is_selected_dicom(dicom_path, selection_criteria) and has_one_slice(dicom_path)
+
+
+def check_selected_dicom_file(dicom_file, selection_criteria):
+    '''Checks that an opened dicom fits the selection criteria using only its header.
+
+    Arguments:
+        dicom_file(DicomFile): An opened dicom file.
+        selection_criteria (set): set of dictionaries where each dictionary describes a set of key:value selection criteria.
+
+    Raises:
+        DicomRejectedError if the header cannot be read or does not meet any set of selection criteria.
+    '''
+
     try:
-        dicom_data = pydicom.dcmread(dicom_path)
+        with stage('header'):
+            dicom_data = dicom_file.header
     except Exception as e:
-        print(e)
-        return False
+        raise DicomRejectedError('unreadable', str(e))
+    add_stage('header', num_bytes=dicom_file.bytes_read)
 
-    # If no selection criteria provided, return True for any readable dicom
-    if len(selection_criteria) == 0: return True
-    for criteria in selection_criteria:
-        match = True
-        for key in criteria.keys():
-            target_val = criteria[key]
-            dicom_val = str(dicom_data.get(key, None))
-            if dicom_val != target_val:
-                print('{} wrong type. Got "{}" instead of "{}".'.format(key, dicom_val, target_val))
-                match = False
-        if match:
-            return True
+    with stage('select'):
+        rejection = get_rejection_reason(dicom_data, selection_criteria)
+    if rejection is not None:
+        raise DicomRejectedError(*rejection)
 
-    return False
+
+def check_convertible_dicom(dicom_path, selection_criteria):
+    '''Checks that a dicom fits the selection criteria and has one slice.
+
+    Arguments:
+        dicom_path(str): The path to a dicom files.
+        selection_criteria (set): set of dictionaries where each dictionary describes a set of key:value selection criteria.
+
+    Raises:
+        DicomRejectedError if the dicom cannot be converted.
+    '''
+
+    try:
+        with stage('header'):
+            dicom_data = read_tags(dicom_path, get_selection_tags(selection_criteria))
+    except Exception as e:
+        raise DicomRejectedError('unreadable', str(e))
+
+    with stage('select'):
+        rejection = get_rejection_reason(dicom_data, selection_criteria)
+    if rejection is not None:
+        raise DicomRejectedError(*rejection)
+
+    try:
+        with stage('slice_count'):
+            num_slices = get_slice_count(dicom_path)
+    except Exception as e:
+        raise DicomRejectedError('unknown_slice_count', str(e))
+    if num_slices != 1:
+        raise DicomRejectedError('multiple_slices', 'Mammogram must only have one slice, got {}.'.format(num_slices))
 
 
 def create_directory_if_necessary(path):
@@ -90,34 +159,351 @@ def dicom_to_png_dcmtk(dicom_path, image_path, selection_criteria={}, skip_exist
         image_path(str): The path where the image will be saved.
         selection_criteria (list or tuple): list or tuple of dictionaries where each dictionary describes a set of key:value selection criteria.
         skip_existing(bool): True to skip images which already exist.
+
+    Returns:
+        None if the image already exists, otherwise a dictionary with the
+        'bytes_read' from the dicom file, its 'sop_instance_uid' and a
+        'warning' if the conversion fell back to another window.
+    Raises:
+        DicomRejectedError if the dicom does not fit the selection criteria.
+        CalledProcessError if dcmj2pnm fails, in which case no image is written.
     """
 
     if skip_existing and os.path.exists(image_path):
         return
 
-    # Ensure dicom  fits the selection criteria and only has one slice
-    if not (is_selected_dicom(dicom_path, selection_criteria)):
-        return
+    # Ensure dicom fits the selection criteria. Routing only needs the header,
+    # so the pixel data is left for dcmj2pnm to read.
+    with DicomFile(dicom_path) as dicom_file:
+        check_selected_dicom_file(dicom_file, selection_criteria)
+        manufacturer = str(dicom_file.header.get('Manufacturer', ''))
+        series = str(dicom_file.header.get('SeriesDescription', ''))
+        sop_instance_uid = str(dicom_file.header.get('SOPInstanceUID', ''))
+        bytes_read = dicom_file.bytes_read + os.path.getsize(dicom_path)
 
     # Create directory for image if necessary
     create_directory_if_necessary(image_path)
 
     # Convert DICOM to PNG using dcmj2pnm (support.dcmtk.org/docs/dcmj2pnm.html)
-    # from dcmtk library (dicom.offis.de/dcmtk.php.en)
-    dcm_file = pydicom.dcmread(dicom_path)
-    manufacturer = dcm_file.Manufacturer
-    series = dcm_file.SeriesDescription
-    if 'GE' in manufacturer:
-        try:
-            check_output(['dcmj2pnm', '+on2', '--use-voi-lut', '1', dicom_path, image_path])
-        except CalledProcessError:
-            print(f"{dicom_path}: No LUT found. Will use sigmoid transformation instead.")
-            Popen(['dcmj2pnm', '+on2', '--sigmoid-function', '--use-window', '1', dicom_path, image_path]).wait()
+    # from dcmtk library (dicom.offis.de/dcmtk.php.en). dcmj2pnm writes to a
+    # temporary file which is only renamed to image_path once it is complete.
+    # Decoding, windowing, encoding and writing all happen in dcmj2pnm, so
+    # they are timed as a single stage.
+    warning = None
+    header_bytes = bytes_read - os.path.getsize(dicom_path)
+    with stage('dcmj2pnm'), atomic_output_path(image_path) as temp_path:
+        if 'GE' in manufacturer:
+            try:
+                check_output(['dcmj2pnm', '+on2', '--use-voi-lut', '1', dicom_path, temp_path])
+            except CalledProcessError:
+                warning = 'No LUT found. Used sigmoid transformation instead.'
+                bytes_read += os.path.getsize(dicom_path)
+                check_output(['dcmj2pnm', '+on2', '--sigmoid-function', '--use-window', '1', dicom_path, temp_path])
+
+        elif 'C-View' in series:
+            check_output(['dcmj2pnm', '+on2', '+Ww', DEFAULT_WINDOW_LEVEL, DEFAULT_WINDOW_WIDTH, dicom_path, temp_path])
+        else:
+            check_output(['dcmj2pnm', '+on2', '--min-max-window', dicom_path, temp_path])
+    add_stage('dcmj2pnm', num_bytes=bytes_read - header_bytes)
+
+    return {'bytes_read': bytes_read, 'sop_instance_uid': sop_instance_uid, 'warning': warning}
+
+
+def window_dicom(dicom_data):
+    """Decodes and windows the pixels of a dicom the same way dicom_to_png_dcmtk does.
+
+    GE images use their first VOI LUT (falling back to a sigmoid of their first
+    window), C-View images use the default window and all other images use
+    a min-max window.
+
+    Arguments:
+        dicom_data(Dataset): A pydicom dataset including pixel data.
+
+    Returns:
+        A 2D uint16 array.
+    """
+
+    return window_pixels(dicom_data, dicom_data.pixel_array)
+
+
+def uses_min_max_window(dicom_data):
+    """Checks if window_pixels windows the pixels of a dicom with their min-max window rather than a window of the dataset."""
+
+    manufacturer = str(dicom_data.get('Manufacturer', ''))
+    series = str(dicom_data.get('SeriesDescription', ''))
+    has_ge_window = 'VOILUTSequence' in dicom_data or ('WindowCenter' in dicom_data and 'WindowWidth' in dicom_data)
+
+    return not ('GE' in manufacturer and has_ge_window) and 'C-View' not in series
 
+
+def window_pixels(dicom_data, pixels, min_max_window=None):
+    """Windows decoded pixels, such as one frame of a multi-frame dicom, as window_dicom does.
+
+    Arguments:
+        dicom_data(Dataset): The pydicom dataset the pixels come from, which
+            need not include the pixel data.
+        pixels(np.ndarray): The stored pixel values.
+        min_max_window(tuple): Optional (center, width) used instead of the
+            min-max window of the pixels, e.g. the min-max window of every
+            frame of a volume.
+
+    Returns:
+        A uint16 array of the same shape as pixels.
+    """
+
+    pixels = windowing.apply_modality_lut(dicom_data, pixels)
+    manufacturer = str(dicom_data.get('Manufacturer', ''))
+    series = str(dicom_data.get('SeriesDescription', ''))
+
+    if 'GE' in manufacturer and 'VOILUTSequence' in dicom_data:
+        windowed = windowing.apply_voi_lut(pixels, dicom_data.VOILUTSequence[0])
+    elif 'GE' in manufacturer and 'WindowCenter' in dicom_data and 'WindowWidth' in dicom_data:
+        windowed = windowing.apply_sigmoid_window(pixels,
+                                                  windowing.get_first_value(dicom_data.WindowCenter),
+                                                  windowing.get_first_value(dicom_data.WindowWidth))
     elif 'C-View' in series:
-        Popen(['dcmj2pnm', '+on2', '+Ww', DEFAULT_WINDOW_LEVEL, DEFAULT_WINDOW_WIDTH, dicom_path, image_path]).wait()
+        windowed = windowing.apply_linear_window(pixels, float(DEFAULT_WINDOW_LEVEL), float(DEFAULT_WINDOW_WIDTH))
     else:
-        Popen(['dcmj2pnm', '+on2', '--min-max-window', dicom_path, image_path]).wait()
+        windowed = windowing.apply_linear_window(pixels, *(min_max_window or windowing.get_min_max_window(pixels)))
+
+    return windowing.round_to_output(windowing.apply_presentation(dicom_data, windowed))
+
+
+def read_windowed_dicom(dicom_path, selection_criteria={}):
+    """Reads a dicom and decodes and windows its pixels if it fits the selection criteria.
+
+    Arguments:
+        dicom_path(str): The path to the dicom file.
+        selection_criteria (list or tuple): list or tuple of dictionaries where each dictionary describes a set of key:value selection criteria.
+
+    Returns:
+        A tuple (image, header, bytes_read) with the windowed 2D uint16 image,
+        the dataset without pixel data and the number of bytes read.
+    Raises:
+        DicomRejectedError if the dicom does not fit the selection criteria
+        or has several frames.
+    """
+
+    # The header is parsed once for selection and the pixel data is
+    # only read for single frame dicoms which fit the selection criteria
+    with DicomFile(dicom_path) as dicom_file:
+        check_selected_dicom_file(dicom_file, selection_criteria)
+        num_frames = int(dicom_file.header.get('NumberOfFrames', 1) or 1)
+        if num_frames != 1:
+            raise DicomRejectedError('multiple_slices',
+                                     'Mammogram must only have one slice, got {}.'.format(num_frames))
+        header_bytes = dicom_file.bytes_read
+        with stage('decode'):
+            dicom_data = dicom_file.dicom_data
+            # The decoded pixels are cached for window_dicom
+            dicom_data.pixel_array
+        add_stage('decode', num_bytes=dicom_file.bytes_read - header_bytes)
+        with stage('window'):
+            image = window_dicom(dicom_data)
+
+        return image, dicom_file.header, dicom_file.bytes_read
+
+
+def write_png_atomic(image, image_path, png_options=None):
+    """Encodes an image and writes it atomically to a png, timing the encode and write stages.
+
+    Arguments:
+        image(np.ndarray): A 2D uint16 image.
+        image_path(str): The path where the image will be saved.
+        png_options(dict): Optional compression_level, png_filter, strategy
+            and num_threads of encode_png.
+    """
+
+    with stage('encode'):
+        png_data = encode_png(image, **(png_options or {}))
+
+    with stage('write'), atomic_output_path(image_path) as temp_path:
+        with open(temp_path, 'wb') as image_file:
+            image_file.write(png_data)
+    add_stage('write', num_bytes=len(png_data))
+
+
+def dicom_to_png_numpy(dicom_path, image_path, selection_criteria={}, skip_existing=True, return_image=False,
+                       png_options=None, pyramid=None, return_png=False):
+    """Converts a dicom image to a grayscale 16-bit png image in-process using pydicom and NumPy.
+
+    Produces the same images as dicom_to_png_dcmtk without starting a dcmj2pnm process per file.
+
+    Arguments:
+        dicom_path(str): The path to the dicom file.
+        image_path(str): The path where the image will be saved, or None to
+            only return the image.
+        selection_criteria (list or tuple): list or tuple of dictionaries where each dictionary describes a set of key:value selection criteria.
+        skip_existing(bool): True to skip images which already exist.
+        return_image(bool): True to also return the windowed image, e.g. to
+            write it to a shard.
+        png_options(dict): Optional compression_level, png_filter, strategy
+            and num_threads of encode_png.
+        pyramid(dict): Optional 'factors' and 'thumbnail_sizes' of iter_pyramid.
+            Each level is computed from the decoded image and saved next to
+            the image, e.g. image_x2.png and image_thumb256.png, before the
+            image itself, so an existing image implies existing levels.
+        return_png(bool): True to return the encoded 'png_data' instead of
+            saving it, e.g. to pack it into an exam bundle. image_path must be None.
+
+    Returns:
+        None if the image already exists, otherwise a dictionary with the
+        'bytes_read' from the dicom file and its 'sop_instance_uid', and
+        if return_image is True its windowed 'image', or if return_png is
+        True its 'png_data', and its 'accession_number'.
+    Raises:
+        DicomRejectedError if the dicom does not fit the selection criteria
+        or has several frames.
+        ValueError if the decoded image is not 2D, e.g. a color image.
+    """
+
+    if skip_existing and image_path is not None and os.path.exists(image_path):
+        return
+
+    image, header, bytes_read = read_windowed_dicom(dicom_path, selection_criteria)
+    if image.ndim != 2:
+        raise ValueError('Expected a 2D image, got {} dimensions.'.format(image.ndim))
+    result = {'bytes_read': bytes_read, 'sop_instance_uid': str(header.get('SOPInstanceUID', '')), 'warning': None}
+    if return_image:
+        result['image'] = image
+    if return_image or return_png:
+        result['accession_number'] = str(header.get('AccessionNumber', ''))
+
+    if image_path is None:
+        if return_png:
+            with stage('encode'):
+                result['png_data'] = encode_png(image, **(png_options or {}))
+        return result
+
+    # Create directory for image if necessary
+    create_directory_if_necessary(image_path)
+
+    if pyramid:
+        levels = iter_pyramid(image, **pyramid)
+        while True:
+            with stage('downsample'):
+                level = next(levels, None)
+            if level is None:
+                break
+            name, level_image = level
+            write_png_atomic(level_image, get_pyramid_path(image_path, name), png_options)
+
+    write_png_atomic(image, image_path, png_options)
+
+    return result
+
+
+def get_frames_window(dicom_file, indices):
+    """Computes the min-max window of the frames of a dicom in a first pass which decodes one frame at a time.
+
+    Arguments:
+        dicom_file(DicomFile): An opened dicom file.
+        indices(iterable): Indices of the frames.
+    Returns:
+        A tuple (center, width).
+    """
+
+    min_value = max_value = None
+    with stage('window'):
+        for _, pixels in dicom_file.iter_frames(indices):
+            pixels = windowing.apply_modality_lut(dicom_file.header, pixels)
+            min_value = pixels.min() if min_value is None else min(min_value, pixels.min())
+            max_value = pixels.max() if max_value is None else max(max_value, pixels.max())
+
+    return windowing.get_min_max_window(np.array([min_value, max_value]))
+
+
+def iter_windowed_frames(dicom_file, indices):
+    """Decodes and windows the frames of a dicom one at a time.
+
+    Every frame is windowed with the same window, so that the frames of a
+    volume share one intensity scale. Dicoms windowed with their min-max
+    window are decoded twice, first to find the min-max window of all the
+    frames.
+
+    Arguments:
+        dicom_file(DicomFile): An opened dicom file.
+        indices(iterable): Indices of the frames.
+    Returns:
+        A generator of (index, frame) tuples where each frame is a 2D uint16 array.
+    """
+
+    min_max_window = get_frames_window(dicom_file, indices) if uses_min_max_window(dicom_file.header) else None
+    frames = dicom_file.iter_frames(indices)
+    while True:
+        with stage('decode'):
+            item = next(frames, None)
+        if item is None:
+            return
+        index, pixels = item
+        with stage('window'):
+            windowed = window_pixels(dicom_file.header, pixels, min_max_window)
+        yield index, windowed
+
+
+def dicom_to_frames_numpy(dicom_path, image_path, selection_criteria={}, skip_existing=True, frame_range=None,
+                          png_options=None):
+    """Converts every frame, or a range of frames, of a dicom such as a tomosynthesis volume.
+
+    Frames are decoded, windowed and written one at a time, so memory stays
+    at about one frame even for volumes of several GB. Single frame dicoms
+    are written as a single frame.
+
+    Arguments:
+        dicom_path(str): The path to the dicom file.
+        image_path(str): A directory where each frame is saved as a 16-bit png
+            named by its index, or a path ending in '.npy' where the frames
+            are saved as one (frames, rows, columns) uint16 volume.
+        selection_criteria (list or tuple): list or tuple of dictionaries where each dictionary describes a set of key:value selection criteria.
+        skip_existing(bool): True to skip outputs which already exist.
+        frame_range(tuple): Optional (start, stop) indices of the frames to convert.
+        png_options(dict): Optional compression_level, png_filter, strategy
+            and num_threads of encode_png.
+
+    Returns:
+        None if the output already exists, otherwise a dictionary with the
+        'bytes_read' from the dicom file, its 'sop_instance_uid' and the
+        'num_frames' converted.
+    Raises:
+        DicomRejectedError if the dicom does not fit the selection criteria or has no frames in frame_range.
+    """
+
+    if skip_existing and os.path.exists(image_path):
+        return
+
+    with DicomFile(dicom_path) as dicom_file:
+        check_selected_dicom_file(dicom_file, selection_criteria)
+        header = dicom_file.header
+        num_frames = int(header.get('NumberOfFrames', 1) or 1)
+        start, stop = frame_range if frame_range is not None else (0, num_frames)
+        indices = range(max(0, start), min(num_frames, stop))
+        if len(indices) == 0:
+            raise DicomRejectedError('no_frames', 'No frames in range {} of {} frames.'.format(frame_range, num_frames))
+
+        # Create directory for image if necessary
+        create_directory_if_necessary(image_path)
+
+        if image_path.endswith('.npy'):
+            with atomic_output_path(image_path) as temp_path:
+                volume = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.uint16,
+                                                   shape=(len(indices), int(header.Rows), int(header.Columns)))
+                for i, (_, frame) in enumerate(iter_windowed_frames(dicom_file, indices)):
+                    with stage('write'):
+                        volume[i] = frame
+                volume.flush()
+                del volume
+        else:
+            with atomic_output_dir(image_path) as temp_dir:
+                for index, frame in iter_windowed_frames(dicom_file, indices):
+                    with stage('encode'):
+                        png_data = encode_png(frame, **(png_options or {}))
+                    with stage('write'):
+                        with open(os.path.join(temp_dir, '{:04d}.png'.format(index)), 'wb') as image_file:
+                            image_file.write(png_data)
+                    add_stage('write', num_bytes=len(png_data))
+
+        return {'bytes_read': dicom_file.bytes_read, 'sop_instance_uid': str(header.get('SOPInstanceUID', '')),
+                'warning': None, 'num_frames': len(indices)}
 
 
 def dicom_to_png_imagemagick(dicom_path, image_path, selection_criteria, skip_existing=True):
@@ -128,19 +514,46 @@ def dicom_to_png_imagemagick(dicom_path, image_path, selection_criteria, skip_ex
         image_path(str): The path where the image will be saved.
         selection_criteria (list or tuple): list or tuple of dictionaries where each dictionary describes a set of key:value selection criteria.
         skip_existing(bool): True to skip images which already exist.
+
+    Returns:
+        None if the image already exists, otherwise a dictionary with the
+        'bytes_read' from the dicom file and its 'sop_instance_uid', which
+        are not tracked by this engine.
+    Raises:
+        DicomRejectedError if the dicom does not fit the selection criteria or has several slices.
+        CalledProcessError if convert fails, in which case no image is written.
     """
 
     if skip_existing and os.path.exists(image_path):
         return
 
     # Ensure dicom meets selection criteria and only has one slice
-    if not (is_selected_dicom(dicom_path, selection_criteria) and has_one_slice(dicom_path)):
-        return
+    check_convertible_dicom(dicom_path, selection_criteria)
     # Create directory for image if necessary
     create_directory_if_necessary(image_path)
 
     # Convert DICOM to PNG using ImageMagick
-    Popen(['convert', dicom_path, image_path]).wait()
+    with stage('convert'), atomic_output_path(image_path) as temp_path:
+        check_output(['convert', dicom_path, temp_path])
+
+    return {'bytes_read': None, 'sop_instance_uid': None, 'warning': None}
+
+
+def get_conversion_parameters(selection_criteria):
+    """Gets the parameters which determine the output of a conversion.
+
+    Arguments:
+        selection_criteria (list or tuple): list or tuple of dictionaries where each dictionary describes a set of key:value selection criteria.
+
+    Returns:
+        A JSON serializable dictionary of parameters.
+    """
+
+    return {
+        'selection_criteria': [dict(criteria) for criteria in selection_criteria],
+        'window_level': DEFAULT_WINDOW_LEVEL,
+        'window_width': DEFAULT_WINDOW_WIDTH
+    }
 
 
 def dicom_to_png_matlab(dicom_paths, image_paths, selection_criteria, skip_existing=True):
@@ -164,15 +577,14 @@ def dicom_to_png_matlab(dicom_paths, image_paths, selection_criteria, skip_exist
 
     if skip_existing:
         print('Checking for existing images')
-        keep = p_map(lambda image_path: not os.path.exists(image_path), image_paths)
-        keep_indices = np.where(keep)
+        exists = p_map(os.path.exists, image_paths)
+        keep_indices = np.where(np.logical_not(exists))
         dicom_paths = dicom_paths[keep_indices]
         image_paths = image_paths[keep_indices]
 
     # Ensure that dicoms meet selection criteria and only have one slice
     print('Checking for invalid dicoms')
-    keep = p_map(lambda dicom_path: is_selected_dicom(dicom_path, selection_criteria) and has_one_slice(dicom_path),
-                 dicom_paths)
+    keep = p_map(partial(is_convertible_dicom, selection_criteria=selection_criteria), dicom_paths)
     keep_indices = np.where(keep)
     dicom_paths = dicom_paths[keep_indices]
     image_paths = image_paths[keep_indices]
@@ -0,0 +1,304 @@
+"""Grouping of DICOMs into exams and packing of the converted images of each exam into one bundle.
+
+An exam is identified by the AccessionNumber of its DICOMs, or by their
+StudyInstanceUID if they have no accession, and each image in it by its
+view, e.g. 'L CC' from the ImageLaterality (or Laterality) and ViewPosition.
+
+Writing one PNG per DICOM creates hundreds of millions of small files, so
+the converted images of an exam can instead be packed into one bundle: an
+uncompressed zip file holding the PNG of every image and an 'index.json'
+member with the view, DICOM path, SOPInstanceUID and byte offset of each PNG
+in the bundle. A loader opens one file per exam, and since the PNGs are
+stored uncompressed it can also read a PNG directly at its offset. Bundles
+are written atomically, so a bundle which exists is complete, and the bundle
+of an exam with a DICOM which failed to convert is not written, so that the
+exam is converted again by the next run. An exam none of whose DICOMs is
+selected gets a bundle without images, so that it is not converted again.
+"""
+
+import hashlib
+import io
+import json
+import os
+import re
+import zipfile
+
+import imageio
+
+from oncodata.dicom_metadata.query import select_rows
+from oncodata.dicom_to_png.manifest import FAILED
+from oncodata.utils.files import get_temp_path
+
+EXAM_COLUMNS = ['dicom_path', 'AccessionNumber', 'StudyInstanceUID', 'ImageLaterality', 'Laterality', 'ViewPosition']
+BUNDLE_EXTENSION = '.zip'
+BUNDLE_INDEX_NAME = 'index.json'
+# Number of hex digits of the hash of the exam identifier in the name of its bundle
+BUNDLE_HASH_LENGTH = 8
+# Size of the fixed part of the local file header preceding each member of a zip file
+ZIP_LOCAL_HEADER_SIZE = 30
+
+
+def get_exam_id(dicom_metadata):
+    """Gets the identifier of the exam of a DICOM: its AccessionNumber, or StudyInstanceUID, or None."""
+
+    return dicom_metadata.get('AccessionNumber') or dicom_metadata.get('StudyInstanceUID') or None
+
+
+def get_view(dicom_metadata):
+    """Gets the view of a DICOM, e.g. 'L CC', from its laterality and ViewPosition, or '' if both are unknown."""
+
+    laterality = dicom_metadata.get('ImageLaterality') or dicom_metadata.get('Laterality') or ''
+    view_position = dicom_metadata.get('ViewPosition') or ''
+
+    return ' '.join(part for part in [laterality, view_position] if part)
+
+
+def group_exams(rows):
+    """Groups DICOMs into exams.
+
+    Arguments:
+        rows(iterable): Dictionaries with the 'dicom_path' and metadata of
+            each DICOM, e.g. as returned by select_rows with EXAM_COLUMNS.
+    Returns:
+        A dictionary from exam identifier to the list of the DICOMs of the
+        exam, sorted by identifier, where each DICOM is a dictionary with its
+        'dicom_path' and 'view' and is sorted by view and path. DICOMs without
+        an exam identifier are left out.
+    """
+
+    exams = {}
+    for row in rows:
+        exam_id = get_exam_id(row)
+        if exam_id is not None:
+            exams.setdefault(exam_id, []).append({'dicom_path': row['dicom_path'], 'view': get_view(row)})
+
+    return {exam_id: sorted(exams[exam_id], key=lambda dicom: (dicom['view'], dicom['dicom_path']))
+            for exam_id in sorted(exams)}
+
+
+def select_exams(database, selection_criteria, start_date=None, end_date=None):
+    """Selects the DICOMs which fit the selection criteria from indexed metadata and groups them into exams.
+
+    Arguments:
+        database(str): Path to a SQLite file or a mssql:// URL of metadata
+            written by SqlMetadataWriter.
+        selection_criteria(list or tuple): list or tuple of dictionaries where each dictionary describes a set of key:value selection criteria.
+        start_date(str): Optional first StudyDate (YYYYMMDD) of the selected DICOMs.
+        end_date(str): Optional last StudyDate (YYYYMMDD) of the selected DICOMs.
+    Returns:
+        A dictionary of exams as returned by group_exams.
+    """
+
+    return group_exams(select_rows(database, selection_criteria, start_date, end_date, EXAM_COLUMNS))
+
+
+def get_bundle_path(bundle_dir, exam_id):
+    """Gets the path of the bundle of an exam, e.g. A_1-<hash>.zip for A/1.
+
+    Characters which are unsafe in file names are replaced, and a short hash
+    of the exam identifier keeps exams such as A/1 and A_1 apart.
+    """
+
+    exam_hash = hashlib.sha1(exam_id.encode('utf-8')).hexdigest()[:BUNDLE_HASH_LENGTH]
+
+    return os.path.join(bundle_dir, '{}-{}{}'.format(re.sub(r'[^\w.-]', '_', exam_id), exam_hash, BUNDLE_EXTENSION))
+
+
+class ExamBundleWriter(object):
+    """Packs the PNGs of converted DICOMs into one bundle per exam, used as a context manager:
+
+        with ExamBundleWriter(bundle_dir, exams) as writer:
+            for row in rows:
+                writer.write(row)
+
+    The bundle of an exam is opened when its first PNG arrives and closed as
+    soon as a row of every DICOM of the exam has been written, even if none
+    of them had a PNG, so DICOMs
+    ordered by exam keep only a few bundles open at a time. If the conversion
+    of a DICOM of the exam failed, the bundle is removed instead.
+    """
+
+    def __init__(self, bundle_dir, exams):
+        """Creates a writer of bundles.
+
+        Arguments:
+            bundle_dir(str): Directory of the bundles.
+            exams(dict): Exams of the DICOMs being converted, as returned by group_exams.
+        """
+
+        self.bundle_dir = bundle_dir
+        self.exams = exams
+        self.dicoms = {dicom['dicom_path']: (exam_id, position, dicom['view'])
+                       for exam_id, dicoms in exams.items() for position, dicom in enumerate(dicoms)}
+        self.remaining = {exam_id: len(dicoms) for exam_id, dicoms in exams.items()}
+        self.bundles = {}
+        self.failed = set()
+        self.num_bundles = 0
+        self.num_failed = 0
+
+        os.makedirs(bundle_dir, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_parameters(self):
+        """Gets the parameters which determine the contents of the bundles, e.g. for a conversion manifest."""
+
+        return {'bundle_dir': os.path.abspath(self.bundle_dir)}
+
+    def open_bundle(self, exam_id):
+        """Gets the bundle of an exam, opening it at a temporary path if necessary."""
+
+        if exam_id not in self.bundles:
+            temp_path = get_temp_path(get_bundle_path(self.bundle_dir, exam_id))
+            self.bundles[exam_id] = {'zip_file': zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_STORED),
+                                     'temp_path': temp_path, 'images': []}
+
+        return self.bundles[exam_id]
+
+    def write_png(self, exam_id, position, view, row, png_data):
+        """Adds the PNG of a converted DICOM to the bundle of its exam, opening the bundle if necessary."""
+
+        bundle = self.open_bundle(exam_id)
+
+        name = '{:03d}_{}.png'.format(position, view.replace(' ', '_') or 'unknown')
+        bundle['zip_file'].writestr(name, png_data)
+        info = bundle['zip_file'].getinfo(name)
+        bundle['images'].append({
+            'name': name,
+            'view': view,
+            'dicom_path': row['source_path'],
+            'sop_instance_uid': row.get('sop_instance_uid'),
+            'offset': info.header_offset + ZIP_LOCAL_HEADER_SIZE + len(info.filename.encode('utf-8')) + len(info.extra),
+            'size': len(png_data)
+        })
+
+    def close_bundle(self, exam_id):
+        """Writes the index of the bundle of an exam and moves the bundle to its path.
+
+        An exam without any converted DICOM gets a bundle with only its index,
+        which records that the exam was converted.
+        """
+
+        bundle = self.open_bundle(exam_id)
+        del self.bundles[exam_id]
+
+        index = {'exam_id': exam_id, 'num_dicoms': len(self.exams[exam_id]), 'images': bundle['images']}
+        bundle['zip_file'].writestr(BUNDLE_INDEX_NAME, json.dumps(index, indent=4, sort_keys=True))
+        bundle['zip_file'].close()
+        os.replace(bundle['temp_path'], get_bundle_path(self.bundle_dir, exam_id))
+        self.num_bundles += 1
+
+    def remove_bundle(self, exam_id):
+        """Closes and removes the unfinished bundle of an exam, if it was opened."""
+
+        bundle = self.bundles.pop(exam_id, None)
+        if bundle is not None:
+            bundle['zip_file'].close()
+            os.remove(bundle['temp_path'])
+
+    def write(self, row):
+        """Packs the PNG of a conversion row, if it has one, and closes the bundle of its exam once it is complete.
+
+        Arguments:
+            row(dict): A row returned by convert_and_record, with the
+                'png_data' of each converted DICOM, which is removed from the row.
+        """
+
+        png_data = row.pop('png_data', None)
+        if row['source_path'] not in self.dicoms:
+            return
+
+        exam_id, position, view = self.dicoms[row['source_path']]
+        if row['status'] == FAILED:
+            self.failed.add(exam_id)
+            self.remove_bundle(exam_id)
+        elif png_data is not None and exam_id not in self.failed:
+            self.write_png(exam_id, position, view, row, png_data)
+
+        self.remaining[exam_id] -= 1
+        if self.remaining[exam_id] == 0:
+            if exam_id in self.failed:
+                self.num_failed += 1
+            else:
+                self.close_bundle(exam_id)
+
+    def close(self):
+        """Closes the bundles of the exams whose DICOMs were not all written, e.g. after an error.
+
+        Their bundles are removed, so that they are converted again by the next run.
+        """
+
+        for exam_id in list(self.bundles):
+            self.remove_bundle(exam_id)
+
+
+def write_bundles(rows, bundle_writer):
+    """Packs the PNGs of converted rows into exam bundles as the rows are produced.
+
+    Arguments:
+        rows(iterable): Rows returned by convert_and_record, with the
+            'png_data' of each converted DICOM.
+        bundle_writer(ExamBundleWriter): The writer of the bundles.
+    Returns:
+        A generator of the rows, without their PNGs.
+    """
+
+    for row in rows:
+        bundle_writer.write(row)
+        yield row
+
+
+class ExamBundle(object):
+    """Reads the images of an exam from its bundle, used as a context manager:
+
+        with ExamBundle(bundle_path) as bundle:
+            for image in bundle.images:
+                pixels = bundle.read(image)
+    """
+
+    def __init__(self, bundle_path):
+        """Opens a bundle and reads its index.
+
+        Arguments:
+            bundle_path(str): Path to the bundle of an exam.
+        """
+
+        self.zip_file = zipfile.ZipFile(bundle_path, 'r')
+        index = json.loads(self.zip_file.read(BUNDLE_INDEX_NAME))
+        self.exam_id = index['exam_id']
+        self.num_dicoms = index['num_dicoms']
+        self.images = index['images']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_images(self, view):
+        """Gets the index entries of the images of a view, e.g. 'L CC'."""
+
+        return [image for image in self.images if image['view'] == view]
+
+    def read_png(self, image):
+        """Reads the PNG of an image as bytes, given its index entry."""
+
+        return self.zip_file.read(image['name'])
+
+    def read(self, image):
+        """Reads and decodes an image, given its index entry.
+
+        Returns:
+            A 2D uint16 array.
+        """
+
+        return imageio.v2.imread(io.BytesIO(self.read_png(image)))
+
+    def close(self):
+        """Closes the bundle."""
+
+        self.zip_file.close()
@@ -1,12 +1,45 @@
+import io
 import re
-from subprocess import Popen, PIPE
+import struct
+from subprocess import PIPE, run
 from tempfile import NamedTemporaryFile
 
-import pydicom
+from pydicom.datadict import tag_for_keyword
+from pydicom.filereader import read_partial
+from pydicom.uid import DeflatedExplicitVRLittleEndian
+
+NUMBER_OF_FRAMES_TAG = tag_for_keyword('NumberOfFrames')
+PIXEL_DATA_TAG = tag_for_keyword('PixelData')
+SLICE_COUNT_TAGS = [tag_for_keyword(keyword) for keyword in
+                    ['NumberOfFrames', 'SamplesPerPixel', 'Rows', 'Columns', 'BitsAllocated',
+                     'PerFrameFunctionalGroupsSequence']]
+UNDEFINED_LENGTH = 0xffffffff
+ITEM_TAG = (0xfffe, 0xe000)
+SEQUENCE_DELIMITER_TAG = (0xfffe, 0xe0dd)
+
 
 def get_slice_count(dicom_path):
     """Determines the number of slices in a DICOM.
 
+    Tries each strategy in resolve_slice_count, which only
+    read the DICOM header, before falling back to dcmj2pnm.
+
+    Arguments:
+        dicom_path(str): The path to a dicom.
+    Returns:
+        The number of slices in the DICOM.
+    Raises:
+        AttributeError if no strategy could determine the
+        number of slices in the DICOM.
+    """
+
+    num_slices, _ = resolve_slice_count(dicom_path)
+
+    return num_slices
+
+def get_slice_count_from_dcmtk(dicom_path):
+    """Determines the number of slices in a DICOM using dcmtk.
+
     Works by attempting to convert the 1000000th slice
     to a PNG using the command line tool dcmj2pnm. When
     this fails, parses dcmj2pnm's error to determine
@@ -21,10 +54,11 @@ def get_slice_count(dicom_path):
         not contain the number of slices in the DICOM.
     """
 
+    # run kills dcmj2pnm if it is interrupted, e.g. by a time limit
     with NamedTemporaryFile(suffix='.png') as temp:
-        output, err = Popen(['dcmj2pnm', '+on', '+Wi', '1000000', dicom_path, temp.name], stdout=PIPE, stderr=PIPE).communicate()
+        err = run(['dcmj2pnm', '+on', '+Wi', '1000000', dicom_path, temp.name], stdout=PIPE, stderr=PIPE).stderr
     err = err.decode('utf-8')
-    num_slices = int(re.search(r'only (\d)+ window', err).group(1))
+    num_slices = int(re.search(r'only (\d+) window', err).group(1))
 
     return num_slices
 
@@ -33,7 +67,8 @@ def get_slice_count_from_metadata(dicom_path):
 
     Works by reading the DICOM metadata attribute
     at [0x0028, 0x0008], is the number of frames
-    in the DICOM. 
+    in the DICOM. Only the header up to that
+    attribute is read.
 
     Arguments:
         dicom_path(str): The path to a dicom.
@@ -44,7 +79,170 @@ def get_slice_count_from_metadata(dicom_path):
         contain the NumberOfFrames attribute.
     """
 
-    dicom_data = pydicom.dcmread(dicom_path)
-    num_slices = dicom_data[0x0028,0x0008].value
+    dicom_data, _, _ = read_slice_count_header(dicom_path)
+    num_slices = int(dicom_data[NUMBER_OF_FRAMES_TAG].value)
 
     return num_slices
+
+def read_encapsulated_fragments(dicom_file, is_little_endian):
+    """Counts the fragments of encapsulated pixel data by reading only item headers.
+
+    Arguments:
+        dicom_file(file): A file positioned after the pixel data element header.
+        is_little_endian(bool): The byte order of the dataset.
+    Returns:
+        A tuple (num_offsets, num_fragments) with the number of entries in
+        the basic offset table and the number of pixel data fragments.
+    """
+
+    item_format = '<HHI' if is_little_endian else '>HHI'
+    num_offsets = None
+    num_fragments = 0
+    while True:
+        item_header = dicom_file.read(8)
+        if len(item_header) < 8:
+            break
+        group, element, length = struct.unpack(item_format, item_header)
+        if (group, element) != ITEM_TAG:
+            break
+        if num_offsets is None:
+            num_offsets = length // 4
+        else:
+            num_fragments += 1
+        dicom_file.seek(length, io.SEEK_CUR)
+
+    return num_offsets or 0, num_fragments
+
+def read_slice_count_header(dicom_path):
+    """Reads the parts of a DICOM header needed to count its slices.
+
+    Stops after NumberOfFrames if it is present and not empty and
+    otherwise at the pixel data, whose fragments are counted without being
+    read if the pixel data is encapsulated.
+
+    Arguments:
+        dicom_path(str): The path to a dicom.
+    Returns:
+        A tuple (dicom_data, pixel_data_length, fragments) where dicom_data
+        contains at most SLICE_COUNT_TAGS, pixel_data_length is the length of
+        the pixel data element or None and fragments is the tuple returned by
+        read_encapsulated_fragments or None.
+    Raises:
+        InvalidDicomError if the dicom file cannot be read.
+    """
+
+    state = {'has_number_of_frames': False, 'pixel_data_length': None}
+
+    def stop_when(tag, VR, length):
+        if state['has_number_of_frames'] and tag > NUMBER_OF_FRAMES_TAG:
+            return True
+        if tag == NUMBER_OF_FRAMES_TAG and length > 0:
+            # An empty NumberOfFrames is not used, so the pixel data is still reached
+            state['has_number_of_frames'] = True
+        if tag == PIXEL_DATA_TAG:
+            state['pixel_data_length'] = length
+            return True
+        return False
+
+    with io.open(dicom_path, 'rb') as dicom_file:
+        dicom_data = read_partial(dicom_file, stop_when=stop_when, specific_tags=SLICE_COUNT_TAGS)
+
+        fragments = None
+        transfer_syntax = dicom_data.file_meta.get('TransferSyntaxUID', None)
+        if (state['pixel_data_length'] == UNDEFINED_LENGTH and transfer_syntax is not None
+                and transfer_syntax != DeflatedExplicitVRLittleEndian):
+            # The file is positioned at the start of the pixel data element
+            header_length = 8 if transfer_syntax.is_implicit_VR else 12
+            dicom_file.seek(header_length, io.SEEK_CUR)
+            fragments = read_encapsulated_fragments(dicom_file, transfer_syntax.is_little_endian)
+
+    return dicom_data, state['pixel_data_length'], fragments
+
+def count_from_number_of_frames(dicom_data, pixel_data_length, fragments):
+    """Uses the NumberOfFrames attribute."""
+
+    if NUMBER_OF_FRAMES_TAG not in dicom_data:
+        return None
+
+    try:
+        return int(dicom_data[NUMBER_OF_FRAMES_TAG].value)
+    except (TypeError, ValueError):
+        # An empty or invalid NumberOfFrames is left to the other strategies
+        return None
+
+def count_from_functional_groups(dicom_data, pixel_data_length, fragments):
+    """Uses the number of items in the per-frame functional groups of enhanced multi-frame DICOMs."""
+
+    if 'PerFrameFunctionalGroupsSequence' not in dicom_data:
+        return None
+
+    return len(dicom_data.PerFrameFunctionalGroupsSequence)
+
+def count_from_pixel_data_length(dicom_data, pixel_data_length, fragments):
+    """Divides the length of native (uncompressed) pixel data by the size of one frame."""
+
+    if pixel_data_length in (None, UNDEFINED_LENGTH):
+        return None
+
+    try:
+        frame_bits = (int(dicom_data.Rows) * int(dicom_data.Columns) * int(dicom_data.get('SamplesPerPixel', 1))
+                      * int(dicom_data.BitsAllocated))
+    except (AttributeError, TypeError, ValueError):
+        return None
+    if frame_bits == 0:
+        return None
+
+    return pixel_data_length * 8 // frame_bits
+
+def count_from_encapsulated_fragments(dicom_data, pixel_data_length, fragments):
+    """Uses the basic offset table, or a single frame if it is empty.
+
+    Only DICOMs without a valid NumberOfFrames get here, and those hold a
+    single frame, which can be split into several fragments, so fragments
+    are never counted as frames.
+    """
+
+    if fragments is None:
+        return None
+
+    num_offsets, num_fragments = fragments
+    if num_offsets > 0:
+        return num_offsets
+
+    return 1 if num_fragments > 0 else None
+
+SLICE_COUNT_STRATEGIES = [
+    ('number_of_frames', count_from_number_of_frames),
+    ('functional_groups', count_from_functional_groups),
+    ('pixel_data_length', count_from_pixel_data_length),
+    ('encapsulated_fragments', count_from_encapsulated_fragments)
+]
+
+def resolve_slice_count(dicom_path):
+    """Determines the number of slices in a DICOM and the strategy which determined it.
+
+    Tries each of SLICE_COUNT_STRATEGIES on a single partial read of the
+    DICOM header and only runs dcmj2pnm if none of them succeed.
+
+    Arguments:
+        dicom_path(str): The path to a dicom.
+    Returns:
+        A tuple (num_slices, strategy) where strategy is the name of the
+        strategy in SLICE_COUNT_STRATEGIES which answered or 'dcmtk'.
+    Raises:
+        AttributeError if no strategy could determine the
+        number of slices in the DICOM.
+    """
+
+    try:
+        header = read_slice_count_header(dicom_path)
+    except Exception:
+        header = None
+
+    if header is not None:
+        for strategy, count_slices in SLICE_COUNT_STRATEGIES:
+            num_slices = count_slices(*header)
+            if num_slices is not None:
+                return num_slices, strategy
+
+    return get_slice_count_from_dcmtk(dicom_path), 'dcmtk'
@@ -0,0 +1,323 @@
+"""A persistent manifest of DICOM to PNG conversions for incremental runs.
+
+The manifest is a SQLite database, by default stored next to the PNG
+directory, with one row per source DICOM recording the source size and
+modification time, its SOPInstanceUID, the conversion engine and parameters,
+the hash of the output and the status of the conversion. A DICOM is
+converted again only if it changed, if the engine or parameters changed or
+if its last conversion did not finish.
+"""
+
+from itertools import islice
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from oncodata.dicom_to_png.dicom_to_png import DicomRejectedError
+from oncodata.utils.files import hash_output
+from oncodata.utils.parallel import time_limit
+from oncodata.utils.timing import collect_stages
+
+CONVERTED = 'converted'
+EXISTING = 'existing'
+NOT_SELECTED = 'not_selected'
+FAILED = 'failed'
+
+MANIFEST_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS conversions (
+    source_path TEXT PRIMARY KEY,
+    source_size INTEGER,
+    source_mtime REAL,
+    sop_instance_uid TEXT,
+    engine TEXT,
+    parameters TEXT,
+    image_path TEXT,
+    output_hash TEXT,
+    status TEXT
+)
+'''
+MANIFEST_COLUMNS = ['source_path', 'source_size', 'source_mtime', 'sop_instance_uid', 'engine', 'parameters',
+                    'image_path', 'output_hash', 'status']
+
+# SQLite limits the number of parameters in a single query
+QUERY_BATCH_SIZE = 900
+
+
+def get_manifest_path(png_dir):
+    """Gets the default manifest path, next to the PNG directory.
+
+    Arguments:
+        png_dir(str): Path to a directory where PNG images are saved.
+    Returns:
+        The path of the manifest database.
+    """
+
+    return os.path.normpath(png_dir) + '.manifest.sqlite'
+
+
+def serialize_parameters(parameters):
+    """Serializes conversion parameters so that equal parameters compare equal.
+
+    Arguments:
+        parameters(dict): JSON serializable conversion parameters.
+    Returns:
+        A JSON string with sorted keys.
+    """
+
+    return json.dumps(parameters, sort_keys=True)
+
+
+def convert_and_record(convert, dicom_path, image_path, selection_criteria, skip_existing=False, timeout=None,
+                       instrument=False, hash_image=False):
+    """Converts a DICOM and returns a row describing the conversion.
+
+    Nothing is printed. DICOMs which do not fit the selection criteria are
+    recorded as not selected with the reason they were rejected, and other
+    exceptions raised by the conversion, including conversions which take
+    longer than timeout, are caught and recorded as a failure with the type
+    of the exception as the reason.
+
+    Arguments:
+        convert(function): A per-file conversion function such as dicom_to_png_dcmtk.
+        dicom_path(str): The path to the dicom file.
+        image_path(str): The path where the image will be saved, or None if
+            the conversion only returns the image.
+        selection_criteria (list or tuple): list or tuple of dictionaries where each dictionary describes a set of key:value selection criteria.
+        skip_existing(bool): True to skip images which already exist.
+        timeout(float): Seconds after which the conversion, and any subprocess
+            it started, is killed, or None for no limit.
+        instrument(bool): True to record the time and bytes of each stage of
+            the conversion in 'stages'.
+        hash_image(bool): True to hash the output in 'output_hash', e.g. when
+            the row is recorded in a ConversionManifest.
+    Returns:
+        A dictionary with the source_path, source_size, source_mtime,
+        sop_instance_uid, image_path, output_hash, status, reason, error,
+        warning, bytes_read, the wall clock time it 'started' and the seconds of
+        the conversion, the 'worker' process which converted it and its
+        'stages' if instrumented. If the conversion returned the windowed
+        'image' or the encoded 'png_data', the row also holds it and the
+        'accession_number' of the dicom, and if it converted frames, the row
+        holds their 'num_frames'.
+    """
+
+    start_time = time.perf_counter()
+    row = {
+        'source_path': dicom_path,
+        'source_size': None,
+        'source_mtime': None,
+        'sop_instance_uid': None,
+        'image_path': image_path,
+        'output_hash': None,
+        'status': FAILED,
+        'reason': None,
+        'error': None,
+        'warning': None,
+        'bytes_read': None,
+        'started': time.time(),
+        'seconds': None,
+        'worker': os.getpid(),
+        'stages': None
+    }
+
+    if skip_existing and image_path is not None and os.path.exists(image_path):
+        row['status'] = EXISTING
+        return row
+
+    try:
+        source_stat = os.stat(dicom_path)
+        row['source_size'] = source_stat.st_size
+        row['source_mtime'] = source_stat.st_mtime
+        with time_limit(timeout):
+            if instrument:
+                with collect_stages() as stages:
+                    row['stages'] = stages
+                    result = convert(dicom_path, image_path, selection_criteria, skip_existing=False)
+            else:
+                result = convert(dicom_path, image_path, selection_criteria, skip_existing=False)
+        if result is None:
+            row['status'] = EXISTING
+        elif image_path is None or os.path.exists(image_path):
+            row['sop_instance_uid'] = result['sop_instance_uid']
+            row['bytes_read'] = result['bytes_read']
+            row['warning'] = result.get('warning')
+            row['output_hash'] = hash_output(image_path) if hash_image and image_path is not None else None
+            row['status'] = CONVERTED
+            for key in ['image', 'png_data', 'accession_number', 'num_frames']:
+                if key in result:
+                    row[key] = result[key]
+        else:
+            row['reason'] = 'missing_output'
+    except DicomRejectedError as e:
+        row['status'] = NOT_SELECTED
+        row['reason'] = e.reason
+        row['error'] = e.detail
+    except Exception as e:
+        row['reason'] = type(e).__name__
+        row['error'] = str(e)
+
+    row['seconds'] = time.perf_counter() - start_time
+
+    return row
+
+
+class ConversionManifest(object):
+    """A SQLite manifest of conversions, used as a context manager:
+
+        with ConversionManifest(manifest_path) as manifest:
+            pending = manifest.get_pending(dicom_paths, image_paths, engine, parameters)
+            ...
+            manifest.record(row, engine, parameters)
+
+    The manifest can be used from several threads, so pending DICOMs can be
+    consumed by a process pool's task thread while rows are recorded.
+    """
+
+    def __init__(self, manifest_path):
+        """Opens or creates a manifest.
+
+        Arguments:
+            manifest_path(str): Path to the SQLite manifest.
+        """
+
+        self.connection = sqlite3.connect(manifest_path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(MANIFEST_SCHEMA)
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Commits pending rows and closes the manifest."""
+
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+    def commit(self):
+        """Commits the rows recorded so far."""
+
+        with self.lock:
+            self.connection.commit()
+
+    def rollback(self):
+        """Forgets the rows recorded since the last commit."""
+
+        with self.lock:
+            self.connection.rollback()
+
+    def get_rows(self, dicom_paths):
+        """Gets the manifest rows of the given source paths.
+
+        Arguments:
+            dicom_paths(list): Paths to dicom files.
+        Returns:
+            A dictionary mapping source path to a dictionary of manifest columns.
+        """
+
+        rows = {}
+        for i in range(0, len(dicom_paths), QUERY_BATCH_SIZE):
+            batch = dicom_paths[i:i + QUERY_BATCH_SIZE]
+            query = 'SELECT {} FROM conversions WHERE source_path IN ({})'.format(
+                ', '.join(MANIFEST_COLUMNS), ', '.join('?' * len(batch)))
+            with self.lock:
+                for values in self.connection.execute(query, batch).fetchall():
+                    rows[values[0]] = dict(zip(MANIFEST_COLUMNS, values))
+
+        return rows
+
+    def get_pending(self, dicom_paths, image_paths, engine, parameters):
+        """Yields the DICOMs which need to be converted.
+
+        A DICOM is skipped only if its last conversion finished (or found it did
+        not fit the selection criteria) with the same engine, parameters and
+        image path and its size and modification time are unchanged. Outputs
+        are never checked since they are written atomically.
+
+        Arguments:
+            dicom_paths(iterable): Paths to dicom files.
+            image_paths(iterable): Paths where the images will be saved.
+            engine(str): The name of the conversion engine.
+            parameters(dict): The conversion parameters.
+        Returns:
+            A generator of (dicom_path, image_path) tuples.
+        """
+
+        parameters = serialize_parameters(parameters)
+        path_pairs = zip(dicom_paths, image_paths)
+        while True:
+            batch = list(islice(path_pairs, QUERY_BATCH_SIZE))
+            if len(batch) == 0:
+                break
+            rows = self.get_rows([dicom_path for dicom_path, _ in batch])
+
+            for dicom_path, image_path in batch:
+                row = rows.get(dicom_path)
+                if (row is not None and row['status'] in (CONVERTED, NOT_SELECTED) and row['engine'] == engine
+                        and row['parameters'] == parameters and row['image_path'] == image_path):
+                    try:
+                        source_stat = os.stat(dicom_path)
+                    except OSError:
+                        continue
+                    if row['source_size'] == source_stat.st_size and row['source_mtime'] == source_stat.st_mtime:
+                        continue
+
+                yield dicom_path, image_path
+
+    def record(self, row, engine, parameters):
+        """Inserts or replaces the manifest row of a source DICOM.
+
+        Arguments:
+            row(dict): A row as returned by convert_and_record.
+            engine(str): The name of the conversion engine.
+            parameters(dict): The conversion parameters.
+        """
+
+        row = dict(row, engine=engine, parameters=serialize_parameters(parameters))
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO conversions ({}) VALUES ({})'.format(
+                    ', '.join(MANIFEST_COLUMNS), ', '.join('?' * len(MANIFEST_COLUMNS))),
+                [row[column] for column in MANIFEST_COLUMNS])
+
+
+def record_rows(rows, manifest, engine, parameters, commit_every=1000, before_commit=None):
+    """Records conversion rows in the manifest as they are produced.
+
+    Arguments:
+        rows(iterable): Rows returned by convert_and_record.
+        manifest(ConversionManifest): The manifest to record the rows in.
+        engine(str): The name of the conversion engine.
+        parameters(dict): The conversion parameters.
+        commit_every(int): Number of rows between commits.
+        before_commit(function): Optional function called before every commit,
+            e.g. ShardWriter.flush, so that the outputs of the committed rows
+            are durable before the manifest records them as converted.
+    Returns:
+        A generator of the recorded rows. If the rows or a consumer raise,
+        the rows recorded since the last commit are rolled back, so that
+        closing the manifest does not commit them before their outputs are
+        flushed, and they are converted again by the next run.
+    """
+
+    def commit():
+        if before_commit is not None:
+            before_commit()
+        manifest.commit()
+
+    try:
+        for i, row in enumerate(rows):
+            manifest.record(row, engine, parameters)
+            if (i + 1) % commit_every == 0:
+                commit()
+            yield row
+        commit()
+    except BaseException:
+        manifest.rollback()
+        raise
@@ -0,0 +1,172 @@
+"""Minimal grayscale PNG encoder built on zlib.
+
+The speed and size of the output are traded off with the zlib compression
+level and strategy and with the PNG filter applied to every scanline. The
+image data can be compressed by several threads in parallel, each
+compressing one chunk as a piece of a single deflate stream primed with the
+end of the previous chunk, so the output is one standard PNG (as pigz does).
+zlib releases the GIL while compressing, so the threads run in parallel.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import struct
+import zlib
+
+import numpy as np
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_GRAYSCALE = 0
+DEFAULT_COMPRESSION_LEVEL = 6
+
+PNG_FILTERS = {'none': 0, 'sub': 1, 'up': 2}
+DEFAULT_FILTER = 'none'
+ZLIB_STRATEGIES = {'default': zlib.Z_DEFAULT_STRATEGY,
+                   'filtered': zlib.Z_FILTERED,
+                   'huffman': zlib.Z_HUFFMAN_ONLY,
+                   'rle': zlib.Z_RLE}
+DEFAULT_STRATEGY = 'default'
+
+# Each thread compresses at least this many bytes, and primes its compressor
+# with the last ZLIB_WINDOW_SIZE bytes of the previous chunk
+MIN_CHUNK_SIZE = 2 ** 20
+ZLIB_WINDOW_SIZE = 2 ** 15
+
+
+def png_chunk(chunk_type, data):
+    """Serializes a PNG chunk.
+
+    Arguments:
+        chunk_type(bytes): The four letter chunk type, e.g. b'IDAT'.
+        data(bytes): The chunk data.
+    Returns:
+        The length, type, data and CRC of the chunk as bytes.
+    """
+
+    crc = zlib.crc32(data, zlib.crc32(chunk_type)) & 0xffffffff
+
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', crc)
+
+
+def filter_scanlines(rows, bytes_per_pixel, png_filter):
+    """Applies a PNG filter to every scanline in place and sets the filter type bytes.
+
+    Arguments:
+        rows(np.ndarray): A uint8 array with one scanline per row, preceded by a
+            byte for the filter type.
+        bytes_per_pixel(int): Number of bytes per pixel.
+        png_filter(str): A filter in PNG_FILTERS.
+    """
+
+    rows[:, 0] = PNG_FILTERS[png_filter]
+    scanlines = rows[:, 1:]
+
+    # Differences wrap around modulo 256, as PNG requires
+    if png_filter == 'sub':
+        scanlines[:, bytes_per_pixel:] -= scanlines[:, :-bytes_per_pixel].copy()
+    elif png_filter == 'up':
+        scanlines[1:] -= scanlines[:-1].copy()
+
+
+def compress_chunk(data, start, end, compression_level, strategy, is_last):
+    """Compresses one chunk of data as a piece of a raw deflate stream.
+
+    Arguments:
+        data(memoryview): All the data being compressed.
+        start(int): Offset of the chunk.
+        end(int): Offset after the chunk.
+        compression_level(int): The zlib compression level (0-9).
+        strategy(int): A zlib strategy.
+        is_last(bool): True to finish the stream, False to end on a byte boundary.
+    Returns:
+        The compressed chunk as bytes.
+    """
+
+    options = {'zdict': data[max(0, start - ZLIB_WINDOW_SIZE):start]} if start > 0 else {}
+    compressor = zlib.compressobj(compression_level, zlib.DEFLATED, -zlib.MAX_WBITS, 9, strategy, **options)
+
+    return compressor.compress(data[start:end]) + compressor.flush(zlib.Z_FINISH if is_last else zlib.Z_SYNC_FLUSH)
+
+
+def compress_parallel(data, compression_level=DEFAULT_COMPRESSION_LEVEL, strategy=zlib.Z_DEFAULT_STRATEGY,
+                      num_threads=1):
+    """Compresses data into a zlib stream, in chunks compressed by several threads.
+
+    Arguments:
+        data(bytes): The data to compress.
+        compression_level(int): The zlib compression level (0-9).
+        strategy(int): A zlib strategy.
+        num_threads(int): Number of threads.
+    Returns:
+        The zlib stream as bytes, which zlib.decompress reads like any other.
+    """
+
+    num_chunks = max(1, min(num_threads, len(data) // MIN_CHUNK_SIZE))
+    if num_chunks == 1:
+        compressor = zlib.compressobj(compression_level, zlib.DEFLATED, zlib.MAX_WBITS, 9, strategy)
+        return compressor.compress(data) + compressor.flush()
+
+    data = memoryview(data)
+    bounds = [len(data) * i // num_chunks for i in range(num_chunks + 1)]
+    with ThreadPoolExecutor(num_threads) as executor:
+        pieces = list(executor.map(lambda i: compress_chunk(data, bounds[i], bounds[i + 1], compression_level, strategy,
+                                                            i == num_chunks - 1),
+                                   range(num_chunks)))
+
+    # A zlib header for a 32K window (its level bits are informational), the raw deflate pieces and the Adler-32
+    return b''.join([b'\x78\x9c'] + pieces + [struct.pack('>I', zlib.adler32(data) & 0xffffffff)])
+
+
+def encode_png(image, compression_level=DEFAULT_COMPRESSION_LEVEL, png_filter=DEFAULT_FILTER,
+               strategy=DEFAULT_STRATEGY, num_threads=1):
+    """Encodes a 2D uint8 or uint16 array as a grayscale PNG.
+
+    Arguments:
+        image(np.ndarray): A 2D uint8 or uint16 array.
+        compression_level(int): The zlib compression level (0-9).
+        png_filter(str): The filter of every scanline, a key of PNG_FILTERS.
+            'sub' and 'up' usually make smooth images smaller.
+        strategy(str): The zlib strategy, a key of ZLIB_STRATEGIES.
+            'rle' and 'huffman' are faster and larger.
+        num_threads(int): Number of threads compressing the image data.
+    Returns:
+        The PNG file contents as bytes.
+    Raises:
+        ValueError if the image is not a 2D uint8 or uint16 array.
+    """
+
+    if image.ndim != 2 or image.dtype not in (np.uint8, np.uint16):
+        raise ValueError('Expected a 2D uint8 or uint16 array, got {} {}.'.format(image.ndim, image.dtype))
+
+    height, width = image.shape
+    bit_depth = image.dtype.itemsize * 8
+
+    # Each scanline is prefixed with its filter type. PNG is big endian.
+    rows = np.empty((height, width * image.dtype.itemsize + 1), dtype=np.uint8)
+    rows[:, 1:] = image.astype(image.dtype.newbyteorder('>'), copy=False).view(np.uint8).reshape(height, -1)
+    filter_scanlines(rows, image.dtype.itemsize, png_filter)
+
+    header = struct.pack('>IIBBBBB', width, height, bit_depth, PNG_GRAYSCALE, 0, 0, 0)
+
+    return b''.join([
+        PNG_SIGNATURE,
+        png_chunk(b'IHDR', header),
+        png_chunk(b'IDAT', compress_parallel(rows.tobytes(), compression_level, ZLIB_STRATEGIES[strategy], num_threads)),
+        png_chunk(b'IEND', b'')
+    ])
+
+
+def write_png(image, image_path, compression_level=DEFAULT_COMPRESSION_LEVEL, png_filter=DEFAULT_FILTER,
+              strategy=DEFAULT_STRATEGY, num_threads=1):
+    """Writes a 2D uint8 or uint16 array to a grayscale PNG file.
+
+    Arguments:
+        image(np.ndarray): A 2D uint8 or uint16 array.
+        image_path(str): The path where the PNG will be saved.
+        compression_level(int): The zlib compression level (0-9).
+        png_filter(str): The filter of every scanline, a key of PNG_FILTERS.
+        strategy(str): The zlib strategy, a key of ZLIB_STRATEGIES.
+        num_threads(int): Number of threads compressing the image data.
+    """
+
+    with open(image_path, 'wb') as image_file:
+        image_file.write(encode_png(image, compression_level, png_filter, strategy, num_threads))
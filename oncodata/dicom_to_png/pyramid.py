@@ -0,0 +1,169 @@
+"""Downsampled copies and thumbnails of windowed images, made from the decoded pixels.
+
+Every level of the pyramid is computed from the array which was decoded for
+the full resolution PNG, so full resolution images never have to be decoded
+again to make smaller copies:
+
+    factors: each image is downsampled by integer factors by averaging blocks
+        of factor x factor pixels. A factor which is a multiple of a smaller
+        factor is computed from the smaller level, e.g. 4 from 2.
+    thumbnail sizes: each image is resized so that its longest side has the
+        size, keeping its aspect ratio, by averaging the area of the image
+        covered by each thumbnail pixel.
+
+Levels are computed in floating point and rounded once, so a cascaded level
+equals the level computed from the full resolution image.
+"""
+
+import os
+
+import numpy as np
+
+
+def downsample_image(image, factor):
+    """Downsamples an image by averaging blocks of factor x factor pixels.
+
+    Rows and columns which do not fill a whole block are dropped.
+
+    Arguments:
+        image(np.ndarray): A 2D uint16 image.
+        factor(int): The downsampling factor.
+    Returns:
+        A 2D uint16 image.
+    """
+
+    if factor == 1:
+        return image
+
+    return np.round(block_mean(image, factor)).astype(image.dtype)
+
+
+def block_mean(image, factor):
+    """Averages blocks of factor x factor pixels, dropping rows and columns which do not fill a whole block.
+
+    Arguments:
+        image(np.ndarray): A 2D array.
+        factor(int): The block size.
+    Returns:
+        A 2D float array.
+    """
+
+    height, width = image.shape[0] // factor, image.shape[1] // factor
+    blocks = image[:height * factor, :width * factor].reshape(height, factor, width, factor)
+
+    return blocks.mean(axis=(1, 3))
+
+
+def resize_area_axis(image, size, axis):
+    """Resizes an image along one axis by averaging the area covered by each output pixel.
+
+    The cumulative sum of the pixels along the axis is linear between pixel
+    boundaries, so interpolating it at the boundaries of the output pixels
+    gives the exact sums of the partially covered pixels.
+
+    Arguments:
+        image(np.ndarray): A 2D array.
+        size(int): The size of the axis after resizing.
+        axis(int): The axis to resize.
+    Returns:
+        A 2D float array.
+    """
+
+    image = np.moveaxis(image, axis, 0)
+    length = image.shape[0]
+    scale = length / size
+
+    sums = np.zeros((length + 1,) + image.shape[1:], dtype=np.float64)
+    np.cumsum(image, axis=0, dtype=np.float64, out=sums[1:])
+
+    bounds = np.arange(size + 1) * scale
+    indices = np.minimum(bounds.astype(np.int64), length - 1)
+    fractions = (bounds - indices)[:, np.newaxis]
+    bound_sums = sums[indices] + fractions * image[indices]
+
+    return np.ascontiguousarray(np.moveaxis(np.diff(bound_sums, axis=0) / scale, 0, axis))
+
+
+def resize_area(image, shape):
+    """Resizes an image by averaging the area of the image covered by each output pixel.
+
+    Arguments:
+        image(np.ndarray): A 2D array.
+        shape(tuple): The (rows, columns) after resizing, at most those of the image.
+    Returns:
+        A 2D float array.
+    """
+
+    if shape[0] != image.shape[0]:
+        image = resize_area_axis(image, shape[0], 0)
+    if shape[1] != image.shape[1]:
+        image = resize_area_axis(image, shape[1], 1)
+
+    return image
+
+
+def get_thumbnail_shape(shape, size):
+    """Gets the shape of a thumbnail whose longest side has size pixels.
+
+    Arguments:
+        shape(tuple): The (rows, columns) of the image.
+        size(int): The size of the longest side of the thumbnail.
+    Returns:
+        The (rows, columns) of the thumbnail, never larger than the image.
+    """
+
+    scale = min(1.0, size / max(shape))
+
+    return tuple(max(1, int(round(length * scale))) for length in shape)
+
+
+def iter_pyramid(image, factors=(), thumbnail_sizes=()):
+    """Computes the levels of the pyramid of an image one at a time.
+
+    Arguments:
+        image(np.ndarray): A 2D uint16 image.
+        factors(list): Integer downsampling factors larger than 1.
+        thumbnail_sizes(list): Sizes of the longest side of the thumbnails.
+    Returns:
+        A generator of (name, image) tuples where name is e.g. 'x2' or
+        'thumb256' and image is a 2D array of the dtype of the image.
+    """
+
+    levels = {1: image}
+    for factor in sorted(set(factors)):
+        source = max(level for level in levels if factor % level == 0)
+        levels[factor] = block_mean(levels[source], factor // source)
+        yield 'x{}'.format(factor), np.round(levels[factor]).astype(image.dtype)
+
+    for size in sorted(set(thumbnail_sizes)):
+        thumbnail = resize_area(image, get_thumbnail_shape(image.shape, size))
+        yield 'thumb{}'.format(size), np.round(thumbnail).astype(image.dtype)
+
+
+def get_pyramid_names(factors=(), thumbnail_sizes=()):
+    """Gets the names of the levels of a pyramid, in the order iter_pyramid yields them.
+
+    Arguments:
+        factors(list): Integer downsampling factors larger than 1.
+        thumbnail_sizes(list): Sizes of the longest side of the thumbnails.
+    Returns:
+        A list of names, e.g. ['x2', 'thumb256'].
+    """
+
+    return (['x{}'.format(factor) for factor in sorted(set(factors))]
+            + ['thumb{}'.format(size) for size in sorted(set(thumbnail_sizes))])
+
+
+def get_pyramid_path(image_path, name):
+    """Gets the path of a level of the pyramid of an image, e.g. image_x2.png for image.png.
+
+    Arguments:
+        image_path(str): The path of the full resolution image.
+        name(str): The name of the level, as yielded by iter_pyramid.
+    Returns:
+        The path of the level, next to the image.
+    """
+
+    root, extension = os.path.splitext(image_path)
+
+    return '{}_{}{}'.format(root, name, extension)
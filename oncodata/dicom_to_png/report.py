@@ -0,0 +1,190 @@
+"""Structured reports of the outcome of every DICOM to PNG conversion.
+
+Workers never print. Each conversion returns a row from convert_and_record
+through the process pool's result queue, and the main process writes the
+rows to a report and aggregates them into a rollup printed at the end of
+the run. Reports ending in '.sqlite' or '.db' are SQLite databases and any
+other report is written as JSON Lines, optionally compressed.
+"""
+
+from collections import Counter
+import sqlite3
+
+from oncodata.dicom_metadata.jsonl import MetadataWriter
+from oncodata.dicom_to_png.manifest import CONVERTED, EXISTING
+
+REPORT_COLUMNS = ['source_path', 'image_path', 'status', 'reason', 'error', 'warning', 'sop_instance_uid',
+                  'source_size', 'bytes_read', 'seconds']
+
+REPORT_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS outcomes (
+    source_path TEXT,
+    image_path TEXT,
+    status TEXT,
+    reason TEXT,
+    error TEXT,
+    warning TEXT,
+    sop_instance_uid TEXT,
+    source_size INTEGER,
+    bytes_read INTEGER,
+    seconds REAL
+);
+CREATE INDEX IF NOT EXISTS outcomes_status ON outcomes (status, reason);
+'''
+
+
+def is_sqlite_report(report_path):
+    """Checks if a report path refers to a SQLite database rather than JSON Lines."""
+
+    return report_path.endswith('.sqlite') or report_path.endswith('.db')
+
+
+class OutcomeReport(object):
+    """Writes conversion outcomes to a JSON Lines or SQLite report, used as a context manager:
+
+        with OutcomeReport(report_path) as report:
+            for row in rows:
+                report.write(row)
+    """
+
+    def __init__(self, report_path, commit_every=1000):
+        """Creates a report, replacing the outcomes of a previous run.
+
+        Arguments:
+            report_path(str): Path to the report.
+            commit_every(int): Number of rows between commits to a SQLite report.
+        """
+
+        self.commit_every = commit_every
+        self.num_rows = 0
+
+        if is_sqlite_report(report_path):
+            self.writer = None
+            self.connection = sqlite3.connect(report_path)
+            self.connection.execute('DROP TABLE IF EXISTS outcomes')
+            self.connection.executescript(REPORT_SCHEMA)
+        else:
+            self.writer = MetadataWriter(report_path, flush_every=commit_every)
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, row):
+        """Writes the outcome of one conversion.
+
+        Arguments:
+            row(dict): A row as returned by convert_and_record.
+        """
+
+        values = [row.get(column) for column in REPORT_COLUMNS]
+        if self.writer is not None:
+            self.writer.write(dict(zip(REPORT_COLUMNS, values)))
+        else:
+            self.connection.execute('INSERT INTO outcomes ({}) VALUES ({})'.format(
+                ', '.join(REPORT_COLUMNS), ', '.join('?' * len(REPORT_COLUMNS))), values)
+            self.num_rows += 1
+            if self.num_rows % self.commit_every == 0:
+                self.connection.commit()
+
+    def close(self):
+        """Flushes and closes the report."""
+
+        if self.writer is not None:
+            self.writer.close()
+        else:
+            self.connection.commit()
+            self.connection.close()
+
+
+def init_rollup():
+    """Creates an empty rollup of conversion outcomes."""
+
+    return {'status_counts': Counter(), 'reason_counts': Counter(), 'seconds': 0.0, 'num_timed': 0,
+            'bytes_read': 0, 'num_bytes_read': 0}
+
+
+def update_rollup(rollup, row):
+    """Adds the outcome of one conversion to a rollup.
+
+    Arguments:
+        rollup(dict): A rollup as returned by init_rollup.
+        row(dict): A row as returned by convert_and_record.
+    """
+
+    rollup['status_counts'][row['status']] += 1
+    if row.get('reason') is not None:
+        rollup['reason_counts'][(row['status'], row['reason'])] += 1
+    if row.get('seconds') is not None and row['status'] != EXISTING:
+        rollup['seconds'] += row['seconds']
+        rollup['num_timed'] += 1
+    if row['status'] == CONVERTED and row.get('bytes_read') is not None:
+        rollup['bytes_read'] += row['bytes_read']
+        rollup['num_bytes_read'] += 1
+
+
+def print_rollup(rollup):
+    """Prints the number of DICOMs with each status and reason, the average time per DICOM
+    and the average number of bytes read per converted image.
+
+    Arguments:
+        rollup(dict): A rollup as returned by init_rollup.
+    """
+
+    for status in sorted(rollup['status_counts'].keys()):
+        print('{}: {}'.format(status, rollup['status_counts'][status]))
+        for (reason_status, reason), count in sorted(rollup['reason_counts'].items()):
+            if reason_status == status:
+                print('    {}: {}'.format(reason, count))
+    if rollup['num_timed'] > 0:
+        print('{:.3f} seconds per DICOM'.format(rollup['seconds'] / rollup['num_timed']))
+    if rollup['num_bytes_read'] > 0:
+        print('Read {:.2f} MB per converted image'.format(rollup['bytes_read'] / rollup['num_bytes_read'] / 2 ** 20))
+
+
+def format_outcome(row):
+    """Formats the outcome of a conversion which did not simply succeed as one line, or returns None."""
+
+    if row['status'] == CONVERTED and row.get('warning') is None:
+        return None
+    if row['status'] == EXISTING:
+        return None
+
+    detail = row.get('error') or row.get('warning')
+    return '{} {} ({}): {}'.format(row['source_path'], row['status'], row.get('reason') or 'warning', detail)
+
+
+def report_outcomes(rows, report_path=None, quiet=False):
+    """Writes conversion rows to a report as they are produced and prints a rollup at the end.
+
+    Arguments:
+        rows(iterable): Rows returned by convert_and_record.
+        report_path(str): Optional path to a JSON Lines or SQLite report.
+        quiet(bool): True to print only the rollup, False to also print one
+            line per DICOM which was not converted or converted with a warning.
+    Returns:
+        The rollup of the outcomes.
+    """
+
+    rollup = init_rollup()
+    report = OutcomeReport(report_path) if report_path is not None else None
+
+    try:
+        for row in rows:
+            update_rollup(rollup, row)
+            if report is not None:
+                report.write(row)
+            if not quiet:
+                outcome = format_outcome(row)
+                if outcome is not None:
+                    print(outcome)
+    finally:
+        if report is not None:
+            report.close()
+
+    print_rollup(rollup)
+
+    return rollup
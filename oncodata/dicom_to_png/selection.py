@@ -0,0 +1,208 @@
+"""Header-only DICOM selection which reads only the tags named in the selection criteria.
+
+Elements in a DICOM dataset are stored in tag order, so reading stops as soon
+as the largest tag named in any of the selection criteria has been passed.
+Rejecting a mammogram therefore costs a read of the first few kilobytes of the
+file instead of the whole file.
+
+Values are compared as strings. A criterion which names a UID, such as
+'MR Image Storage', also matches the dotted UID, which is how pydicom 3 and
+the SQL metadata represent it.
+"""
+
+import io
+
+from pydicom.datadict import tag_for_keyword
+from pydicom.filereader import read_partial
+from pydicom.uid import UID_dictionary
+
+MAMMOGRAM_SELECTION_CRITERIA = {'SOPClassUID': 'Digital Mammography X-Ray Image Storage - For Presentation'}
+BPE_MRI_SELECTION_CRITERIA = {'SOPClassUID': 'MR Image Storage', 'SeriesNumber': '2000', 'InstanceNumber': '8'}
+TOMOSYNTHESIS_SELECTION_CRITERIA = {'SOPClassUID': 'Breast Tomosynthesis Image Storage'}
+DICOM_TYPES = {'bpe_mri': BPE_MRI_SELECTION_CRITERIA,
+               'mammo': MAMMOGRAM_SELECTION_CRITERIA,
+               'tomosynthesis': TOMOSYNTHESIS_SELECTION_CRITERIA}
+
+SELECTION_BUFFER_SIZE = 4096
+# Dotted UIDs by name, e.g. '1.2.840.10008.5.1.4.1.1.4' for 'MR Image Storage'
+UIDS_BY_NAME = {info[0]: uid for uid, info in UID_dictionary.items()}
+
+
+def get_selection_criteria(dicom_types):
+    """Gets the selection criteria for a list of dicom types.
+
+    Arguments:
+        dicom_types(list): Names of dicom types in DICOM_TYPES.
+    Returns:
+        A tuple of selection criteria dictionaries.
+    """
+
+    selection_criteria = []
+    for dicom_type in dicom_types:
+        criteria = DICOM_TYPES.get(dicom_type)
+        assert criteria is not None, "Unsupported dicom_type. Please add the appropriate type to DICOM_TYPES."
+        selection_criteria.append(criteria)
+    assert len(selection_criteria) > 0, "No dicoms selected."
+
+    return tuple(selection_criteria)
+
+
+def get_criterion_values(target_val):
+    """Gets the strings which match the value of a selection criterion.
+
+    Arguments:
+        target_val(str): The value of a criterion.
+    Returns:
+        A list of the value and, if it is the name of a UID, the dotted UID.
+    """
+
+    uid = UIDS_BY_NAME.get(target_val)
+
+    return [target_val] if uid is None else [target_val, uid]
+
+
+def get_selection_tags(selection_criteria):
+    """Gets the tags needed to evaluate every set of selection criteria.
+
+    Arguments:
+        selection_criteria(list or tuple): list or tuple of dictionaries where each dictionary describes a set of key:value selection criteria.
+    Returns:
+        A sorted list of tags.
+    Raises:
+        ValueError if a key is not a DICOM keyword.
+    """
+
+    tags = set()
+    for criteria in selection_criteria:
+        for key in criteria.keys():
+            tag = tag_for_keyword(key)
+            if tag is None:
+                raise ValueError('{} is not a DICOM keyword.'.format(key))
+            tags.add(tag)
+
+    return sorted(tags)
+
+
+def read_tags(dicom_path, tags):
+    """Reads only the given tags from a dicom, stopping after the largest one.
+
+    Arguments:
+        dicom_path(str): The path to a dicom file.
+        tags(list): A sorted list of tags to read.
+    Returns:
+        A dataset containing at most the given tags.
+    Raises:
+        InvalidDicomError if the dicom file cannot be read.
+    """
+
+    last_tag = tags[-1] if len(tags) > 0 else 0
+    with io.open(dicom_path, 'rb', buffering=SELECTION_BUFFER_SIZE) as dicom_file:
+        return read_partial(dicom_file,
+                            stop_when=lambda tag, VR, length: tag > last_tag,
+                            specific_tags=tags)
+
+
+def matches_criteria(dicom_data, criteria, verbose=True):
+    """Checks if a dataset fits one set of selection criteria.
+
+    Arguments:
+        dicom_data(Dataset): A pydicom dataset.
+        criteria(dict): A dictionary of key:value selection criteria.
+        verbose(bool): True to print every mismatched value.
+    Returns:
+        True if every value in the dataset matches the criteria.
+    """
+
+    match = True
+    for key in criteria.keys():
+        target_val = criteria[key]
+        dicom_val = str(dicom_data.get(key, None))
+        if dicom_val not in get_criterion_values(target_val):
+            if verbose:
+                print('{} wrong type. Got "{}" instead of "{}".'.format(key, dicom_val, target_val))
+            match = False
+
+    return match
+
+
+def get_mismatch(dicom_data, criteria):
+    """Finds the first value of a dataset which does not fit one set of selection criteria.
+
+    Arguments:
+        dicom_data(Dataset): A pydicom dataset.
+        criteria(dict): A dictionary of key:value selection criteria.
+    Returns:
+        A tuple (key, dicom_val, target_val), or None if the dataset fits the criteria.
+    """
+
+    for key in criteria.keys():
+        target_val = criteria[key]
+        dicom_val = str(dicom_data.get(key, None))
+        if dicom_val not in get_criterion_values(target_val):
+            return key, dicom_val, target_val
+
+    return None
+
+
+def get_rejection_reason(dicom_data, selection_criteria):
+    """Explains why a dataset does not fit any set of selection criteria.
+
+    Arguments:
+        dicom_data(Dataset): A pydicom dataset, which may contain only the selection tags.
+        selection_criteria(list or tuple): list or tuple of dictionaries where each dictionary describes a set of key:value selection criteria.
+    Returns:
+        None if the dataset is selected, otherwise a tuple (reason, detail) where
+        reason names the first mismatched key of the first set of criteria and
+        detail gives its value.
+    """
+
+    mismatches = [get_mismatch(dicom_data, criteria) for criteria in selection_criteria]
+    if len(selection_criteria) == 0 or any(mismatch is None for mismatch in mismatches):
+        return None
+
+    key, dicom_val, target_val = mismatches[0]
+
+    return 'wrong_{}'.format(key), 'Got "{}" instead of "{}".'.format(dicom_val, target_val)
+
+
+def is_selected_header(dicom_data, selection_criteria, verbose=True):
+    """Checks if a dataset fits at least one set of selection criteria.
+
+    Arguments:
+        dicom_data(Dataset): A pydicom dataset, which may contain only the selection tags.
+        selection_criteria(list or tuple): list or tuple of dictionaries where each dictionary describes a set of key:value selection criteria.
+        verbose(bool): True to print every mismatched value.
+    Returns:
+        True if the dataset meets at least one set of selection criteria or if no selection criteria is provided.
+    """
+
+    if len(selection_criteria) == 0:
+        return True
+
+    return any(matches_criteria(dicom_data, criteria, verbose) for criteria in selection_criteria)
+
+
+def select_dicom(dicom_path, selection_criteria, tags=None, verbose=True):
+    """Checks if a dicom fits the selection criteria by reading only the selection tags.
+
+    Arguments:
+        dicom_path(str): The path to a dicom file.
+        selection_criteria(list or tuple): list or tuple of dictionaries where each dictionary describes a set of key:value selection criteria.
+        tags(list): The sorted selection tags as returned by get_selection_tags. Computed if not provided.
+        verbose(bool): True to print read errors and mismatched values.
+    Returns:
+        True if the dicom is readable and meets at least one set of selection criteria. If no
+        selection criteria is provided, returns true for all readable dicoms.
+    """
+
+    if tags is None:
+        tags = get_selection_tags(selection_criteria)
+
+    try:
+        dicom_data = read_tags(dicom_path, tags)
+    except Exception as e:
+        if verbose:
+            print(e)
+        return False
+
+    return is_selected_header(dicom_data, selection_criteria, verbose)
@@ -0,0 +1,327 @@
+"""Export of windowed images to HDF5 or memory-mapped NumPy shards for training.
+
+Training reads every image each epoch, so decoding PNGs again every time is
+wasted work. Shards hold the same windowed 16-bit pixels as the PNGs:
+
+    hdf5: each image is a chunked dataset in a shard file, named by its offset.
+    npy: each shard is a flat uint16 .npy array of fixed capacity and images
+        are stored one after another, so a loader can memory-map the shard
+        and read an image as a zero-copy view.
+
+Optionally every image is also stored downsampled by integer factors. An
+SQLite index in the shard directory maps each image and level to its
+SOPInstanceUID, accession, source path, shard, shape and offset. Index rows
+are only committed once their pixels are flushed to disk, when their shard
+is closed or the writer is flushed, so an interrupted export never indexes
+incomplete data. Requires h5py for the hdf5 format.
+"""
+
+import json
+import os
+import re
+import sqlite3
+
+import numpy as np
+
+from oncodata.dicom_to_png.pyramid import downsample_image
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+SHARD_FORMATS = ['hdf5', 'npy']
+SHARD_EXTENSIONS = {'hdf5': '.h5', 'npy': '.npy'}
+DEFAULT_SHARD_BYTES = 2 ** 30
+HDF5_CHUNK_SIZE = 256
+INDEX_NAME = 'index.sqlite'
+SHARD_NAME_PATTERN = re.compile(r'^shard-(\d+)\.(?:h5|npy)$')
+
+INDEX_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS images (
+    source_path TEXT,
+    level INTEGER,
+    sop_instance_uid TEXT,
+    accession_number TEXT,
+    shard_path TEXT,
+    shape TEXT,
+    offset INTEGER,
+    PRIMARY KEY (source_path, level)
+);
+CREATE INDEX IF NOT EXISTS images_sop_instance_uid ON images (sop_instance_uid);
+CREATE INDEX IF NOT EXISTS images_accession_number ON images (accession_number);
+'''
+INDEX_COLUMNS = ['source_path', 'level', 'sop_instance_uid', 'accession_number', 'shard_path', 'shape', 'offset']
+
+NO_FORMAT_ERR = 'Shard format {} not in SHARD_FORMATS! Available formats are {}.'
+
+
+class ShardWriter(object):
+    """Writes windowed images to shards and indexes them, used as a context manager:
+
+        with ShardWriter(shard_dir, 'npy', levels=[1, 4]) as writer:
+            writer.write(image, source_path, sop_instance_uid, accession_number)
+
+    New shards are added next to the shards of previous exports. An image
+    written again replaces its index rows, leaving its old pixels unused.
+    """
+
+    def __init__(self, shard_dir, shard_format='hdf5', shard_bytes=DEFAULT_SHARD_BYTES, levels=(1,)):
+        """Opens or creates a shard directory.
+
+        Arguments:
+            shard_dir(str): Directory of the shards and their index.
+            shard_format(str): A format in SHARD_FORMATS.
+            shard_bytes(int): Size of a shard. An npy shard is allocated with
+                this capacity, or larger if an image does not fit.
+            levels(list): Downsampling factors of the stored copies of each
+                image, 1 for the full resolution.
+        Raises:
+            ImportError if the format is hdf5 and h5py is not installed.
+        """
+
+        if shard_format not in SHARD_FORMATS:
+            raise Exception(NO_FORMAT_ERR.format(shard_format, SHARD_FORMATS))
+        if shard_format == 'hdf5' and h5py is None:
+            raise ImportError('h5py must be installed to write hdf5 shards.')
+
+        self.shard_dir = shard_dir
+        self.shard_format = shard_format
+        self.shard_bytes = shard_bytes
+        self.levels = sorted(set(levels))
+
+        os.makedirs(shard_dir, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(shard_dir, INDEX_NAME))
+        self.connection.executescript(INDEX_SCHEMA)
+
+        self.next_shard = self.get_next_shard_number()
+        self.shard = None
+        self.shard_path = None
+        self.capacity = 0
+        self.used = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_next_shard_number(self):
+        """Gets the number of the next shard, after every shard on disk or in the index.
+
+        Shards may be missing, e.g. removed or never flushed by an interrupted
+        export, so the number is one more than the largest existing number
+        rather than the number of shards, and an existing shard is never
+        overwritten.
+        """
+
+        names = os.listdir(self.shard_dir)
+        names.extend(shard_path for shard_path, in self.connection.execute('SELECT DISTINCT shard_path FROM images'))
+        numbers = [int(match.group(1)) for match in map(SHARD_NAME_PATTERN.match, names) if match is not None]
+
+        return max(numbers, default=-1) + 1
+
+    def get_parameters(self):
+        """Gets the parameters which determine the contents of the shards, e.g. for a conversion manifest."""
+
+        return {'shard_dir': os.path.abspath(self.shard_dir), 'shard_format': self.shard_format, 'levels': self.levels}
+
+    def open_shard(self, min_size):
+        """Closes the current shard and opens a new one with room for at least min_size elements or bytes."""
+
+        self.close_shard()
+
+        self.shard_path = 'shard-{:05d}{}'.format(self.next_shard, SHARD_EXTENSIONS[self.shard_format])
+        self.next_shard += 1
+        path = os.path.join(self.shard_dir, self.shard_path)
+        if self.shard_format == 'npy':
+            # Unused capacity is never written, so it takes no space on disk on most file systems
+            self.capacity = max(self.shard_bytes // np.dtype(np.uint16).itemsize, min_size)
+            self.shard = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint16, shape=(self.capacity,))
+        else:
+            self.capacity = max(self.shard_bytes, min_size)
+            self.shard = h5py.File(path, 'w')
+        self.used = 0
+
+    def close_shard(self):
+        """Flushes and closes the current shard and commits its index rows."""
+
+        if self.shard is None:
+            return
+
+        if self.shard_format == 'npy':
+            self.shard.flush()
+            del self.shard
+        else:
+            self.shard.close()
+        self.shard = None
+        self.connection.commit()
+
+    def flush(self):
+        """Flushes the images written so far to the current shard, which stays open, and commits their index rows.
+
+        Used before a manifest commit, so that the manifest never records a
+        conversion whose images are not on disk.
+        """
+
+        if self.shard is not None:
+            self.shard.flush()
+        self.connection.commit()
+
+    def write_array(self, image):
+        """Writes one array to the current shard, opening a new one if it is full.
+
+        Arguments:
+            image(np.ndarray): A 2D uint16 array.
+        Returns:
+            The offset of the array in the shard: the index of its first element
+            for npy shards and the name of its dataset for hdf5 shards.
+        """
+
+        size = image.size if self.shard_format == 'npy' else image.nbytes
+        if self.shard is None or self.used + size > self.capacity:
+            self.open_shard(size)
+
+        offset = self.used if self.shard_format == 'npy' else len(self.shard)
+        if self.shard_format == 'npy':
+            self.shard[offset:offset + size] = image.ravel()
+        else:
+            chunks = (min(HDF5_CHUNK_SIZE, image.shape[0]), min(HDF5_CHUNK_SIZE, image.shape[1]))
+            self.shard.create_dataset(str(offset), data=image, chunks=chunks)
+        self.used += size
+
+        return offset
+
+    def write(self, image, source_path, sop_instance_uid, accession_number):
+        """Writes an image, and its downsampled copies, and indexes them.
+
+        Arguments:
+            image(np.ndarray): A windowed 2D uint16 image.
+            source_path(str): Path of the DICOM the image was read from.
+            sop_instance_uid(str): The SOPInstanceUID of the DICOM.
+            accession_number(str): The AccessionNumber of the DICOM.
+        """
+
+        for level in self.levels:
+            array = np.ascontiguousarray(downsample_image(image, level), dtype=np.uint16)
+            offset = self.write_array(array)
+            self.connection.execute(
+                'INSERT OR REPLACE INTO images ({}) VALUES ({})'.format(
+                    ', '.join(INDEX_COLUMNS), ', '.join('?' * len(INDEX_COLUMNS))),
+                [source_path, level, sop_instance_uid, accession_number, self.shard_path, json.dumps(array.shape),
+                 offset])
+
+    def close(self):
+        """Closes the current shard and the index."""
+
+        self.close_shard()
+        self.connection.commit()
+        self.connection.close()
+
+
+def write_shards(rows, shard_writer):
+    """Writes the images of converted rows to shards as the rows are produced.
+
+    The image is removed from each row so that it is not kept by later consumers.
+
+    Arguments:
+        rows(iterable): Rows returned by convert_and_record, with the 'image'
+            of each converted DICOM.
+        shard_writer(ShardWriter): The writer of the shards.
+    Returns:
+        A generator of the rows.
+    """
+
+    for row in rows:
+        image = row.pop('image', None)
+        if image is not None:
+            shard_writer.write(image, row['source_path'], row['sop_instance_uid'], row.get('accession_number'))
+        yield row
+
+
+class ShardReader(object):
+    """Reads images from the shards of a shard directory, used as a context manager:
+
+        with ShardReader(shard_dir) as reader:
+            for row in reader.get_rows(accession_number=accession_number, level=4):
+                image = reader.read(row)
+    """
+
+    def __init__(self, shard_dir):
+        """Opens the index of a shard directory.
+
+        Arguments:
+            shard_dir(str): Directory of the shards and their index.
+        """
+
+        self.shard_dir = shard_dir
+        self.connection = sqlite3.connect(os.path.join(shard_dir, INDEX_NAME))
+        self.shards = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_rows(self, sop_instance_uid=None, accession_number=None, level=1):
+        """Gets the index rows of the images at one level, optionally of one DICOM or accession.
+
+        Arguments:
+            sop_instance_uid(str): Optional SOPInstanceUID of the images.
+            accession_number(str): Optional AccessionNumber of the images.
+            level(int): The downsampling factor of the images.
+        Returns:
+            A list of dictionaries with the INDEX_COLUMNS of each image, with its shape as a tuple.
+        """
+
+        query = 'SELECT {} FROM images WHERE level = ?'.format(', '.join(INDEX_COLUMNS))
+        values = [level]
+        if sop_instance_uid is not None:
+            query += ' AND sop_instance_uid = ?'
+            values.append(sop_instance_uid)
+        if accession_number is not None:
+            query += ' AND accession_number = ?'
+            values.append(accession_number)
+
+        rows = [dict(zip(INDEX_COLUMNS, row)) for row in self.connection.execute(query + ' ORDER BY source_path', values)]
+        for row in rows:
+            row['shape'] = tuple(json.loads(row['shape']))
+
+        return rows
+
+    def read(self, row):
+        """Reads an image without decoding it.
+
+        Arguments:
+            row(dict): An index row as returned by get_rows.
+        Returns:
+            A read-only view of a memory-mapped npy shard, or an h5py Dataset
+            which reads only the slices that are accessed.
+        """
+
+        shard = self.shards.get(row['shard_path'])
+        if shard is None:
+            path = os.path.join(self.shard_dir, row['shard_path'])
+            if path.endswith(SHARD_EXTENSIONS['npy']):
+                shard = np.load(path, mmap_mode='r')
+            else:
+                if h5py is None:
+                    raise ImportError('h5py must be installed to read hdf5 shards.')
+                shard = h5py.File(path, 'r')
+            self.shards[row['shard_path']] = shard
+
+        if isinstance(shard, np.ndarray):
+            size = int(np.prod(row['shape']))
+            return shard[row['offset']:row['offset'] + size].reshape(row['shape'])
+
+        return shard[str(row['offset'])]
+
+    def close(self):
+        """Closes the opened shards and the index."""
+
+        for shard in self.shards.values():
+            if not isinstance(shard, np.ndarray):
+                shard.close()
+        self.shards = {}
+        self.connection.close()
@@ -0,0 +1,125 @@
+"""A benchmark harness for the conversion and metadata extraction hot paths.
+
+Each task runs over a list of files in a fresh process pool for each number
+of workers, recording the throughput in files and megabytes per second, the
+number of files which raised an error and the peak resident memory of any
+worker, so that results of different runs and machines can be compared.
+"""
+
+from functools import partial
+from multiprocessing import Pool
+import os
+import resource
+import shutil
+from tempfile import TemporaryDirectory
+import time
+
+import pandas as pd
+
+from oncodata.dicom_metadata.get_dicom_metadata import get_dicom_metadata
+from oncodata.dicom_to_png.dicom_to_png import dicom_to_png_dcmtk, dicom_to_png_imagemagick, dicom_to_png_numpy
+from oncodata.dicom_to_png.get_slice_count import get_slice_count
+
+TASKS = {
+    'dcmtk': lambda dicom_path, image_path: dicom_to_png_dcmtk(dicom_path, image_path, skip_existing=False),
+    'imagemagick': lambda dicom_path, image_path: dicom_to_png_imagemagick(dicom_path, image_path, (),
+                                                                           skip_existing=False),
+    'numpy': lambda dicom_path, image_path: dicom_to_png_numpy(dicom_path, image_path, skip_existing=False),
+    'metadata': lambda dicom_path, image_path: get_dicom_metadata(dicom_path),
+    'slice_count': lambda dicom_path, image_path: get_slice_count(dicom_path)
+}
+# Executables a task needs, which is skipped if they are not installed
+TASK_EXECUTABLES = {'dcmtk': 'dcmj2pnm', 'imagemagick': 'convert'}
+RESULT_COLUMNS = ['task', 'workers', 'files', 'errors', 'seconds', 'files_per_sec', 'mb_per_sec', 'max_rss_mb']
+
+
+def get_max_rss():
+    """Gets the peak resident memory of this process in bytes (ru_maxrss is in kilobytes on Linux)."""
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_task(indexed_path, task, output_dir):
+    """Runs a task on one file in a worker.
+
+    Arguments:
+        indexed_path(tuple): The index of the file and its path.
+        task(str): The name of a task in TASKS.
+        output_dir(str): Directory where images are written.
+    Returns:
+        A tuple (ok, max_rss) where ok is False if the task raised an error
+        and max_rss is the peak resident memory of the worker in bytes.
+    """
+
+    index, path = indexed_path
+    try:
+        TASKS[task](path, os.path.join(output_dir, '{}.png'.format(index)))
+        ok = True
+    except Exception:
+        ok = False
+
+    return ok, get_max_rss()
+
+
+def is_task_available(task):
+    """Checks if the executable a task needs, if any, is installed."""
+
+    return task not in TASK_EXECUTABLES or shutil.which(TASK_EXECUTABLES[task]) is not None
+
+
+def benchmark_task(task, paths, num_workers, chunksize=1):
+    """Runs a task over files in a fresh pool of workers and times it.
+
+    Arguments:
+        task(str): The name of a task in TASKS.
+        paths(list): Paths to the files.
+        num_workers(int): Number of worker processes.
+        chunksize(int): Number of files sent to a worker at a time.
+    Returns:
+        A dictionary with the RESULT_COLUMNS of the run.
+    """
+
+    megabytes = sum(os.path.getsize(path) for path in paths) / 2 ** 20
+
+    with TemporaryDirectory() as output_dir:
+        with Pool(num_workers) as pool:
+            start = time.perf_counter()
+            results = list(pool.imap_unordered(partial(run_task, task=task, output_dir=output_dir),
+                                               enumerate(paths), chunksize))
+            seconds = time.perf_counter() - start
+
+    return {
+        'task': task,
+        'workers': num_workers,
+        'files': len(paths),
+        'errors': sum(not ok for ok, _ in results),
+        'seconds': seconds,
+        'files_per_sec': len(paths) / seconds,
+        'mb_per_sec': megabytes / seconds,
+        'max_rss_mb': max(max_rss for _, max_rss in results) / 2 ** 20 if results else 0
+    }
+
+
+def run_benchmarks(paths, tasks, worker_counts, chunksize=1):
+    """Runs every task at every number of workers.
+
+    Tasks whose executable is not installed are skipped.
+
+    Arguments:
+        paths(list): Paths to the files.
+        tasks(list): Names of tasks in TASKS.
+        worker_counts(list): Numbers of worker processes.
+        chunksize(int): Number of files sent to a worker at a time.
+    Returns:
+        A pandas DataFrame with one row of RESULT_COLUMNS per task and number of workers.
+    """
+
+    results = []
+    for task in tasks:
+        if not is_task_available(task):
+            print('Skipping {}: {} is not installed.'.format(task, TASK_EXECUTABLES[task]))
+            continue
+        for num_workers in worker_counts:
+            results.append(benchmark_task(task, paths, num_workers, chunksize))
+
+    return pd.DataFrame(results, columns=RESULT_COLUMNS)
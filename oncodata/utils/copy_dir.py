@@ -0,0 +1,230 @@
+"""A parallel, resumable and verified copy of a directory tree.
+
+The tree is walked lazily and files are grouped into batches as they are
+found, so copying starts immediately and walking overlaps with copying.
+Small files are batched so that per-task overhead is amortized, while each
+large file is a batch of its own. Every copy is written to a temporary path,
+verified against the size (and optionally the hash) of the source and then
+renamed into place. Copied files are appended to a JSON Lines journal so an
+interrupted copy can be resumed without checking the destination tree.
+"""
+
+from functools import partial
+import json
+import os
+
+from oncodata.utils.discovery import discover_files
+from oncodata.utils.files import atomic_output_path, copy_file, hash_file
+from oncodata.utils.parallel import DEFAULT_MAX_IN_FLIGHT, bounded_imap_unordered
+
+COPIED = 'copied'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+DEFAULT_BATCH_FILES = 256
+DEFAULT_BATCH_BYTES = 64 * 2 ** 20
+
+
+def get_journal_path(dest_dir):
+    """Gets the default journal path, next to the destination directory.
+
+    Arguments:
+        dest_dir(str): The directory where files are copied to.
+    Returns:
+        The path of the journal.
+    """
+
+    return os.path.normpath(dest_dir) + '.copy_journal.jsonl'
+
+
+def get_dest_path(source_path, source_dir, dest_dir):
+    """Maps a path under source_dir to the same relative path under dest_dir.
+
+    Arguments:
+        source_path(str): Path to a file under source_dir.
+        source_dir(str): The directory with files to copy.
+        dest_dir(str): The directory where the files will be copied to.
+    Returns:
+        The destination path.
+    """
+
+    return os.path.join(dest_dir, os.path.relpath(source_path, source_dir))
+
+
+def read_journal(journal_path):
+    """Reads the files recorded as copied by previous runs.
+
+    Arguments:
+        journal_path(str): Path to the journal.
+    Returns:
+        A dictionary mapping path relative to the source directory
+        to a tuple (size, mtime) of the source when it was copied.
+    """
+
+    copied = {}
+    if not os.path.exists(journal_path):
+        return copied
+
+    with open(journal_path, 'r') as journal_file:
+        for line in journal_file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue # Line truncated by a crash
+            copied[entry['path']] = (entry['size'], entry['mtime'])
+
+    return copied
+
+
+def get_batches(files, batch_files=DEFAULT_BATCH_FILES, batch_bytes=DEFAULT_BATCH_BYTES):
+    """Groups files into batches of at most batch_files files or about batch_bytes bytes.
+
+    A file of at least batch_bytes bytes is a batch of its own.
+
+    Arguments:
+        files(iterable): (path, size, mtime) tuples.
+        batch_files(int): Maximum number of files per batch.
+        batch_bytes(int): Number of bytes after which a batch is closed.
+    Returns:
+        A generator of lists of (path, size, mtime) tuples.
+    """
+
+    batch = []
+    num_bytes = 0
+    for path, size, mtime in files:
+        if size >= batch_bytes:
+            yield [(path, size, mtime)]
+            continue
+        batch.append((path, size, mtime))
+        num_bytes += size
+        if len(batch) == batch_files or num_bytes >= batch_bytes:
+            yield batch
+            batch = []
+            num_bytes = 0
+    if len(batch) > 0:
+        yield batch
+
+
+def copy_and_verify(source_path, dest_path, verify_hash=False):
+    """Copies a file atomically and verifies the copy.
+
+    Arguments:
+        source_path(str): Path to a file to be copied.
+        dest_path(str): Path to the copy.
+        verify_hash(bool): True to also compare the SHA-1 hashes
+            of the source and the copy.
+    Returns:
+        The SHA-1 hash of the copy if verify_hash and otherwise None.
+    Raises:
+        IOError if the copy does not match the source.
+    """
+
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+
+    with atomic_output_path(dest_path) as temp_path:
+        size = copy_file(source_path, temp_path)
+        if size != os.path.getsize(source_path):
+            raise IOError('Copy of {} has {} bytes instead of {}.'.format(source_path, size, os.path.getsize(source_path)))
+
+        dest_hash = None
+        if verify_hash:
+            dest_hash = hash_file(temp_path)
+            if dest_hash != hash_file(source_path):
+                raise IOError('Copy of {} does not match its hash.'.format(source_path))
+
+    return dest_hash
+
+
+def copy_batch(batch, source_dir, dest_dir, verify_hash=False):
+    """Copies a batch of files.
+
+    Arguments:
+        batch(list): (path, size, mtime) tuples of files under source_dir.
+        source_dir(str): The directory with files to copy.
+        dest_dir(str): The directory where the files will be copied to.
+        verify_hash(bool): True to verify copies by hash as well as size.
+    Returns:
+        A list of dictionaries with the relative path, size, mtime, hash,
+        status and error of each file.
+    """
+
+    results = []
+    for source_path, size, mtime in batch:
+        result = {'path': os.path.relpath(source_path, source_dir), 'size': size, 'mtime': mtime,
+                  'hash': None, 'status': FAILED, 'error': None}
+        try:
+            result['hash'] = copy_and_verify(source_path, get_dest_path(source_path, source_dir, dest_dir), verify_hash)
+            result['status'] = COPIED
+        except Exception as e:
+            result['error'] = str(e)
+        results.append(result)
+
+    return results
+
+
+def copy_dir_parallel(source_dir, dest_dir, journal_path=None, verify_hash=False, skip_existing=True,
+                      batch_files=DEFAULT_BATCH_FILES, batch_bytes=DEFAULT_BATCH_BYTES,
+                      max_in_flight=DEFAULT_MAX_IN_FLIGHT, num_processes=None, index_path=None):
+    """Copies all files from one directory to another, preserving directory structure.
+
+    A file is skipped if the journal records that it was copied with the same
+    size and modification time and its copy exists, or, if skip_existing,
+    if a file with the same size already exists at its destination.
+
+    Arguments:
+        source_dir(str): The directory with files to copy.
+        dest_dir(str): The directory where the files will be copied to.
+        journal_path(str): Path to the resume journal. Defaults to get_journal_path(dest_dir).
+        verify_hash(bool): True to verify copies by hash as well as size.
+        skip_existing(bool): True to skip files which already exist at the
+            destination with the same size, even if not in the journal.
+        batch_files(int): Maximum number of small files copied per task.
+        batch_bytes(int): Number of bytes after which a batch is closed.
+        max_in_flight(int): Maximum number of batches submitted but not yet finished.
+        num_processes(int): Number of worker processes. Defaults to the number of CPUs.
+        index_path(str): Optional path to a persistent index of the source tree
+            used to skip listing unchanged directories.
+    Returns:
+        A dictionary mapping status to number of files, and 'bytes' to the
+        number of bytes copied.
+    """
+
+    journal_path = journal_path or get_journal_path(dest_dir)
+    copied = read_journal(journal_path)
+    counts = {COPIED: 0, SKIPPED: 0, FAILED: 0, 'bytes': 0}
+
+    def pending_files():
+        for source_path, size, mtime, _ in discover_files(source_dir, index_path):
+            dest_path = get_dest_path(source_path, source_dir, dest_dir)
+            relative_path = os.path.relpath(source_path, source_dir)
+            if copied.get(relative_path) == (size, mtime) or skip_existing:
+                try:
+                    if os.path.getsize(dest_path) == size:
+                        counts[SKIPPED] += 1
+                        continue
+                except OSError:
+                    pass
+            yield source_path, size, mtime
+
+    copy = partial(copy_batch, source_dir=source_dir, dest_dir=dest_dir, verify_hash=verify_hash)
+    batches = get_batches(pending_files(), batch_files, batch_bytes)
+
+    with open(journal_path, 'ab+') as journal_file:
+        # Terminate a line left unfinished by a crash so it is skipped when reading
+        if journal_file.tell() > 0:
+            journal_file.seek(-1, os.SEEK_END)
+            if journal_file.read(1) != b'\n':
+                journal_file.write(b'\n')
+
+    with open(journal_path, 'a') as journal_file:
+        for results in bounded_imap_unordered(copy, batches, max_in_flight, num_processes):
+            for result in results:
+                counts[result['status']] += 1
+                if result['status'] == COPIED:
+                    counts['bytes'] += result['size']
+                    journal_file.write(json.dumps({key: result[key] for key in ['path', 'size', 'mtime', 'hash']}) + '\n')
+                else:
+                    print('Failed to copy {}: {}'.format(result['path'], result['error']))
+            journal_file.flush()
+
+    return counts
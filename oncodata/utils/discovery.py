@@ -0,0 +1,320 @@
+"""Streaming discovery of the files in a directory tree, with an optional persistent index.
+
+Directories are listed with os.scandir by a pool of threads, which overlap
+the latency of listing directories on network file systems, and files are
+yielded as soon as their directory has been listed so work can start before
+the whole tree has been walked.
+
+The index is a SQLite database recording the modification time of every
+directory and the path, size and modification time of every file (and
+optionally whether it is a DICOM). A directory whose modification time is
+unchanged since the last run is not listed again and its files and
+subdirectories are read from the index. Each directory also records which
+classifier, and which file extension, its files were classified with, so
+that its files are classified again when either changes. Note that the modification time of
+a directory only changes when entries are added, removed or renamed, so
+files which are modified in place keep their indexed size and mtime.
+"""
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+import os
+import sqlite3
+
+DEFAULT_NUM_THREADS = 16
+# Maximum number of directories being listed, or listed but not yet consumed, at once
+DEFAULT_MAX_PENDING = 256
+COMMIT_EVERY = 1000
+
+INDEX_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime REAL,
+    classified TEXT
+);
+CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    directory TEXT,
+    size INTEGER,
+    mtime REAL,
+    is_dicom INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+'''
+
+
+def get_classifier_key(classify, extension=''):
+    """Describes a classifier and the files it is applied to, to detect when either changes.
+
+    Arguments:
+        classify(function): A function of a file path returning True if the
+            file is a DICOM, possibly a functools.partial, or None.
+        extension(str): Only files ending with this extension are classified.
+    Returns:
+        A string naming the function, its bound arguments and the extension,
+        or None if classify is None.
+    """
+
+    if classify is None:
+        return None
+
+    args, keywords = (), {}
+    if isinstance(classify, partial):
+        classify, args, keywords = classify.func, classify.args, classify.keywords
+    name = '{}.{}'.format(getattr(classify, '__module__', None), getattr(classify, '__qualname__', repr(classify)))
+    arguments = [repr(arg) for arg in args] + ['{}={!r}'.format(key, keywords[key]) for key in sorted(keywords)]
+
+    return '{}({}) {}'.format(name, ', '.join(arguments), extension)
+
+
+def scan_directory(directory, indexed_mtime=None, classify=None, extension=''):
+    """Lists a directory unless its modification time matches the index.
+
+    Arguments:
+        directory(str): Path to a directory.
+        indexed_mtime(float): The modification time of the directory
+            recorded in the index, or None if it is not indexed.
+        classify(function): An optional function of a file path returning
+            True if the file is a DICOM.
+        extension(str): Only files ending with this extension are
+            classified, the others have is_dicom None.
+    Returns:
+        A tuple (directory, mtime, files, subdirectories) where files is a list
+        of (path, size, mtime, is_dicom) tuples and subdirectories is a list of
+        paths, or both are None if the directory is unchanged.
+    """
+
+    mtime = os.stat(directory).st_mtime
+    if mtime == indexed_mtime:
+        return directory, mtime, None, None
+
+    files = []
+    subdirectories = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.path)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    is_dicom = None
+                    if classify is not None and entry.path.endswith(extension):
+                        is_dicom = classify(entry.path)
+                    files.append((entry.path, stat.st_size, stat.st_mtime, is_dicom))
+            except OSError:
+                # Removed while listing or unreadable
+                continue
+
+    return directory, mtime, files, subdirectories
+
+
+def get_descendant_range(directory):
+    """Gets the bounds of the paths strictly inside a directory, for range queries."""
+
+    return directory + os.sep, directory + chr(ord(os.sep) + 1)
+
+
+class FileIndex(object):
+    """A SQLite index of a directory tree, used as a context manager."""
+
+    def __init__(self, index_path):
+        """Opens or creates an index.
+
+        Arguments:
+            index_path(str): Path to the SQLite index.
+        """
+
+        self.connection = sqlite3.connect(index_path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(INDEX_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Commits pending changes and closes the index."""
+
+        self.connection.commit()
+        self.connection.close()
+
+    def get_mtime(self, directory, classifier):
+        """Gets the indexed modification time of a directory.
+
+        Arguments:
+            directory(str): Path to a directory.
+            classifier(str): The key of the classifier the files must have
+                been classified with, as returned by get_classifier_key, or
+                None if they need not be classified.
+        Returns:
+            The modification time, or None if the directory is not indexed
+            (or its files were not classified with classifier but need to be).
+        """
+
+        row = self.connection.execute('SELECT mtime, classified FROM directories WHERE path = ?', [directory]).fetchone()
+        if row is None or (classifier is not None and row[1] != classifier):
+            return None
+
+        return row[0]
+
+    def get_children(self, directory, classifier=None):
+        """Gets the indexed files and subdirectories of a directory.
+
+        Arguments:
+            directory(str): Path to a directory.
+            classifier(str): The key of the classifier the files must have
+                been classified with, or None.
+        Returns:
+            A tuple (files, subdirectories) where files is a list of (path, size,
+            mtime, is_dicom) tuples and subdirectories maps path to indexed mtime
+            as returned by get_mtime.
+        """
+
+        files = self.connection.execute(
+            'SELECT path, size, mtime, is_dicom FROM files WHERE directory = ?', [directory]).fetchall()
+        subdirectories = {path: None if classifier is not None and classified != classifier else mtime
+                          for path, mtime, classified in
+                          self.connection.execute('SELECT path, mtime, classified FROM directories WHERE parent = ?',
+                                                  [directory])}
+
+        return [(path, size, mtime, None if is_dicom is None else bool(is_dicom))
+                for path, size, mtime, is_dicom in files], subdirectories
+
+    def remove_tree(self, directory):
+        """Removes a directory and everything inside it from the index."""
+
+        start, end = get_descendant_range(directory)
+        self.connection.execute('DELETE FROM directories WHERE path = ? OR (path >= ? AND path < ?)',
+                                [directory, start, end])
+        self.connection.execute('DELETE FROM files WHERE directory = ? OR (directory >= ? AND directory < ?)',
+                                [directory, start, end])
+
+    def update(self, directory, parent, mtime, files, subdirectories, classifier):
+        """Replaces the indexed contents of a directory which was listed.
+
+        Arguments:
+            directory(str): Path to the directory.
+            parent(str): Path to its parent directory, or None for the root.
+            mtime(float): The modification time of the directory.
+            files(list): (path, size, mtime, is_dicom) tuples of its files.
+            subdirectories(list): Paths to its subdirectories.
+            classifier(str): The key of the classifier the files were
+                classified with, or None if they were not classified.
+        Returns:
+            A dictionary mapping each subdirectory to its indexed mtime or None.
+        """
+
+        _, indexed_subdirectories = self.get_children(directory, classifier)
+        for removed in set(indexed_subdirectories) - set(subdirectories):
+            self.remove_tree(removed)
+
+        self.connection.execute('DELETE FROM files WHERE directory = ?', [directory])
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO files (path, directory, size, mtime, is_dicom) VALUES (?, ?, ?, ?, ?)',
+            [(path, directory, size, file_mtime, is_dicom) for path, size, file_mtime, is_dicom in files])
+        self.connection.execute(
+            'INSERT OR REPLACE INTO directories (path, parent, mtime, classified) VALUES (?, ?, ?, ?)',
+            [directory, parent, mtime, classifier])
+
+        return {subdirectory: indexed_subdirectories.get(subdirectory) for subdirectory in subdirectories}
+
+    def commit(self):
+        """Commits the changes made so far."""
+
+        self.connection.commit()
+
+
+def discover_files(directory, index_path=None, classify=None, num_threads=DEFAULT_NUM_THREADS,
+                   max_pending=DEFAULT_MAX_PENDING, extension=''):
+    """Yields the files in a directory tree as their directories are listed.
+
+    Arguments:
+        directory(str): The root of the tree.
+        index_path(str): Optional path to a persistent index, created if it
+            does not exist, used to skip listing unchanged directories.
+        classify(function): An optional function of a file path
+            returning True if the file is a DICOM. Its results are stored
+            in the index and reused for unchanged directories which were
+            classified with the same function, arguments and extension.
+        num_threads(int): Number of threads listing directories.
+        max_pending(int): Maximum number of directories being listed, or
+            listed but not yet consumed, at once.
+        extension(str): Only files ending with this extension are classified.
+    Returns:
+        A generator of (path, size, mtime, is_dicom) tuples in no particular
+        order, where is_dicom is None if classify is None or the file does
+        not end with extension.
+    """
+
+    index = FileIndex(index_path) if index_path is not None else None
+    parents = {}
+    waiting = deque()
+    num_updates = 0
+    classifier = get_classifier_key(classify, extension)
+
+    try:
+        waiting.append((directory, index.get_mtime(directory, classifier) if index else None))
+        parents[directory] = None
+
+        with ThreadPoolExecutor(num_threads) as executor:
+            pending = set()
+            while waiting or pending:
+                while waiting and len(pending) < max_pending:
+                    subdirectory, indexed_mtime = waiting.popleft()
+                    pending.add(executor.submit(scan_directory, subdirectory, indexed_mtime, classify,
+                                                 extension))
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        scanned_directory, mtime, files, subdirectories = future.result()
+                    except OSError as e:
+                        print('Could not list directory: {}'.format(e))
+                        continue
+                    parent = parents.pop(scanned_directory)
+
+                    if files is None:
+                        files, subdirectory_mtimes = index.get_children(scanned_directory, classifier)
+                    elif index is not None:
+                        subdirectory_mtimes = index.update(scanned_directory, parent, mtime, files, subdirectories,
+                                                           classifier)
+                        num_updates += 1
+                        if num_updates % COMMIT_EVERY == 0:
+                            index.commit()
+                    else:
+                        subdirectory_mtimes = {subdirectory: None for subdirectory in subdirectories}
+
+                    for subdirectory, indexed_mtime in subdirectory_mtimes.items():
+                        parents[subdirectory] = scanned_directory
+                        waiting.append((subdirectory, indexed_mtime))
+
+                    for file in files:
+                        yield file
+    finally:
+        if index is not None:
+            index.close()
+
+
+def discover_paths(directory, extension='', index_path=None, classify=None, num_threads=DEFAULT_NUM_THREADS):
+    """Yields the paths of the files in a directory tree which end with an extension.
+
+    Arguments:
+        directory(str): The root of the tree.
+        extension(str): Only paths ending with this extension are yielded.
+        index_path(str): Optional path to a persistent index.
+        classify(function): An optional function of a file path returning
+            True if the file is a DICOM, only applied to the paths ending
+            with extension. Only DICOMs are yielded if given.
+        num_threads(int): Number of threads listing directories.
+    Returns:
+        A generator of file paths.
+    """
+
+    for path, _, _, is_dicom in discover_files(directory, index_path, classify, num_threads, extension=extension):
+        if path.endswith(extension) and (classify is None or is_dicom):
+            yield path
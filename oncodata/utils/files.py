@@ -0,0 +1,190 @@
+"""Helpers for writing, hashing and copying files."""
+
+import contextlib
+import errno
+import hashlib
+import os
+import shutil
+import uuid
+
+HASH_BLOCK_SIZE = 2 ** 20
+# Maximum number of bytes requested per copy_file_range or sendfile call
+COPY_BLOCK_SIZE = 2 ** 30
+# Errors raised when a zero-copy system call is not supported for a pair of files
+UNSUPPORTED_COPY_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF}
+
+
+def get_temp_path(path):
+    """Gets a unique hidden temporary path next to path, with the same extension.
+
+    Arguments:
+        path(str): The final path of an output.
+    Returns:
+        The temporary path.
+    """
+
+    directory, filename = os.path.split(path)
+    _, extension = os.path.splitext(filename)
+
+    return os.path.join(directory, '.{}.{}{}'.format(filename, uuid.uuid4().hex, extension))
+
+
+@contextlib.contextmanager
+def atomic_output_path(path):
+    """Yields a temporary path which is renamed to path if the block succeeds.
+
+    The temporary path is in the same directory as path so that the rename
+    is atomic and a partially written file never appears at path. It keeps
+    the extension of path since some tools choose the output format from it.
+
+    Arguments:
+        path(str): The final path of the output.
+    """
+
+    temp_path = get_temp_path(path)
+
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+@contextlib.contextmanager
+def atomic_output_dir(path):
+    """Yields a temporary directory which replaces the directory at path if the block succeeds.
+
+    Like atomic_output_path, but for outputs made of several files, so that a
+    partially written set of files never appears at path.
+
+    Arguments:
+        path(str): The final path of the output directory.
+    """
+
+    directory, name = os.path.split(os.path.normpath(path))
+    temp_path = os.path.join(directory, '.{}.{}'.format(name, uuid.uuid4().hex))
+    os.makedirs(temp_path)
+
+    try:
+        yield temp_path
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            shutil.rmtree(temp_path)
+
+
+def hash_output(path):
+    """Computes the SHA-1 hash of a file, or of the names and hashes of the files in a directory.
+
+    Arguments:
+        path(str): Path to a file or a directory.
+    Returns:
+        The hex digest.
+    """
+
+    if not os.path.isdir(path):
+        return hash_file(path)
+
+    sha1 = hashlib.sha1()
+    for name in sorted(os.listdir(path)):
+        sha1.update('{} {}\n'.format(name, hash_output(os.path.join(path, name))).encode('utf-8'))
+
+    return sha1.hexdigest()
+
+
+def hash_file(path):
+    """Computes the SHA-1 hash of a file.
+
+    Arguments:
+        path(str): Path to a file.
+    Returns:
+        The hex digest of the file contents.
+    """
+
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            sha1.update(block)
+
+    return sha1.hexdigest()
+
+
+def zero_copy(copy_call, source_fd, dest_fd, size):
+    """Copies size bytes between file descriptors with a zero-copy system call.
+
+    Arguments:
+        copy_call(function): os.copy_file_range or os.sendfile.
+        source_fd(int): A file descriptor open for reading at offset 0.
+        dest_fd(int): A file descriptor open for writing at offset 0.
+        size(int): The number of bytes to copy.
+    Returns:
+        True if the file was copied, False if the system call is not
+        supported for these files and nothing was copied.
+    """
+
+    offset = 0
+    while offset < size:
+        try:
+            if copy_call is os.sendfile:
+                copied = os.sendfile(dest_fd, source_fd, offset, min(COPY_BLOCK_SIZE, size - offset))
+            else:
+                copied = os.copy_file_range(source_fd, dest_fd, min(COPY_BLOCK_SIZE, size - offset))
+        except OSError as e:
+            if offset == 0 and e.errno in UNSUPPORTED_COPY_ERRNOS:
+                return False
+            raise
+        if copied == 0:
+            break
+        offset += copied
+
+    return True
+
+
+def copy_file(source_path, dest_path):
+    """Copies the contents of a file without passing them through user space if possible.
+
+    Tries os.copy_file_range, which can share blocks or copy on the server on
+    some file systems, then os.sendfile and falls back to a buffered copy.
+
+    Arguments:
+        source_path(str): Path to the file to copy.
+        dest_path(str): Path to the copy.
+    Returns:
+        The number of bytes copied.
+    """
+
+    with open(source_path, 'rb') as source_file, open(dest_path, 'wb') as dest_file:
+        size = os.fstat(source_file.fileno()).st_size
+
+        for copy_call in [getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)]:
+            if copy_call is not None and zero_copy(copy_call, source_file.fileno(), dest_file.fileno(), size):
+                return os.fstat(dest_file.fileno()).st_size
+
+        shutil.copyfileobj(source_file, dest_file, HASH_BLOCK_SIZE)
+
+    return os.path.getsize(dest_path)
+
+
+def link_or_copy(source_path, dest_path):
+    """Atomically creates dest_path as a hard link to source_path, or as a copy if they cannot be linked.
+
+    Files on different file systems, or on file systems without hard links,
+    are copied with copy_file.
+
+    Arguments:
+        source_path(str): Path to an existing file.
+        dest_path(str): Path of the link, replaced if it exists.
+    Returns:
+        True if a hard link was created, False if the file was copied.
+    """
+
+    with atomic_output_path(dest_path) as temp_path:
+        try:
+            os.link(source_path, temp_path)
+            return True
+        except OSError:
+            copy_file(source_path, temp_path)
+            return False
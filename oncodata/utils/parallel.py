@@ -0,0 +1,82 @@
+"""Helpers for running work over a process pool."""
+
+import contextlib
+from multiprocessing import Pool
+import signal
+import threading
+
+from tqdm import tqdm
+
+DEFAULT_MAX_IN_FLIGHT = 1024
+
+
+class TaskTimeoutError(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def time_limit(seconds):
+    """Raises TaskTimeoutError in the block if it runs for longer than seconds.
+
+    Uses SIGALRM, so it only applies in the main thread of a process, such as
+    a pool worker, and cannot interrupt a system call which does not return
+    (e.g. a read from a hung network file system). Subprocesses started with
+    subprocess.run or check_output are killed when the error is raised.
+
+    Arguments:
+        seconds(float): The time limit, or None for no limit.
+    """
+
+    if seconds is None or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def timeout(signum, frame):
+        raise TaskTimeoutError('Timed out after {} seconds.'.format(seconds))
+
+    previous_handler = signal.signal(signal.SIGALRM, timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+def bounded_imap_unordered(func, iterable, max_in_flight=DEFAULT_MAX_IN_FLIGHT, num_processes=None, total=None,
+                           chunksize=1, max_tasks_per_child=None):
+    """Maps a function over an iterable in a process pool, yielding results as they finish.
+
+    Unlike p_uimap, at most max_in_flight items are taken from the iterable
+    before their results have been consumed, so a lazy iterable is never fully
+    materialized and results which are not consumed quickly do not pile up
+    in memory.
+
+    Arguments:
+        func(function): A picklable function of one argument.
+        iterable(iterable): The arguments to map over.
+        max_in_flight(int): Maximum number of items submitted but not yet consumed.
+            At least chunksize.
+        num_processes(int): Number of worker processes. Defaults to the number of CPUs.
+        total(int): The number of items, if known, for the progress bar.
+        chunksize(int): Number of items sent to a worker at a time. Larger chunks
+            amortize the cost of dispatching cheap tasks.
+        max_tasks_per_child(int): Number of chunks after which a worker is replaced
+            by a new process, releasing any memory it leaked, or None to keep workers.
+    Returns:
+        A generator of results in completion order.
+    """
+
+    slots = threading.BoundedSemaphore(max(max_in_flight, chunksize))
+
+    def bounded(items):
+        # Runs in the pool's task handler thread, which blocks here once
+        # max_in_flight results are outstanding.
+        for item in items:
+            slots.acquire()
+            yield item
+
+    with Pool(num_processes, maxtasksperchild=max_tasks_per_child) as pool:
+        for result in tqdm(pool.imap_unordered(func, bounded(iterable), chunksize), total=total):
+            slots.release()
+            yield result
@@ -0,0 +1,227 @@
+"""Read-ahead of input files in threads, overlapping slow reads with their conversion.
+
+On a network file system the workers of a conversion pool wait for the
+bytes of each DICOM before they can decode it. The Prefetcher reads the
+upcoming files in a thread pool while earlier files are being converted, so
+that a worker finds its file in the page cache. Files are read in order and
+the total size of the files which were read ahead but not yet converted is
+kept under a byte budget, so that read-ahead never evicts files from the
+page cache before they are used:
+
+    with Prefetcher(budget_bytes) as prefetcher:
+        for row in prefetcher.release_rows(pool.imap(convert, prefetcher.prefetch(paths))):
+            ...
+
+A file is released from the budget once its row has been consumed. The
+first min_files files held are admitted whatever their size, so that a
+file larger than the whole budget, or a chunk of files sent to one worker,
+is never waiting for files which cannot be released before it.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_PREFETCH_BYTES = 2 ** 30
+DEFAULT_PREFETCH_THREADS = 8
+DEFAULT_PREFETCH_FILES = 1024
+READ_BLOCK_SIZE = 2 ** 20
+# Seconds between checks of whether the prefetcher was closed while waiting
+POLL_INTERVAL = 0.1
+
+
+def read_file(path):
+    """Reads a file into the page cache, discarding its bytes.
+
+    Arguments:
+        path(str): The path of the file.
+    Returns:
+        The number of bytes read, or 0 if the file could not be read, in
+        which case the conversion reports the error.
+    """
+
+    buffer = bytearray(READ_BLOCK_SIZE)
+    num_bytes = 0
+    try:
+        with open(path, 'rb', buffering=0) as f:
+            while True:
+                size = f.readinto(buffer)
+                if not size:
+                    break
+                num_bytes += size
+    except OSError:
+        pass
+
+    return num_bytes
+
+
+class Prefetcher(object):
+    """Reads files ahead of their consumer under a byte budget, used as a context manager."""
+
+    def __init__(self, budget_bytes=DEFAULT_PREFETCH_BYTES, num_threads=DEFAULT_PREFETCH_THREADS,
+                 max_files=DEFAULT_PREFETCH_FILES, get_path=None, min_files=1):
+        """Creates a prefetcher.
+
+        Arguments:
+            budget_bytes(int): Maximum total size of the files read ahead and not yet released.
+            num_threads(int): Number of threads reading files.
+            max_files(int): Maximum number of files read ahead and not yet consumed.
+            get_path(function): Gets the path of the file of an item, or None
+                if the items are paths, e.g. operator.itemgetter(0) for
+                (dicom_path, image_path) pairs.
+            min_files(int): Number of held files under which files are read
+                whatever the budget, at least the chunksize of the consumer.
+        """
+
+        self.budget_bytes = budget_bytes
+        self.max_files = max_files
+        self.min_files = min_files
+        self.get_path = get_path or (lambda item: item)
+        self.executor = ThreadPoolExecutor(num_threads)
+        self.condition = threading.Condition()
+        self.held = {}
+        self.held_bytes = 0
+        self.held_files = 0
+        self.closed = threading.Event()
+        self.thread = None
+        self.stats = {'files': 0, 'bytes': 0, 'read_seconds': 0.0, 'wait_seconds': 0.0, 'budget_wait_seconds': 0.0,
+                      'peak_bytes': 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def acquire(self, path, size):
+        """Waits until a file fits in the budget and holds its size.
+
+        Returns:
+            False if the prefetcher was closed while waiting, True otherwise.
+        """
+
+        start_time = time.perf_counter()
+        with self.condition:
+            while self.held_files >= self.min_files and self.held_bytes + size > self.budget_bytes:
+                if self.closed.is_set():
+                    return False
+                self.condition.wait(POLL_INTERVAL)
+            self.held.setdefault(path, []).append(size)
+            self.held_bytes += size
+            self.held_files += 1
+            self.stats['peak_bytes'] = max(self.stats['peak_bytes'], self.held_bytes)
+            self.stats['budget_wait_seconds'] += time.perf_counter() - start_time
+
+        return True
+
+    def release(self, path):
+        """Releases the size of a file which was consumed, if it was held."""
+
+        with self.condition:
+            sizes = self.held.get(path)
+            if not sizes:
+                return
+            self.held_bytes -= sizes.pop()
+            self.held_files -= 1
+            if len(sizes) == 0:
+                del self.held[path]
+            self.condition.notify_all()
+
+    def read(self, path):
+        """Reads a file in a thread of the pool and records the time it took."""
+
+        start_time = time.perf_counter()
+        num_bytes = read_file(path)
+        with self.condition:
+            self.stats['files'] += 1
+            self.stats['bytes'] += num_bytes
+            self.stats['read_seconds'] += time.perf_counter() - start_time
+
+    def put(self, ready, entry):
+        """Puts an entry in the queue of items read ahead, unless the prefetcher is closed."""
+
+        while not self.closed.is_set():
+            try:
+                ready.put(entry, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def admit(self, items, ready):
+        """Runs in a thread, starting the read of each item in order as soon as it fits in the budget."""
+
+        try:
+            for item in items:
+                path = self.get_path(item)
+                try:
+                    size = os.stat(path).st_size
+                except OSError:
+                    size = 0
+                if not self.acquire(path, size) or not self.put(ready, (item, self.executor.submit(self.read, path))):
+                    return
+            self.put(ready, None)
+        except Exception as e:
+            self.put(ready, e)
+
+    def prefetch(self, items):
+        """Yields items in order once their file has been read, while the files of the next items are read ahead.
+
+        Arguments:
+            items(iterable): The items, e.g. paths or (dicom_path, image_path) pairs.
+        Returns:
+            A generator of the items. Each item must be released by release or
+            release_rows once it is consumed, or read-ahead stops at the budget.
+        """
+
+        ready = queue.Queue(self.max_files)
+        self.thread = threading.Thread(target=self.admit, args=(items, ready), daemon=True)
+        self.thread.start()
+
+        while True:
+            start_time = time.perf_counter()
+            entry = ready.get()
+            if isinstance(entry, Exception):
+                raise entry
+            if entry is not None:
+                entry[1].result()
+            self.stats['wait_seconds'] += time.perf_counter() - start_time
+            if entry is None:
+                return
+            yield entry[0]
+
+    def release_rows(self, rows, key='source_path'):
+        """Releases the file of every row as the rows are consumed.
+
+        Arguments:
+            rows(iterable): Rows with the path of their file in key.
+            key(str): The key of the path in each row.
+        Returns:
+            A generator of the rows.
+        """
+
+        for row in rows:
+            self.release(row[key])
+            yield row
+
+    def print_summary(self):
+        """Prints the bytes read ahead and how long the consumer waited for them."""
+
+        stats = self.stats
+        print('Prefetch: read {} files, {:.2f} MB in {:.2f} s of reads, peak {:.2f} MB held, {:.2f} s waiting for '
+              'the budget, consumer starved for {:.2f} s'.format(
+                  stats['files'], stats['bytes'] / 2 ** 20, stats['read_seconds'], stats['peak_bytes'] / 2 ** 20,
+                  stats['budget_wait_seconds'], stats['wait_seconds']))
+
+    def close(self):
+        """Stops reading ahead and waits for the reads in progress."""
+
+        self.closed.set()
+        with self.condition:
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+        self.executor.shutdown(wait=True)
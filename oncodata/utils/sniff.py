@@ -0,0 +1,70 @@
+"""Fast detection of DICOM files from their first bytes.
+
+A DICOM file starts with a 128 byte preamble followed by the magic bytes
+'DICM', so a file can be recognized by reading its first 132 bytes instead
+of parsing it. Some older files have no preamble and start directly with a
+data element; these can optionally be recognized from their first element.
+"""
+
+import struct
+
+DICOM_PREAMBLE_LENGTH = 128
+DICOM_MAGIC = b'DICM'
+SNIFF_LENGTH = DICOM_PREAMBLE_LENGTH + len(DICOM_MAGIC)
+
+# Groups of the first data element of a DICOM without a preamble: file meta information or identifying elements
+FIRST_ELEMENT_GROUPS = {0x0002, 0x0008}
+# Upper bound on the length of the first element of an implicit VR DICOM without a preamble
+MAX_FIRST_ELEMENT_LENGTH = 2 ** 16
+EXPLICIT_VRS = {b'AE', b'AS', b'AT', b'CS', b'DA', b'DS', b'DT', b'FL', b'FD', b'IS', b'LO', b'LT', b'OB', b'OD',
+                b'OF', b'OL', b'OV', b'OW', b'PN', b'SH', b'SL', b'SQ', b'SS', b'ST', b'SV', b'TM', b'UC', b'UI',
+                b'UL', b'UN', b'UR', b'US', b'UT', b'UV'}
+
+
+def is_dicom_without_preamble(header):
+    """Checks if bytes look like the first data element of a DICOM without a preamble.
+
+    Arguments:
+        header(bytes): The first bytes of a file.
+    Returns:
+        True if the bytes start with a little endian element in the file meta
+        or identifying group with either an explicit VR or a plausible
+        implicit VR length.
+    """
+
+    if len(header) < 8:
+        return False
+
+    group, _ = struct.unpack('<HH', header[:4])
+    if group not in FIRST_ELEMENT_GROUPS:
+        return False
+    if header[4:6] in EXPLICIT_VRS:
+        return True
+
+    length, = struct.unpack('<I', header[4:8])
+
+    return length < MAX_FIRST_ELEMENT_LENGTH
+
+
+def is_dicom_file(path, allow_no_preamble=False):
+    """Checks if a file is a DICOM by reading only its first 132 bytes.
+
+    Arguments:
+        path(str): Path to a file.
+        allow_no_preamble(bool): True to also accept files without a
+            preamble and 'DICM' magic which start with a plausible
+            data element, as written by some older implicit VR devices.
+    Returns:
+        True if the file looks like a DICOM.
+    """
+
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(SNIFF_LENGTH)
+    except OSError:
+        return False
+
+    if header[DICOM_PREAMBLE_LENGTH:SNIFF_LENGTH] == DICOM_MAGIC:
+        return True
+
+    return allow_no_preamble and is_dicom_without_preamble(header)
@@ -0,0 +1,174 @@
+"""Synthesis of reproducible DICOM corpora for benchmarks.
+
+Corpora mix mammograms of several sizes and transfer syntaxes, MR slices,
+multi-frame tomosynthesis volumes and files which are not DICOMs. Pixel
+data is a smooth gradient with noise so that it compresses roughly like a
+real image. The same seed always produces the same files.
+"""
+
+import os
+
+import numpy as np
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import (DeflatedExplicitVRLittleEndian, ExplicitVRLittleEndian, ImplicitVRLittleEndian, RLELossless,
+                         generate_uid)
+
+MAMMOGRAPHY_SOP_CLASS_UID = '1.2.840.10008.5.1.4.1.1.1.2'
+MR_SOP_CLASS_UID = '1.2.840.10008.5.1.4.1.1.4'
+TOMOSYNTHESIS_SOP_CLASS_UID = '1.2.840.10008.5.1.4.1.1.13.1.3'
+
+CORPUS_SPECS = [
+    {'name': 'mammo_small', 'sop_class_uid': MAMMOGRAPHY_SOP_CLASS_UID, 'modality': 'MG', 'rows': 512,
+     'columns': 416, 'num_frames': 1, 'transfer_syntax': ExplicitVRLittleEndian},
+    {'name': 'mammo_full', 'sop_class_uid': MAMMOGRAPHY_SOP_CLASS_UID, 'modality': 'MG', 'rows': 3328,
+     'columns': 2560, 'num_frames': 1, 'transfer_syntax': ExplicitVRLittleEndian},
+    {'name': 'mammo_implicit', 'sop_class_uid': MAMMOGRAPHY_SOP_CLASS_UID, 'modality': 'MG', 'rows': 1024,
+     'columns': 832, 'num_frames': 1, 'transfer_syntax': ImplicitVRLittleEndian},
+    {'name': 'mammo_deflated', 'sop_class_uid': MAMMOGRAPHY_SOP_CLASS_UID, 'modality': 'MG', 'rows': 1024,
+     'columns': 832, 'num_frames': 1, 'transfer_syntax': DeflatedExplicitVRLittleEndian},
+    {'name': 'mammo_rle', 'sop_class_uid': MAMMOGRAPHY_SOP_CLASS_UID, 'modality': 'MG', 'rows': 1024,
+     'columns': 832, 'num_frames': 1, 'transfer_syntax': RLELossless},
+    {'name': 'mr', 'sop_class_uid': MR_SOP_CLASS_UID, 'modality': 'MR', 'rows': 256, 'columns': 256,
+     'num_frames': 1, 'transfer_syntax': ExplicitVRLittleEndian},
+    {'name': 'tomosynthesis', 'sop_class_uid': TOMOSYNTHESIS_SOP_CLASS_UID, 'modality': 'MG', 'rows': 512,
+     'columns': 416, 'num_frames': 16, 'transfer_syntax': ExplicitVRLittleEndian},
+]
+NOISE_KINDS = ['random', 'text', 'truncated']
+NOISE_SIZE = 65536
+BITS_STORED = 12
+
+
+def make_pixels(rows, columns, num_frames, rng):
+    """Makes 12-bit pixel data: a gradient with noise, one frame after another.
+
+    Arguments:
+        rows(int): Number of rows per frame.
+        columns(int): Number of columns per frame.
+        num_frames(int): Number of frames.
+        rng(np.random.Generator): The random number generator.
+    Returns:
+        A uint16 array of shape (rows, columns), or (num_frames, rows, columns) if num_frames > 1.
+    """
+
+    max_value = 2 ** BITS_STORED - 1
+    gradient = np.add.outer(np.linspace(0, max_value / 2, rows), np.linspace(0, max_value / 2, columns))
+    frames = [np.clip(gradient + rng.normal(0, max_value / 50, (rows, columns)), 0, max_value).astype(np.uint16)
+              for _ in range(num_frames)]
+
+    return frames[0] if num_frames == 1 else np.stack(frames)
+
+
+def make_dicom(spec, index, rng, seed=0):
+    """Makes a synthetic DICOM dataset.
+
+    Arguments:
+        spec(dict): An entry of CORPUS_SPECS.
+        index(int): The index of the file within its spec, used to derive its UIDs and tags.
+        rng(np.random.Generator): The random number generator for the pixel data.
+        seed(int): The seed of the corpus, used to derive its UIDs.
+    Returns:
+        A pydicom Dataset with file meta information.
+    """
+
+    entropy = [str(seed), spec['name'], str(index)]
+
+    file_meta = FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = spec['sop_class_uid']
+    file_meta.MediaStorageSOPInstanceUID = generate_uid(entropy_srcs=entropy + ['sop'])
+    file_meta.TransferSyntaxUID = ExplicitVRLittleEndian if spec['transfer_syntax'] == RLELossless \
+        else spec['transfer_syntax']
+
+    dicom_data = Dataset()
+    dicom_data.file_meta = file_meta
+    dicom_data.SOPClassUID = spec['sop_class_uid']
+    dicom_data.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    dicom_data.StudyInstanceUID = generate_uid(entropy_srcs=entropy[:2] + [str(index // 4)])
+    dicom_data.SeriesInstanceUID = generate_uid(entropy_srcs=entropy + ['series'])
+    dicom_data.AccessionNumber = '{:08d}'.format(index // 4)
+    dicom_data.PatientID = 'SYNTHETIC{:06d}'.format(index // 4)
+    dicom_data.StudyDate = '{}0101'.format(2010 + index % 10)
+    dicom_data.Modality = spec['modality']
+    dicom_data.Manufacturer = 'SYNTHETIC'
+    dicom_data.SeriesDescription = spec['name']
+    dicom_data.SeriesNumber = 1
+    dicom_data.InstanceNumber = index + 1
+    dicom_data.ViewPosition = ['CC', 'MLO'][index % 2]
+    dicom_data.ImageLaterality = ['L', 'R'][(index // 2) % 2]
+    dicom_data.WindowCenter = 2 ** (BITS_STORED - 1)
+    dicom_data.WindowWidth = 2 ** BITS_STORED
+
+    pixels = make_pixels(spec['rows'], spec['columns'], spec['num_frames'], rng)
+    dicom_data.Rows = spec['rows']
+    dicom_data.Columns = spec['columns']
+    if spec['num_frames'] > 1:
+        dicom_data.NumberOfFrames = spec['num_frames']
+    dicom_data.SamplesPerPixel = 1
+    dicom_data.PhotometricInterpretation = 'MONOCHROME2'
+    dicom_data.BitsAllocated = 16
+    dicom_data.BitsStored = BITS_STORED
+    dicom_data.HighBit = BITS_STORED - 1
+    dicom_data.PixelRepresentation = 0
+    dicom_data.PixelData = pixels.tobytes()
+
+    if spec['transfer_syntax'] == RLELossless:
+        dicom_data.compress(RLELossless, pixels)
+
+    return dicom_data
+
+
+def write_noise_file(path, kind, rng, dicom_path=None):
+    """Writes a file which is not a valid DICOM.
+
+    Arguments:
+        path(str): Path of the file.
+        kind(str): One of NOISE_KINDS: 'random' bytes, 'text' or a 'truncated' copy of a DICOM.
+        rng(np.random.Generator): The random number generator.
+        dicom_path(str): The DICOM to truncate, for 'truncated' files.
+    """
+
+    if kind == 'random':
+        data = rng.integers(0, 256, NOISE_SIZE, dtype=np.uint8).tobytes()
+    elif kind == 'text':
+        data = b'Not a DICOM.\n' * (NOISE_SIZE // 13)
+    else:
+        with open(dicom_path, 'rb') as dicom_file:
+            data = dicom_file.read(1024)
+
+    with open(path, 'wb') as noise_file:
+        noise_file.write(data)
+
+
+def make_corpus(corpus_dir, num_files=4, specs=CORPUS_SPECS, num_noise_files=2, seed=0):
+    """Writes a reproducible synthetic corpus of DICOMs and noise files.
+
+    Arguments:
+        corpus_dir(str): Directory where the corpus is written, one subdirectory per spec.
+        num_files(int): Number of DICOMs per spec.
+        specs(list): Entries of CORPUS_SPECS to synthesize.
+        num_noise_files(int): Number of files of each kind in NOISE_KINDS.
+        seed(int): The seed of the random number generator.
+    Returns:
+        A list of dictionaries with the 'path', 'spec' name and 'is_dicom' of each file.
+    """
+
+    rng = np.random.default_rng(seed)
+    corpus = []
+
+    for spec in specs:
+        spec_dir = os.path.join(corpus_dir, spec['name'])
+        os.makedirs(spec_dir, exist_ok=True)
+        for index in range(num_files):
+            path = os.path.join(spec_dir, '{:06d}.dcm'.format(index))
+            make_dicom(spec, index, rng, seed).save_as(path, enforce_file_format=True)
+            corpus.append({'path': path, 'spec': spec['name'], 'is_dicom': True})
+
+    noise_dir = os.path.join(corpus_dir, 'noise')
+    os.makedirs(noise_dir, exist_ok=True)
+    dicom_paths = [entry['path'] for entry in corpus]
+    for kind in NOISE_KINDS:
+        for index in range(num_noise_files if kind != 'truncated' or dicom_paths else 0):
+            path = os.path.join(noise_dir, '{}_{:06d}.dcm'.format(kind, index))
+            write_noise_file(path, kind, rng, dicom_paths[index % len(dicom_paths)] if dicom_paths else None)
+            corpus.append({'path': path, 'spec': 'noise_{}'.format(kind), 'is_dicom': False})
+
+    return corpus
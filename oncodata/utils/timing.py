@@ -0,0 +1,284 @@
+"""Optional per-stage timing of conversions, aggregated into per-worker histograms.
+
+Stages are timed with the stage context manager, which does nothing unless
+it runs inside collect_stages, so instrumented code costs a single check
+when instrumentation is off. The stages of one conversion are returned to
+the main process with its result and added to StageHistograms, which can be
+exported as JSON or as Prometheus text.
+"""
+
+import bisect
+import contextlib
+import json
+import threading
+import time
+
+from oncodata.utils.files import atomic_output_path
+
+# Upper bounds in seconds of the histogram buckets
+HISTOGRAM_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+DEFAULT_EXPORT_EVERY = 60.0
+METRIC_PREFIX = 'oncodata_stage'
+
+# The stages of the conversion running in this process, or None if it is not instrumented
+_stages = None
+
+
+@contextlib.contextmanager
+def collect_stages():
+    """Records the stages run in the block.
+
+    Returns:
+        A dictionary, filled in as stages finish, mapping each stage name to a
+        dictionary with its total 'seconds' and 'bytes' (or None if unknown).
+    """
+
+    global _stages
+
+    previous_stages = _stages
+    _stages = {}
+    try:
+        yield _stages
+    finally:
+        _stages = previous_stages
+
+
+def add_stage(name, seconds=0.0, num_bytes=None):
+    """Adds time and bytes to a stage of the conversion being collected, if any.
+
+    Arguments:
+        name(str): The name of the stage.
+        seconds(float): Wall time spent in the stage.
+        num_bytes(int): Number of bytes read or written by the stage, or None.
+    """
+
+    if _stages is None:
+        return
+
+    totals = _stages.setdefault(name, {'seconds': 0.0, 'bytes': None})
+    totals['seconds'] += seconds
+    if num_bytes is not None:
+        totals['bytes'] = (totals['bytes'] or 0) + num_bytes
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Times the block as a stage of the conversion being collected, if any.
+
+    Arguments:
+        name(str): The name of the stage, e.g. 'header', 'decode' or 'encode'.
+    """
+
+    if _stages is None:
+        yield
+        return
+
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage(name, time.perf_counter() - start_time)
+
+
+class StageHistograms(object):
+    """Histograms of the wall time of each stage, per worker process.
+
+    Observations can be added from several threads.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name, seconds, num_bytes=None, worker='main'):
+        """Adds one observation of a stage.
+
+        Arguments:
+            name(str): The name of the stage.
+            seconds(float): Wall time spent in the stage.
+            num_bytes(int): Number of bytes read or written by the stage, or None.
+            worker(str): The worker which ran the stage.
+        """
+
+        with self.lock:
+            histogram = self.histograms.get((str(worker), name))
+            if histogram is None:
+                histogram = {'buckets': [0] * (len(HISTOGRAM_BUCKETS) + 1), 'count': 0, 'seconds': 0.0, 'bytes': 0}
+                self.histograms[(str(worker), name)] = histogram
+            histogram['buckets'][bisect.bisect_left(HISTOGRAM_BUCKETS, seconds)] += 1
+            histogram['count'] += 1
+            histogram['seconds'] += seconds
+            histogram['bytes'] += num_bytes or 0
+
+    def update(self, row):
+        """Adds the stages of a conversion row, if it was instrumented.
+
+        Arguments:
+            row(dict): A row with 'stages' as returned by collect_stages and the 'worker' which converted it.
+        """
+
+        for name, totals in (row.get('stages') or {}).items():
+            self.observe(name, totals['seconds'], totals['bytes'], row.get('worker', 'main'))
+
+    def to_json(self):
+        """Exports the histograms as a JSON serializable list with one entry per worker and stage."""
+
+        with self.lock:
+            return [{'worker': worker, 'stage': name, 'buckets': HISTOGRAM_BUCKETS, 'counts': histogram['buckets'],
+                     'count': histogram['count'], 'seconds': histogram['seconds'], 'bytes': histogram['bytes']}
+                    for (worker, name), histogram in sorted(self.histograms.items())]
+
+    def to_prometheus(self):
+        """Exports the histograms in the Prometheus text exposition format."""
+
+        lines = ['# TYPE {}_seconds histogram'.format(METRIC_PREFIX)]
+        byte_lines = ['# TYPE {}_bytes_total counter'.format(METRIC_PREFIX)]
+        for histogram in self.to_json():
+            labels = 'stage="{}",worker="{}"'.format(histogram['stage'], histogram['worker'])
+            cumulative_count = 0
+            for bound, count in zip(HISTOGRAM_BUCKETS + ['+Inf'], histogram['counts']):
+                cumulative_count += count
+                lines.append('{}_seconds_bucket{{{},le="{}"}} {}'.format(METRIC_PREFIX, labels, bound,
+                                                                         cumulative_count))
+            lines.append('{}_seconds_sum{{{}}} {}'.format(METRIC_PREFIX, labels, histogram['seconds']))
+            lines.append('{}_seconds_count{{{}}} {}'.format(METRIC_PREFIX, labels, histogram['count']))
+            byte_lines.append('{}_bytes_total{{{}}} {}'.format(METRIC_PREFIX, labels, histogram['bytes']))
+
+        return '\n'.join(lines + byte_lines) + '\n'
+
+    def write(self, metrics_path):
+        """Atomically writes the histograms, as Prometheus text if the path ends in '.prom' and as JSON otherwise.
+
+        Arguments:
+            metrics_path(str): Path to the metrics file.
+        """
+
+        with atomic_output_path(metrics_path) as temp_path:
+            with open(temp_path, 'w') as metrics_file:
+                if metrics_path.endswith('.prom'):
+                    metrics_file.write(self.to_prometheus())
+                else:
+                    json.dump(self.to_json(), metrics_file, indent=2)
+
+    def print_summary(self):
+        """Prints the mean time and total bytes of each stage over all workers."""
+
+        totals = {}
+        for histogram in self.to_json():
+            total = totals.setdefault(histogram['stage'], {'count': 0, 'seconds': 0.0, 'bytes': 0})
+            for key in total:
+                total[key] += histogram[key]
+
+        for name, total in sorted(totals.items(), key=lambda item: -item[1]['seconds']):
+            print('{}: {:.2f} s total, {:.4f} s mean over {}, {:.2f} MB'.format(
+                name, total['seconds'], total['seconds'] / total['count'], total['count'], total['bytes'] / 2 ** 20))
+
+
+def timed_iter(iterable, name, histograms):
+    """Yields the items of an iterable, timing how long each one takes to produce as a stage.
+
+    Arguments:
+        iterable(iterable): An iterable, e.g. a generator of discovered paths.
+        name(str): The name of the stage.
+        histograms(StageHistograms): The histograms to add the time to.
+    Returns:
+        A generator of the items.
+    """
+
+    iterator = iter(iterable)
+    while True:
+        start_time = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        histograms.observe(name, time.perf_counter() - start_time)
+        yield item
+
+
+def observe_rows(rows, histograms, metrics_path=None, export_every=DEFAULT_EXPORT_EVERY):
+    """Adds the stages of conversion rows to histograms as they are produced, exporting them periodically.
+
+    Arguments:
+        rows(iterable): Rows with the 'stages' of each conversion.
+        histograms(StageHistograms): The histograms to add the stages to.
+        metrics_path(str): Optional path where the histograms are written every
+            export_every seconds and once all rows are produced.
+        export_every(float): Seconds between exports.
+    Returns:
+        A generator of the rows.
+    """
+
+    last_export = time.perf_counter()
+    for row in rows:
+        histograms.update(row)
+        if metrics_path is not None and time.perf_counter() - last_export > export_every:
+            histograms.write(metrics_path)
+            last_export = time.perf_counter()
+        yield row
+
+    if metrics_path is not None:
+        histograms.write(metrics_path)
+
+
+class WorkerUtilization(object):
+    """Time each worker process spent converting, and starved for input between conversions.
+
+    A worker is starved from the end of one conversion to the start of its
+    next one, e.g. while the pool waits for the next DICOM to be read.
+    """
+
+    def __init__(self):
+        self.workers = {}
+
+    def update(self, row):
+        """Adds a conversion row with the 'worker', its 'started' wall clock time and its duration in 'seconds'.
+
+        The rows of one worker must be added in the order it converted them,
+        which is the order in which a pool returns them.
+        """
+
+        if row.get('started') is None:
+            return
+
+        end_time = row['started'] + (row.get('seconds') or 0.0)
+        worker = self.workers.setdefault(row.get('worker', 'main'),
+                                         {'busy_seconds': 0.0, 'starved_seconds': 0.0, 'end_time': None})
+        if worker['end_time'] is not None:
+            worker['starved_seconds'] += max(0.0, row['started'] - worker['end_time'])
+        worker['busy_seconds'] += end_time - row['started']
+        worker['end_time'] = end_time
+
+    def get_totals(self):
+        """Gets the number of workers and their total busy and starved seconds."""
+
+        return {'workers': len(self.workers),
+                'busy_seconds': sum(worker['busy_seconds'] for worker in self.workers.values()),
+                'starved_seconds': sum(worker['starved_seconds'] for worker in self.workers.values())}
+
+    def print_summary(self):
+        """Prints the time workers spent busy and starved for input."""
+
+        totals = self.get_totals()
+        if totals['workers'] == 0:
+            return
+
+        total_seconds = totals['busy_seconds'] + totals['starved_seconds']
+        print('Workers: {} busy for {:.2f} s and starved for input for {:.2f} s ({:.1%} busy)'.format(
+            totals['workers'], totals['busy_seconds'], totals['starved_seconds'],
+            totals['busy_seconds'] / total_seconds if total_seconds > 0 else 1.0))
+
+
+def observe_utilization(rows, utilization):
+    """Adds conversion rows to a WorkerUtilization as they are produced.
+
+    Arguments:
+        rows(iterable): Rows returned by convert_and_record.
+        utilization(WorkerUtilization): The utilization to add the rows to.
+    Returns:
+        A generator of the rows.
+    """
+
+    for row in rows:
+        utilization.update(row)
+        yield row
@@ -1,65 +1,64 @@
-"""Get dicom metadata from all dicoms in a directory and save as a JSON file."""
+"""Get dicom metadata from all dicoms in a directory and save as a JSON or JSON Lines file."""
 
 import argparse
+from functools import partial
 import json
 import os
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
 
-from p_tqdm import p_umap
+from oncodata.dicom_metadata.get_dicom_metadata import get_dicom_metadata_and_slice_counts
+from oncodata.dicom_metadata.jsonl import MetadataWriter, is_json_lines, read_dicom_paths
+from oncodata.utils.discovery import discover_paths
+from oncodata.utils.parallel import DEFAULT_MAX_IN_FLIGHT, bounded_imap_unordered
 
-from oncodata.dicom_metadata.get_dicom_metadata import get_dicom_metadata
-from oncodata.get_slice_count import get_slice_count
+def main(directory, results_path, resume, max_in_flight, index_path, timeout, chunksize, max_tasks_per_child):
+    """Extracts and saves metadata from DICOMs to a JSON or JSON Lines file.
 
-def get_dicom_metadata_and_slice_counts(dicom_path):
-    """Gets DICOM metadata and slice counts.
+    Rows are written to JSON Lines files as soon as they are extracted.
+    Results paths ending in '.json' are written as a single JSON list
+    once all the metadata has been extracted.
 
-    Argumuments:
-        dicom_path(str): Path to a DICOM file.
-    Returns:
-        A dictionary containing the DICOM path,
-        metadata, slice count, and a list of any
-        errors encountered while extracting this
-        information.
+    Arguments:
+        directory(str): Path to a directory containing DICOMs.
+        results_path(str): Path to the JSON or JSON Lines file where the
+            metadata will be saved. JSON Lines files ending in '.gz' or
+            '.zst' are compressed.
+        resume(bool): True to skip DICOMs already in the JSON Lines file.
+        max_in_flight(int): Maximum number of DICOMs being processed
+            but not yet written.
+        index_path(str): Optional path to a persistent file index used to
+            skip listing unchanged directories.
+        timeout(float): Seconds after which reading the metadata or slice count
+            of a DICOM is abandoned and recorded as an error, or None for no limit.
+        chunksize(int): Number of DICOMs sent to a worker at a time.
+        max_tasks_per_child(int): Number of chunks after which a worker is
+            replaced, or None to keep workers.
     """
-    row = {
-        'dicom_path': dicom_path,
-        'dicom_metadata': {},
-        'slice_count': None,
-        'errors': []
-    }
-
-    # Get metadata
-    try:
-        row['dicom_metadata'] = get_dicom_metadata(dicom_path)
-    except Exception as e:
-        row['errors'].append(str(e))
-
-    # Get slice count
-    try:
-        row['slice_count'] = get_slice_count(dicom_path)
-    except Exception as e:
-        row['errors'].append(str(e))
 
-    return row
+    # DICOM paths are discovered while metadata is extracted
+    dicom_paths = discover_paths(os.path.abspath(directory), '.dcm', index_path)
+    get_row = partial(get_dicom_metadata_and_slice_counts, timeout=timeout)
+    imap_options = {'chunksize': chunksize, 'max_tasks_per_child': max_tasks_per_child, 'max_in_flight': max_in_flight}
 
-def main(directory, results_path):
-    """Extracts and saves metadata from DICOMs to a JSON file.
+    if not is_json_lines(results_path):
+        assert not resume, "Resuming is only supported for JSON Lines results."
+        metadata = list(bounded_imap_unordered(get_row, dicom_paths, **imap_options))
 
-    Arguments:
-        directory(str): Path to a directory containing DICOMs.
-        results_path(str): Path to the JSON where the metadata
-            will be saved.
-    """
+        with open(results_path, 'w') as results_file:
+            json.dump(metadata, results_file, indent=4, sort_keys=True)
+        return
 
-    dicom_paths = []
-    for root, _, files in os.walk(directory):
-        dicom_paths.extend([os.path.abspath(os.path.join(root, f)) for f in files if f.endswith('.dcm')])
-    
-    metadata = p_umap(get_dicom_metadata_and_slice_counts, dicom_paths)
+    append = resume and os.path.exists(results_path)
+    if append:
+        done_paths = read_dicom_paths(results_path)
+        print('Resuming, skipping {} DICOMs'.format(len(done_paths)))
+        dicom_paths = (dicom_path for dicom_path in dicom_paths if dicom_path not in done_paths)
 
-    with open(results_path, 'w') as results_file:
-        json.dump(metadata, results_file, indent=4, sort_keys=True)
+    rows = bounded_imap_unordered(get_row, dicom_paths, **imap_options)
+    with MetadataWriter(results_path, append=append) as writer:
+        for row in rows:
+            writer.write(row)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -71,7 +70,39 @@ if __name__ == '__main__':
     parser.add_argument('--results_path',
         type=str,
         required=True,
-        help='Path to the JSON where the metadata will be saved.')
+        help='Path to the file where the metadata will be saved. Paths ending in .json are saved as a single JSON list, '
+             'all other paths as JSON Lines (one row per line), compressed if they end in .gz or .zst.')
+    parser.add_argument(
+        '--resume',
+        default=False,
+        action='store_true',
+        help='Set flag to skip DICOMs already in the JSON Lines results and append to it.')
+    parser.add_argument(
+        '--max_in_flight',
+        type=int,
+        default=DEFAULT_MAX_IN_FLIGHT,
+        help='Maximum number of DICOMs being processed but not yet written.')
+    parser.add_argument(
+        '--index_path',
+        type=str,
+        default=None,
+        help='Optional path to a SQLite file index, created if it does not exist, so later runs only list changed directories.')
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=None,
+        help='Seconds after which reading a DICOM is abandoned and recorded as an error.')
+    parser.add_argument(
+        '--chunksize',
+        type=int,
+        default=1,
+        help='Number of DICOMs sent to a worker at a time.')
+    parser.add_argument(
+        '--max_tasks_per_child',
+        type=int,
+        default=None,
+        help='Number of chunks after which a worker process is replaced, to release leaked memory.')
     args = parser.parse_args()
 
-    main(args.directory, args.results_path)
+    main(args.directory, args.results_path, args.resume, args.max_in_flight, args.index_path, args.timeout, args.chunksize,
+         args.max_tasks_per_child)
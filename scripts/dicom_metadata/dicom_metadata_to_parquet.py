@@ -0,0 +1,84 @@
+"""Save dicom metadata as a columnar Parquet dataset, either extracted from a directory of dicoms or converted from JSON metadata."""
+
+import argparse
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+
+from oncodata.dicom_metadata.columnar import DEFAULT_BATCH_SIZE, PARTITIONS, write_columnar
+from oncodata.dicom_metadata.get_dicom_metadata import get_dicom_metadata_and_slice_counts
+from oncodata.dicom_metadata.jsonl import read_metadata
+from oncodata.utils.discovery import discover_paths
+from oncodata.utils.parallel import bounded_imap_unordered
+
+def read_all_metadata(metadata_paths):
+    """Reads rows from several metadata files one at a time.
+
+    Arguments:
+        metadata_paths(list): Paths to JSON or JSON Lines metadata files.
+    Returns:
+        A generator of metadata rows.
+    """
+
+    for metadata_path in metadata_paths:
+        for row in read_metadata(metadata_path):
+            yield row
+
+def main(directory, metadata_paths, results_dir, partition_by, batch_size, index_path):
+    """Extracts or converts DICOM metadata and saves it as a partitioned Parquet dataset.
+
+    Arguments:
+        directory(str): Path to a directory containing DICOMs, or None.
+        metadata_paths(list): Paths to JSON or JSON Lines metadata files
+            to convert, used if directory is None.
+        results_dir(str): Directory of the Parquet dataset.
+        partition_by(str): The name of a partition in PARTITIONS.
+        batch_size(int): Number of rows per written batch.
+        index_path(str): Optional path to a persistent file index used to
+            skip listing unchanged directories.
+    """
+
+    if directory is not None:
+        dicom_paths = discover_paths(os.path.abspath(directory), '.dcm', index_path)
+        rows = bounded_imap_unordered(get_dicom_metadata_and_slice_counts, dicom_paths)
+    else:
+        rows = read_all_metadata(metadata_paths)
+
+    num_rows = write_columnar(rows, results_dir, partition_by=partition_by, batch_size=batch_size)
+    print('Wrote {} rows to {}'.format(num_rows, results_dir))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument(
+        '--directory',
+        type=str,
+        help='Path to a directory containing DICOMs.')
+    inputs.add_argument(
+        '--metadata_paths',
+        nargs='+',
+        type=str,
+        help='List of paths to JSON or JSON Lines files containing DICOM metadata to convert.')
+    parser.add_argument(
+        '--results_dir',
+        type=str,
+        required=True,
+        help='Directory where the Parquet dataset will be saved.')
+    parser.add_argument(
+        '--partition_by',
+        type=str,
+        default='year',
+        help='How to partition the dataset. Available partitions are: {}.'.format(sorted(PARTITIONS.keys())))
+    parser.add_argument(
+        '--batch_size',
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help='Number of rows written at a time.')
+    parser.add_argument(
+        '--index_path',
+        type=str,
+        default=None,
+        help='Optional path to a SQLite file index, created if it does not exist, so later runs only list changed directories.')
+    args = parser.parse_args()
+
+    main(args.directory, args.metadata_paths, args.results_dir, args.partition_by, args.batch_size, args.index_path)
@@ -6,23 +6,26 @@ from os.path import dirname, realpath
 import sys
 sys.path.append(dirname(dirname(dirname(realpath(__file__)))))
 
-from oncodata.dicom_metadata.summarize import summarize
+from oncodata.dicom_metadata.summarize import DEFAULT_SHARD_SIZE, summarize_paths
 
-def main(metadata_paths, summary_path):
+def main(metadata_paths, summary_path, shard_size, num_cpus):
     """ Loads metadata and creates and saves summary statistics.
 
+    The metadata is split into shards which are summarized in
+    parallel and the partial summaries are merged.
+
     Arguments:
-        metadata_paths(list): An array of paths to DICOM metadata JSONs.
+        metadata_paths(list): An array of paths to DICOM metadata JSON
+            or JSON Lines files, or to columnar (Parquet) metadata
+            directories, which are summarized column-wise.
         summary_path(str): The path where the summary statistics JSON
             will be saved.
+        shard_size(int): Approximate number of bytes per shard of an
+            uncompressed JSON Lines file.
+        num_cpus(int): Number of worker processes, or None for all CPUs.
     """
 
-    metadata = []
-    for metadata_path in metadata_paths:
-        with open(metadata_path, 'r') as metadata_file:
-            metadata.extend(json.load(metadata_file))
-
-    summary = summarize(metadata)
+    summary = summarize_paths(metadata_paths, shard_size, num_cpus)
 
     with open(summary_path, 'w') as summary_file:
         json.dump(summary, summary_file, indent=4, sort_keys=True)
@@ -34,12 +37,22 @@ if __name__ == '__main__':
         nargs='+',
         type=str,
         required=True,
-        help='List of paths to JSON files containing DICOM metadata.')
+        help='List of paths to JSON or JSON Lines files or Parquet directories containing DICOM metadata.')
     parser.add_argument(
         '--summary_path',
         type=str,
         required=True,
         help='Path to a JSON file where the summary will be saved.')
+    parser.add_argument(
+        '--shard_size',
+        type=int,
+        default=DEFAULT_SHARD_SIZE,
+        help='Approximate number of bytes of an uncompressed JSON Lines file summarized by one worker at a time.')
+    parser.add_argument(
+        '--num_cpus',
+        type=int,
+        default=None,
+        help='Number of worker processes. Defaults to the number of CPUs.')
     args = parser.parse_args()
 
-    main(args.metadata_paths, args.summary_path)
+    main(args.metadata_paths, args.summary_path, args.shard_size, args.num_cpus)
@@ -0,0 +1,86 @@
+"""Compares the throughput of the dcmtk and NumPy DICOM to PNG conversion engines."""
+
+import argparse
+import os
+import sys
+from tempfile import TemporaryDirectory
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+
+from oncodata.dicom_to_png.dicom_to_png import dicom_to_png_dcmtk, dicom_to_png_numpy
+
+ENGINES = {'dcmtk': dicom_to_png_dcmtk,
+           'numpy': dicom_to_png_numpy}
+
+
+def benchmark_engine(convert, dicom_paths, png_dir):
+    """Converts every DICOM with one engine in a single process and times it.
+
+    Arguments:
+        convert(function): A dicom_to_png_* conversion function.
+        dicom_paths(list): Paths to DICOM files.
+        png_dir(str): Directory where the PNGs will be written.
+    Returns:
+        A tuple (seconds, megabytes) with the total conversion time and
+        the total size of the converted DICOMs.
+    """
+
+    megabytes = sum(os.path.getsize(dicom_path) for dicom_path in dicom_paths) / 2 ** 20
+
+    start = time.perf_counter()
+    for i, dicom_path in enumerate(dicom_paths):
+        convert(dicom_path, os.path.join(png_dir, '{}.png'.format(i)), skip_existing=False)
+    seconds = time.perf_counter() - start
+
+    return seconds, megabytes
+
+
+def main(dicom_dir, dicom_ext, num_files, engines):
+    """Benchmarks DICOM to PNG conversion engines.
+
+    Arguments:
+        dicom_dir(str): Path to a directory containing DICOM files.
+        dicom_ext(str): The extension of the dicom files.
+        num_files(int): Maximum number of DICOMs to convert per engine.
+        engines(list): Names of the engines to benchmark.
+    """
+
+    dicom_paths = []
+    for root, _, files in os.walk(dicom_dir):
+        dicom_paths.extend([os.path.join(root, f) for f in files if f.endswith(dicom_ext)])
+    dicom_paths = sorted(dicom_paths)[:num_files]
+    assert len(dicom_paths) > 0, "No DICOMs found in {}.".format(dicom_dir)
+
+    print('{:<8}{:>8}{:>12}{:>12}'.format('engine', 'files', 'files/sec', 'MB/sec'))
+    for engine in engines:
+        with TemporaryDirectory() as png_dir:
+            seconds, megabytes = benchmark_engine(ENGINES[engine], dicom_paths, png_dir)
+        print('{:<8}{:>8}{:>12.2f}{:>12.2f}'.format(engine, len(dicom_paths), len(dicom_paths) / seconds, megabytes / seconds))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--dicom_dir',
+        type=str,
+        required=True,
+        help='Path to a directory containing DICOM files.')
+    parser.add_argument(
+        '--dicom_ext',
+        default='',
+        type=str,
+        help='The extension of the dicom files. For filtering all other files. Default as "", no filtering')
+    parser.add_argument(
+        '--num_files',
+        type=int,
+        default=100,
+        help='Maximum number of DICOMs to convert with each engine.')
+    parser.add_argument(
+        '--engines',
+        nargs='*',
+        default=sorted(ENGINES.keys()),
+        help='Engines to benchmark. Available engines are: {}.'.format(sorted(ENGINES.keys())))
+    args = parser.parse_args()
+
+    main(args.dicom_dir, args.dicom_ext, args.num_files, args.engines)
@@ -0,0 +1,124 @@
+"""Compares the speed and size of PNG encoder settings on mammography-sized images."""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+
+import imageio
+import numpy as np
+import pandas as pd
+
+from oncodata.dicom_to_png.png import PNG_FILTERS, ZLIB_STRATEGIES, encode_png
+from oncodata.utils.synthetic import make_pixels
+
+MAMMOGRAM_SHAPE = (3328, 2560)
+
+
+def benchmark_setting(images, compression_level, png_filter, strategy, num_threads):
+    """Encodes images with one setting, checking that they decode to the same pixels.
+
+    Arguments:
+        images(list): 2D uint16 arrays.
+        compression_level(int): The zlib compression level (0-9).
+        png_filter(str): A filter in PNG_FILTERS.
+        strategy(str): A strategy in ZLIB_STRATEGIES.
+        num_threads(int): Number of compression threads.
+    Returns:
+        A dictionary with the setting, the encoding speed in MB/sec of raw
+        pixels and the size of the PNGs relative to the raw pixels.
+    """
+
+    raw_bytes = sum(image.nbytes for image in images)
+    png_bytes = 0
+
+    seconds = 0
+    for image in images:
+        start = time.perf_counter()
+        png_data = encode_png(image, compression_level, png_filter, strategy, num_threads)
+        seconds += time.perf_counter() - start
+        png_bytes += len(png_data)
+        assert np.array_equal(imageio.v2.imread(io.BytesIO(png_data)), image), 'PNG does not decode to the image.'
+
+    return {'level': compression_level, 'filter': png_filter, 'strategy': strategy, 'threads': num_threads,
+            'mb_per_sec': raw_bytes / 2 ** 20 / seconds, 'size_ratio': png_bytes / raw_bytes}
+
+
+def main(dicom_paths, num_images, levels, filters, strategies, threads, results_path):
+    """Benchmarks every combination of encoder settings and prints a table of the results.
+
+    Arguments:
+        dicom_paths(list): Optional DICOMs whose windowed images are encoded
+            instead of synthetic mammography-sized images.
+        num_images(int): Number of synthetic images.
+        levels(list): zlib compression levels.
+        filters(list): Filters in PNG_FILTERS.
+        strategies(list): Strategies in ZLIB_STRATEGIES.
+        threads(list): Numbers of compression threads.
+        results_path(str): Optional path where the results are saved as CSV.
+    """
+
+    if dicom_paths:
+        from oncodata.dicom_to_png.dicom_to_png import read_windowed_dicom
+        images = [read_windowed_dicom(dicom_path)[0] for dicom_path in dicom_paths]
+    else:
+        rng = np.random.default_rng(0)
+        images = [make_pixels(MAMMOGRAM_SHAPE[0], MAMMOGRAM_SHAPE[1], 1, rng) for _ in range(num_images)]
+
+    results = pd.DataFrame([benchmark_setting(images, level, png_filter, strategy, num_threads)
+                            for level in levels for png_filter in filters for strategy in strategies
+                            for num_threads in threads])
+
+    with pd.option_context('display.float_format', '{:.3f}'.format, 'display.width', 120):
+        print(results.to_string(index=False))
+
+    if results_path is not None:
+        results.to_csv(results_path, index=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--dicom_paths',
+        nargs='*',
+        default=[],
+        help='Optional DICOMs to encode instead of synthetic mammography-sized images.')
+    parser.add_argument(
+        '--num_images',
+        type=int,
+        default=3,
+        help='Number of synthetic images.')
+    parser.add_argument(
+        '--levels',
+        type=int,
+        nargs='*',
+        default=[1, 3, 6, 9],
+        help='zlib compression levels to benchmark.')
+    parser.add_argument(
+        '--filters',
+        nargs='*',
+        default=sorted(PNG_FILTERS.keys()),
+        help='PNG filters to benchmark. Available filters are: {}.'.format(sorted(PNG_FILTERS.keys())))
+    parser.add_argument(
+        '--strategies',
+        nargs='*',
+        default=['default', 'rle'],
+        help='zlib strategies to benchmark. Available strategies are: {}.'.format(sorted(ZLIB_STRATEGIES.keys())))
+    parser.add_argument(
+        '--threads',
+        type=int,
+        nargs='*',
+        default=[1, os.cpu_count()],
+        help='Numbers of compression threads to benchmark.')
+    parser.add_argument(
+        '--results_path',
+        type=str,
+        default=None,
+        help='Optional path where the results table is saved as CSV.')
+    args = parser.parse_args()
+
+    main(args.dicom_paths, args.num_images, args.levels, args.filters, args.strategies, sorted(set(args.threads)),
+         args.results_path)
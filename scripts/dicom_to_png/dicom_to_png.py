@@ -1,20 +1,40 @@
 """Converts DICOM files in a directory to PNG images."""
 
 import argparse
+import cProfile
+from functools import partial
+from itertools import chain, islice, tee
+from operator import itemgetter
 import os
+import pstats
 import sys
 import json
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
 
-from p_tqdm import p_umap
+from oncodata.dicom_metadata.query import select_paths
+from oncodata.dicom_to_png.dedup import DUPLICATE_MAP_SUFFIX, find_duplicates, get_instance_key, get_output_pairs, \
+    report_duplicates, write_duplicate_map
+from oncodata.dicom_to_png.dicom_to_png import create_directory_if_necessary, dicom_to_frames_numpy, dicom_to_png_dcmtk, \
+    dicom_to_png_imagemagick, dicom_to_png_matlab, dicom_to_png_numpy, get_conversion_parameters
+from oncodata.dicom_to_png.exams import ExamBundleWriter, get_bundle_path, select_exams, write_bundles
+from oncodata.dicom_to_png.manifest import ConversionManifest, convert_and_record, get_manifest_path, record_rows
+from oncodata.dicom_to_png.png import DEFAULT_COMPRESSION_LEVEL, DEFAULT_FILTER, DEFAULT_STRATEGY, PNG_FILTERS, \
+    ZLIB_STRATEGIES
+from oncodata.dicom_to_png.report import report_outcomes
+from oncodata.dicom_to_png.shards import DEFAULT_SHARD_BYTES, SHARD_FORMATS, ShardWriter, write_shards
+from oncodata.dicom_to_png.selection import DICOM_TYPES, get_selection_criteria
+from oncodata.utils.discovery import discover_paths
+from oncodata.utils.files import link_or_copy
+from oncodata.utils.parallel import DEFAULT_MAX_IN_FLIGHT, bounded_imap_unordered
+from oncodata.utils.prefetch import DEFAULT_PREFETCH_BYTES, DEFAULT_PREFETCH_THREADS, Prefetcher
+from oncodata.utils.sniff import is_dicom_file
+from oncodata.utils.timing import DEFAULT_EXPORT_EVERY, StageHistograms, WorkerUtilization, observe_rows, \
+    observe_utilization, timed_iter
 
-from oncodata.dicom_to_png.dicom_to_png import dicom_to_png_dcmtk, dicom_to_png_imagemagick, dicom_to_png_matlab
-
-MAMMOGRAM_SELECTION_CRITERIA = {'SOPClassUID': 'Digital Mammography X-Ray Image Storage - For Presentation'}
-BPE_MRI_SELECTION_CRITERIA = {'SOPClassUID': 'MR Image Storage', 'SeriesNumber': '2000', 'InstanceNumber': '8'}
-DICOM_TYPES = {'bpe_mri': BPE_MRI_SELECTION_CRITERIA,
-               'mammo': MAMMOGRAM_SELECTION_CRITERIA}
+PROFILE_NUM_LINES = 30
+DEFAULT_PNG_OPTIONS = {'compression_level': DEFAULT_COMPRESSION_LEVEL, 'png_filter': DEFAULT_FILTER,
+                       'strategy': DEFAULT_STRATEGY, 'num_threads': 1}
 
 
 def dicom_path_to_png_path(dicom_path, dicom_dir, png_dir, dicom_ext):
@@ -32,16 +52,222 @@ def dicom_path_to_png_path(dicom_path, dicom_dir, png_dir, dicom_ext):
         png_dir and with dicom_ext replaced with '.png'.
     """
 
-    dicom_path_parts = dicom_path.split(dicom_dir)
-    dicom_path_after_dir = dicom_path.replace(dicom_dir, '', 1).strip('/')
-    if dicom_ext != '':
-        png_path_after_dir = dicom_path_after_dir.replace(dicom_ext, '') 
+    dicom_path_after_dir = os.path.relpath(dicom_path, dicom_dir)
+    if dicom_path_after_dir.startswith(os.pardir):
+        # Paths from a DICOM list need not be inside dicom_dir
+        dicom_path_after_dir = dicom_path.strip('/')
+    if dicom_ext != '' and dicom_path_after_dir.endswith(dicom_ext):
+        dicom_path_after_dir = dicom_path_after_dir[:-len(dicom_ext)]
     png_path_after_dir = dicom_path_after_dir + '.png'
     png_path = os.path.join(png_dir, png_path_after_dir)
 
     return png_path
 
-def main(dicom_dir, dicom_list_json_path, png_dir, dcmtk, imagemagick, matlab, dicom_types, dicom_ext):
+def convert_and_record_paths(paths, convert, selection_criteria, skip_existing=False, timeout=None, instrument=False,
+                             hash_image=False):
+    """Calls convert_and_record with a (dicom_path, image_path) tuple."""
+
+    dicom_path, image_path = paths
+
+    return convert_and_record(convert, dicom_path, image_path, selection_criteria, skip_existing=skip_existing,
+                              timeout=timeout, instrument=instrument, hash_image=hash_image)
+
+def profile_conversions(convert_paths, path_pairs, profile_path):
+    """Converts DICOMs in this process under cProfile, dumping the stats and printing the slowest functions.
+
+    Arguments:
+        convert_paths(function): A function of a (dicom_path, image_path) tuple such as convert_and_record_paths.
+        path_pairs(iterable): (dicom_path, image_path) tuples to convert.
+        profile_path(str): Path where the profile stats are dumped, for use with pstats or snakeviz.
+    Returns:
+        The list of rows returned by convert_paths.
+    """
+
+    profiler = cProfile.Profile()
+    rows = []
+    for paths in path_pairs:
+        profiler.enable()
+        rows.append(convert_paths(paths))
+        profiler.disable()
+
+    profiler.dump_stats(profile_path)
+    print('Profiled {} DICOMs, stats saved to {}'.format(len(rows), profile_path))
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(PROFILE_NUM_LINES)
+
+    return rows
+
+def convert_dicoms(convert, engine, dicom_paths, image_paths, selection_criteria, manifest_path, timeout=None,
+                   chunksize=1, max_tasks_per_child=None, max_in_flight=DEFAULT_MAX_IN_FLIGHT, report_path=None,
+                   quiet=False, histograms=None, metrics_path=None, metrics_every=DEFAULT_EXPORT_EVERY,
+                   profile_files=0, profile_path=None, shard_writer=None, png_options=None, extra_parameters=None,
+                   bundle_writer=None, prefetch_bytes=0, prefetch_threads=DEFAULT_PREFETCH_THREADS, duplicate_map=None):
+    """Converts DICOMs with a per-file conversion function in parallel.
+
+    DICOMs are converted as they are discovered. The time the workers spent
+    converting and starved for input between conversions is printed at the end.
+
+    Arguments:
+        convert(function): A per-file conversion function such as dicom_to_png_dcmtk.
+        engine(str): The name of the conversion engine.
+        dicom_paths(iterable): Paths to DICOM files.
+        image_paths(iterable): Paths where the images will be saved.
+        selection_criteria(tuple): Selection criteria dictionaries.
+        manifest_path(str): Path to a conversion manifest used to decide which
+            DICOMs to convert, or None to skip images which already exist.
+        timeout(float): Seconds after which a conversion is killed and recorded
+            as failed, or None for no limit.
+        chunksize(int): Number of DICOMs sent to a worker at a time.
+        max_tasks_per_child(int): Number of chunks after which a worker is
+            replaced, or None to keep workers.
+        max_in_flight(int): Maximum number of DICOMs queued for conversion.
+        report_path(str): Optional path to a JSON Lines or SQLite report of
+            the outcome of every conversion.
+        quiet(bool): True to only print the rollup of the outcomes.
+        histograms(StageHistograms): Histograms to add the time of each stage
+            of every conversion to, or None to not instrument conversions.
+        metrics_path(str): Optional path where the histograms are exported
+            as JSON, or Prometheus text if it ends in '.prom'.
+        metrics_every(float): Seconds between exports of the histograms.
+        profile_files(int): Number of DICOMs to convert first in this process
+            under cProfile, or 0 to not profile.
+        profile_path(str): Path where the profile stats are dumped.
+        shard_writer(ShardWriter): Optional writer of the windowed images to
+            shards. The conversion function must accept return_image.
+        png_options(dict): Optional options of encode_png. The conversion
+            function must accept png_options.
+        extra_parameters(dict): Optional parameters of the conversion function
+            which are recorded in the manifest, e.g. a frame range.
+        bundle_writer(ExamBundleWriter): Optional writer of the PNGs to exam
+            bundles. The conversion function must accept return_png.
+        prefetch_bytes(int): Maximum size of the DICOMs read ahead of the
+            workers into the page cache, or 0 to not read ahead.
+        prefetch_threads(int): Number of threads reading DICOMs ahead.
+        duplicate_map(dict): Optional map from duplicate to canonical DICOM
+            path of the DICOMs which are not converted. Duplicates of DICOMs
+            which are rejected or fail are reported with the same outcome.
+    """
+
+    imap_options = {'chunksize': chunksize, 'max_tasks_per_child': max_tasks_per_child, 'max_in_flight': max_in_flight}
+    if png_options is not None:
+        convert = partial(convert, png_options=png_options)
+    if shard_writer is not None:
+        # Images are sent back to this process, which is the only writer of the shards
+        convert = partial(convert, return_image=True)
+    if bundle_writer is not None:
+        # PNGs are encoded by the workers and sent back to this process, which packs them
+        convert = partial(convert, return_png=True)
+    convert_paths = partial(convert_and_record_paths, convert=convert, selection_criteria=selection_criteria,
+                            skip_existing=manifest_path is None, timeout=timeout, instrument=histograms is not None,
+                            hash_image=manifest_path is not None)
+
+    utilization = WorkerUtilization()
+    prefetcher = Prefetcher(prefetch_bytes, prefetch_threads, max_in_flight, itemgetter(0), chunksize) \
+        if prefetch_bytes > 0 else None
+
+    def convert_pending(path_pairs):
+        path_pairs = iter(path_pairs)
+        rows = profile_conversions(convert_paths, islice(path_pairs, profile_files), profile_path) \
+            if profile_files > 0 else []
+        if prefetcher is not None:
+            # Only the DICOMs converted by the pool are read ahead, since their rows release the budget
+            path_pairs = prefetcher.prefetch(path_pairs)
+        rows = chain(rows, bounded_imap_unordered(convert_paths, path_pairs, **imap_options))
+        if prefetcher is not None:
+            rows = prefetcher.release_rows(rows)
+        rows = observe_utilization(rows, utilization)
+        if histograms is not None:
+            rows = observe_rows(rows, histograms, metrics_path, metrics_every)
+        if shard_writer is not None:
+            rows = write_shards(rows, shard_writer)
+        if bundle_writer is not None:
+            rows = write_bundles(rows, bundle_writer)
+        return rows
+
+    try:
+        if manifest_path is None:
+            rows = convert_pending(zip(dicom_paths, image_paths))
+            report_outcomes(report_duplicates(rows, duplicate_map or {}), report_path, quiet)
+        else:
+            parameters = get_conversion_parameters(selection_criteria)
+            parameters.update(extra_parameters or {})
+            if shard_writer is not None:
+                parameters['shards'] = shard_writer.get_parameters()
+            # The number of threads does not change the decoded image, and default
+            # options are left out so that existing manifests stay valid
+            png_parameters = {key: value for key, value in (png_options or {}).items()
+                              if key != 'num_threads' and value != DEFAULT_PNG_OPTIONS[key]}
+            if len(png_parameters) > 0:
+                parameters['png'] = png_parameters
+            with ConversionManifest(manifest_path) as manifest:
+                pending = manifest.get_pending(dicom_paths, image_paths, engine, parameters)
+                rows = record_rows(convert_pending(pending), manifest, engine, parameters,
+                                   before_commit=shard_writer.flush if shard_writer is not None else None)
+                report_outcomes(report_duplicates(rows, duplicate_map or {}), report_path, quiet)
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
+
+    utilization.print_summary()
+    if prefetcher is not None:
+        prefetcher.print_summary()
+    if histograms is not None:
+        histograms.print_summary()
+
+def find_duplicate_dicoms(dicom_paths, verify_pixels, map_path, pool_options):
+    """Finds the DICOMs which are copies of another DICOM, reading only their headers or raw pixel bytes.
+
+    Arguments:
+        dicom_paths(list): Paths to DICOM files.
+        verify_pixels(bool): True to also compare the pixel data of DICOMs with
+            the same SOPInstanceUID.
+        map_path(str): Path where the duplicate map is saved as JSON.
+        pool_options(dict): Options of the conversion pool, of which chunksize,
+            max_tasks_per_child and max_in_flight are used.
+    Returns:
+        A dictionary from the path of every duplicate DICOM to the path of the
+        canonical DICOM of its instance.
+    """
+
+    print('Finding duplicate DICOMs')
+    rows = bounded_imap_unordered(partial(get_instance_key, verify_pixels=verify_pixels), dicom_paths,
+                                  total=len(dicom_paths), chunksize=pool_options.get('chunksize', 1),
+                                  max_tasks_per_child=pool_options.get('max_tasks_per_child'),
+                                  max_in_flight=pool_options.get('max_in_flight', DEFAULT_MAX_IN_FLIGHT))
+    duplicate_map = find_duplicates(rows)
+    write_duplicate_map(duplicate_map, map_path)
+    print('Found {} duplicates of {} DICOMs, duplicate map saved to {}'.format(len(duplicate_map), len(dicom_paths),
+                                                                               map_path))
+
+    return duplicate_map
+
+def link_duplicates(duplicate_map, get_image_path, pyramid=None):
+    """Gives every duplicate DICOM the outputs of its canonical DICOM, as hard links or else copies.
+
+    Arguments:
+        duplicate_map(dict): A dictionary from duplicate to canonical DICOM path.
+        get_image_path(function): Maps a DICOM path to the path of its output.
+        pyramid(dict): Optional downsampling 'factors' and 'thumbnail_sizes'
+            of the levels saved next to each PNG, which are also linked.
+    """
+
+    num_links = num_copies = 0
+    for duplicate_path, canonical_path in sorted(duplicate_map.items()):
+        source_path, dest_path = get_image_path(canonical_path), get_image_path(duplicate_path)
+        # DICOMs which were not converted have no outputs, and are reported with the outcome of their canonical DICOM
+        if source_path is None or dest_path is None:
+            continue
+        for source_file, dest_file in get_output_pairs(source_path, dest_path, pyramid):
+            create_directory_if_necessary(dest_file)
+            if link_or_copy(source_file, dest_file):
+                num_links += 1
+            else:
+                num_copies += 1
+
+    print('Linked {} and copied {} outputs of duplicate DICOMs'.format(num_links, num_copies))
+
+def main(dicom_dir, dicom_list_json_path, png_dir, dcmtk, imagemagick, matlab, numpy, dicom_types, dicom_ext, manifest,
+         index_path, sniff, allow_no_preamble, pool_options, shard_options=None, png_options=None, frame_options=None,
+         pyramid=None, metadata_database=None, bundle_dir=None, dedup_options=None):
     """Converts DICOM files in a directory to PNG images.
 
     NOTE: When using Matlab, must be run from oncodata/dicom_to_png
@@ -55,34 +281,142 @@ def main(dicom_dir, dicom_list_json_path, png_dir, dcmtk, imagemagick, matlab, d
         dcmtk(bool): True to use dcmtk to convert DICOMs to PNGs.
         imagemagick(bool): True to use ImageMagick to convert DICOMs to PNGs.
         matlab(bool): Ture to use matlab to convert DICOMs to PNGs.
+        numpy(bool): True to convert DICOMs to PNGs in-process with pydicom and NumPy.
+        dicom_types(list): Names of the dicom types to convert.
+        dicom_ext(str): The extension of the dicom files.
+        manifest(bool): True to decide which DICOMs to convert using a conversion
+            manifest stored next to png_dir instead of checking for existing images.
+        index_path(str): Optional path to a persistent file index used to
+            skip listing unchanged directories.
+        sniff(bool): True to only convert files whose first bytes show they are DICOMs.
+        allow_no_preamble(bool): True to also accept DICOMs without a preamble when sniffing.
+        pool_options(dict): The timeout, chunksize, max_tasks_per_child,
+            max_in_flight, report_path, quiet, metrics_path, metrics_every,
+            profile_files, profile_path, prefetch_bytes and prefetch_threads
+            options of convert_dicoms. The time of each stage is only recorded
+            if metrics_path is given.
+        shard_options(dict): Optional shard_dir, shard_format, shard_bytes
+            and levels of a ShardWriter the windowed images are also written
+            to with the numpy engine, and png, False to only write shards.
+        png_options(dict): Optional options of encode_png for the numpy engine.
+        frame_options(dict): Optional frame_range and volume options to convert
+            every frame, or a range of frames, of each DICOM with the numpy
+            engine, to a directory of PNGs per DICOM or to one .npy volume
+            per DICOM if volume is True.
+        pyramid(dict): Optional downsampling 'factors' and 'thumbnail_sizes'
+            of the reduced resolution PNGs which the numpy engine saves next
+            to each PNG, computed from the same decoded image.
+        metadata_database(str): Optional path to a SQLite file or a mssql:// URL
+            of DICOM metadata, from which the DICOMs in dicom_dir which fit the
+            selection criteria are selected instead of listing dicom_dir.
+        bundle_dir(str): Optional directory where the PNGs of each exam are
+            packed into one bundle instead of being saved in png_dir, using the
+            exams of the DICOMs in metadata_database. Exams whose bundle exists
+            are skipped.
+        dedup_options(dict): Optional options to convert each instance once:
+            verify_pixels to also compare the pixel data of DICOMs with the same
+            SOPInstanceUID, the map_path of the duplicate map and link to give
+            every duplicate hard links to (or copies of) the outputs of its
+            canonical DICOM after conversion.
     """
 
-    print('Extracting DICOM paths')
-    if dicom_list_json_path is not None:
+    if bundle_dir is not None:
+        dicom_dir_prefix = os.path.join(os.path.abspath(dicom_dir), '')
+        exams = {}
+        for exam_id, dicoms in select_exams(metadata_database, get_selection_criteria(dicom_types)).items():
+            dicoms = [dicom for dicom in dicoms if dicom['dicom_path'].startswith(dicom_dir_prefix)]
+            if len(dicoms) > 0 and not os.path.exists(get_bundle_path(bundle_dir, exam_id)):
+                exams[exam_id] = dicoms
+        # DICOMs are converted exam by exam, so only a few bundles are open at a time
+        dicom_paths = [dicom['dicom_path'] for dicoms in exams.values() for dicom in dicoms]
+        print('Selected {} exams with {} DICOMs from {}'.format(len(exams), len(dicom_paths), metadata_database))
+    elif dicom_list_json_path is not None:
         dicom_paths = json.load(open(dicom_list_json_path,'r'))
+    elif metadata_database is not None:
+        dicom_dir_prefix = os.path.join(os.path.abspath(dicom_dir), '')
+        dicom_paths = [dicom_path for dicom_path in select_paths(metadata_database, get_selection_criteria(dicom_types))
+                       if dicom_path.startswith(dicom_dir_prefix)]
+        print('Selected {} DICOMs from {}'.format(len(dicom_paths), metadata_database))
     else:
-        dicom_paths = []
-        for root, _, files in os.walk(dicom_dir):
-            dicom_paths.extend([os.path.join(root, f) for f in files if f.endswith(dicom_ext)])
+        # DICOM paths are discovered while DICOMs are converted
+        classify = partial(is_dicom_file, allow_no_preamble=allow_no_preamble) if sniff else None
+        dicom_paths = discover_paths(dicom_dir, dicom_ext, index_path, classify)
+
+    histograms = StageHistograms() if pool_options.get('metrics_path') is not None else None
+    if histograms is not None:
+        dicom_paths = timed_iter(dicom_paths, 'discover', histograms)
+
+    def get_image_path(dicom_path):
+        image_path = dicom_path_to_png_path(dicom_path, dicom_dir, png_dir, dicom_ext)
+        if (shard_options is not None and not shard_options['png']) or bundle_dir is not None:
+            return None
+        if frame_options is not None:
+            # Frames are saved in a directory, or a volume, named after the PNG
+            return image_path[:-len('.png')] + ('.npy' if frame_options['volume'] else '')
+        return image_path
 
-    image_paths = [dicom_path_to_png_path(dicom_path, dicom_dir, png_dir, dicom_ext) for dicom_path in dicom_paths]
+    duplicate_map = {}
+    if dedup_options is not None:
+        # Every DICOM is keyed before the first conversion, so that only canonical DICOMs are converted
+        dicom_paths = list(dicom_paths)
+        duplicate_map = find_duplicate_dicoms(dicom_paths, dedup_options['verify_pixels'], dedup_options['map_path'],
+                                              pool_options)
+        dicom_paths = [dicom_path for dicom_path in dicom_paths if dicom_path not in duplicate_map]
+        # Duplicates of DICOMs which are not converted are reported with the same outcome
+        pool_options = dict(pool_options, duplicate_map=duplicate_map)
+
+    if matlab:
+        dicom_paths = list(dicom_paths)
+        image_paths = [get_image_path(dicom_path) for dicom_path in dicom_paths]
+    else:
+        dicom_paths, dicom_paths_copy = tee(dicom_paths)
+        image_paths = (get_image_path(dicom_path) for dicom_path in dicom_paths_copy)
 
-    selection_criteria = []
-    for dicom_type in dicom_types:
-        criteria = DICOM_TYPES.get(dicom_type)
-        assert criteria is not None, "Unsupported dicom_type. Please add the appropriate type to DICOM_TYPES."
-        selection_criteria.append(criteria)
-    assert len(selection_criteria) > 0, "No dicoms selected."
-    selection_criteria = tuple(selection_criteria)
+    selection_criteria = get_selection_criteria(dicom_types)
+
+    manifest_path = get_manifest_path(png_dir) if manifest else None
 
     if dcmtk:
         print('Converting to PNG')
-        p_umap(dicom_to_png_dcmtk, dicom_paths, image_paths)
+        # dcmtk converts every readable DICOM
+        convert_dicoms(dicom_to_png_dcmtk, 'dcmtk', dicom_paths, image_paths, (), manifest_path, histograms=histograms,
+                       **pool_options)
     elif imagemagick:
         print('Converting to PNG')
-        p_umap(dicom_to_png_imagemagick, dicom_paths, image_paths, selection_criteria)
+        convert_dicoms(dicom_to_png_imagemagick, 'imagemagick', dicom_paths, image_paths, selection_criteria, manifest_path,
+                       histograms=histograms, **pool_options)
     elif matlab:
+        assert not manifest, "The conversion manifest is not supported with matlab."
         dicom_to_png_matlab(dicom_paths, image_paths, selection_criteria)
+    elif numpy and frame_options is not None:
+        print('Converting frames to {}'.format('volumes' if frame_options['volume'] else 'PNG'))
+        frame_range = frame_options['frame_range']
+        convert_dicoms(partial(dicom_to_frames_numpy, frame_range=frame_range), 'numpy_frames', dicom_paths, image_paths,
+                       selection_criteria, manifest_path, histograms=histograms, png_options=png_options,
+                       extra_parameters={'frame_range': frame_range}, **pool_options)
+    elif numpy and bundle_dir is not None:
+        print('Converting to exam bundles')
+        with ExamBundleWriter(bundle_dir, exams) as bundle_writer:
+            convert_dicoms(dicom_to_png_numpy, 'numpy', dicom_paths, image_paths, selection_criteria, manifest_path,
+                           histograms=histograms, png_options=png_options, bundle_writer=bundle_writer, **pool_options)
+        print('Wrote {} exam bundles to {}, {} exams with failed DICOMs will be converted again by the next run'.format(
+            bundle_writer.num_bundles, bundle_dir, bundle_writer.num_failed))
+    elif numpy and shard_options is not None:
+        print('Converting to {}shards'.format('PNG and ' if shard_options['png'] else ''))
+        with ShardWriter(shard_options['shard_dir'], shard_options['shard_format'], shard_options['shard_bytes'],
+                         shard_options['levels']) as shard_writer:
+            convert_dicoms(partial(dicom_to_png_numpy, pyramid=pyramid), 'numpy', dicom_paths, image_paths,
+                           selection_criteria, manifest_path, histograms=histograms, shard_writer=shard_writer,
+                           png_options=png_options, extra_parameters={'pyramid': pyramid} if pyramid else None,
+                           **pool_options)
+    elif numpy:
+        print('Converting to PNG')
+        convert_dicoms(partial(dicom_to_png_numpy, pyramid=pyramid), 'numpy', dicom_paths, image_paths,
+                       selection_criteria, manifest_path, histograms=histograms, png_options=png_options,
+                       extra_parameters={'pyramid': pyramid} if pyramid else None, **pool_options)
+
+    if dedup_options is not None and dedup_options['link']:
+        link_duplicates(duplicate_map, get_image_path, pyramid)
 
 
 if __name__ == '__main__':
@@ -98,6 +432,43 @@ if __name__ == '__main__':
         required=False,
         default=None,
         help='Optionally give a json with a list of dicom paths instead of a dicom directory.')
+    parser.add_argument(
+        '--metadata_database',
+        type=str,
+        default=None,
+        help='Optional path to a SQLite file, or a mssql:// URL, of DICOM metadata saved by dicom_metadata_to_sql.py. '
+             'The DICOMs in dicom_dir which fit --dicom_types are selected from the metadata instead of listing dicom_dir.')
+    parser.add_argument(
+        '--dedup',
+        default=False,
+        action='store_true',
+        help='Set flag to convert each instance once: DICOMs with the SOPInstanceUID of another DICOM, or without a '
+             'SOPInstanceUID and with the same raw pixel data, are not converted. The map from each duplicate to its '
+             'converted DICOM is saved to --duplicate_map_path.')
+    parser.add_argument(
+        '--dedup_verify_pixels',
+        default=False,
+        action='store_true',
+        help='Set flag to also compare a hash of the raw pixel data of DICOMs with the same SOPInstanceUID.')
+    parser.add_argument(
+        '--duplicate_map_path',
+        type=str,
+        default=None,
+        help='Path of the JSON duplicate map of --dedup. Defaults to the PNG directory with the suffix {}.'.format(
+            DUPLICATE_MAP_SUFFIX))
+    parser.add_argument(
+        '--link_duplicates',
+        default=False,
+        action='store_true',
+        help='Set flag to give every duplicate DICOM a hard link to (or a copy of, across file systems) the output of '
+             'its converted DICOM after conversion.')
+    parser.add_argument(
+        '--bundle_dir',
+        type=str,
+        default=None,
+        help='Optional directory where the PNGs of each exam (grouped by AccessionNumber, or StudyInstanceUID, from '
+             '--metadata_database) are packed into one bundle instead of being saved in png_dir. Exams whose bundle '
+             'exists are skipped. Only supported with --numpy and --metadata_database.')
     parser.add_argument(
         '--png_dir',
         type=str,
@@ -118,6 +489,11 @@ if __name__ == '__main__':
         default=False,
         action='store_true',
         help='Set flag to use matlab to convert DICOMs to PNGs')
+    parser.add_argument(
+        '--numpy',
+        default=False,
+        action='store_true',
+        help='Set flag to convert DICOMs to PNGs in-process with pydicom and NumPy instead of forking dcmj2pnm')
     parser.add_argument(
         '--dicom_ext',
         default='',
@@ -126,16 +502,224 @@ if __name__ == '__main__':
     parser.add_argument(
         '--dicom_types',
         nargs='*', default=['bpe_mri', 'mammo'],
-        help='List of dicom types to convert.')
+        help='List of dicom types to convert. Available types are: {}.'.format(sorted(DICOM_TYPES.keys())))
+    parser.add_argument(
+        '--manifest',
+        default=False,
+        action='store_true',
+        help='Set flag to record conversions in a manifest next to png_dir and only convert DICOMs which are new, '
+             'changed or failed, or whose conversion parameters changed')
+    parser.add_argument(
+        '--index_path',
+        type=str,
+        default=None,
+        help='Optional path to a SQLite file index, created if it does not exist, so later runs only list changed directories.')
+    parser.add_argument(
+        '--no_sniff',
+        default=False,
+        action='store_true',
+        help='Set flag to pass every file with dicom_ext to the converter instead of only files starting with the DICOM preamble and DICM magic')
+    parser.add_argument(
+        '--allow_no_preamble',
+        default=False,
+        action='store_true',
+        help='Set flag to also convert files without a preamble which start with a plausible DICOM element (older implicit VR files)')
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=None,
+        help='Seconds after which the conversion of a DICOM, including any dcmj2pnm process, is killed and recorded as failed.')
+    parser.add_argument(
+        '--chunksize',
+        type=int,
+        default=1,
+        help='Number of DICOMs sent to a worker at a time.')
+    parser.add_argument(
+        '--max_tasks_per_child',
+        type=int,
+        default=None,
+        help='Number of chunks after which a worker process is replaced, to release leaked memory.')
+    parser.add_argument(
+        '--max_in_flight',
+        type=int,
+        default=DEFAULT_MAX_IN_FLIGHT,
+        help='Maximum number of DICOMs queued for conversion while the directory is walked.')
+    parser.add_argument(
+        '--prefetch_size',
+        type=int,
+        default=0,
+        help='Size in MB of the DICOMs read ahead of the workers into the page cache by a thread pool, so that slow '
+             'network reads overlap decoding, or 0 to not read ahead. E.g. {}.'.format(DEFAULT_PREFETCH_BYTES // 2 ** 20))
+    parser.add_argument(
+        '--prefetch_threads',
+        type=int,
+        default=DEFAULT_PREFETCH_THREADS,
+        help='Number of threads reading DICOMs ahead with --prefetch_size.')
+    parser.add_argument(
+        '--report_path',
+        type=str,
+        default=None,
+        help='Optional path to a report of the outcome, reason and time of every conversion. '
+             'Paths ending in .sqlite or .db are written as SQLite, others as JSON Lines.')
+    parser.add_argument(
+        '--quiet',
+        default=False,
+        action='store_true',
+        help='Set flag to only print the rollup of the outcomes instead of one line per rejected or failed DICOM')
+
+    parser.add_argument(
+        '--metrics_path',
+        type=str,
+        default=None,
+        help='Optional path where histograms of the time and bytes of each conversion stage (discover, header, select, '
+             'decode, window, encode, write or dcmj2pnm) of each worker are exported, as Prometheus text if it ends '
+             'in .prom and as JSON otherwise. Stages are only timed if given.')
+    parser.add_argument(
+        '--metrics_every',
+        type=float,
+        default=DEFAULT_EXPORT_EVERY,
+        help='Seconds between exports of the stage histograms.')
+    parser.add_argument(
+        '--profile',
+        type=int,
+        default=0,
+        help='Number of DICOMs to convert first in the main process under cProfile, printing the slowest functions.')
+    parser.add_argument(
+        '--profile_path',
+        type=str,
+        default=None,
+        help='Path where the cProfile stats are dumped. Defaults to png_dir with a .prof extension.')
+
+    parser.add_argument(
+        '--shard_dir',
+        type=str,
+        default=None,
+        help='Optional directory where the windowed images are also written to indexed shards for training. '
+             'Only supported with --numpy.')
+    parser.add_argument(
+        '--shard_format',
+        type=str,
+        default='hdf5',
+        choices=SHARD_FORMATS,
+        help='Format of the shards: chunked hdf5 datasets or flat npy arrays which can be memory-mapped.')
+    parser.add_argument(
+        '--shard_size',
+        type=int,
+        default=DEFAULT_SHARD_BYTES // 2 ** 20,
+        help='Size of a shard in MB.')
+    parser.add_argument(
+        '--shard_levels',
+        type=int,
+        nargs='*',
+        default=[1],
+        help='Downsampling factors of the copies of each image stored in the shards, 1 for full resolution.')
+    parser.add_argument(
+        '--no_png',
+        default=False,
+        action='store_true',
+        help='Set flag to only write shards and no PNGs.')
+
+    parser.add_argument(
+        '--png_compression_level',
+        type=int,
+        default=DEFAULT_COMPRESSION_LEVEL,
+        help='zlib compression level (0-9) of the PNGs written by --numpy. Lower is faster and larger.')
+    parser.add_argument(
+        '--png_filter',
+        type=str,
+        default=DEFAULT_FILTER,
+        choices=sorted(PNG_FILTERS.keys()),
+        help='PNG filter of every scanline of the PNGs written by --numpy.')
+    parser.add_argument(
+        '--png_strategy',
+        type=str,
+        default=DEFAULT_STRATEGY,
+        choices=sorted(ZLIB_STRATEGIES.keys()),
+        help='zlib strategy of the PNGs written by --numpy.')
+    parser.add_argument(
+        '--png_threads',
+        type=int,
+        default=1,
+        help='Number of threads compressing each PNG written by --numpy. Only useful with fewer workers than CPUs.')
+
+    parser.add_argument(
+        '--frames',
+        default=False,
+        action='store_true',
+        help='Set flag to convert every frame of multi-frame DICOMs, such as tomosynthesis volumes, one frame at a time, '
+             'to a directory of PNGs named after the PNG of each DICOM. Only supported with --numpy.')
+    parser.add_argument(
+        '--frame_range',
+        type=int,
+        nargs=2,
+        default=None,
+        help='Start and stop indices of the frames to convert with --frames.')
+    parser.add_argument(
+        '--frames_volume',
+        default=False,
+        action='store_true',
+        help='Set flag to save the frames of each DICOM as one .npy volume instead of a directory of PNGs.')
+    parser.add_argument(
+        '--downsample_factors',
+        type=int,
+        nargs='*',
+        default=[],
+        help='Integer factors, e.g. 2 4, by which the numpy engine also saves each PNG downsampled, next to the PNG, '
+             'e.g. image_x2.png, from the same decoded image. Only supported with --numpy.')
+    parser.add_argument(
+        '--thumbnail_sizes',
+        type=int,
+        nargs='*',
+        default=[],
+        help='Sizes of the longest side of thumbnails, e.g. 256, which the numpy engine also saves next to each PNG, '
+             'e.g. image_thumb256.png. Only supported with --numpy.')
 
     args = parser.parse_args()
 
-    if sum([args.dcmtk, args.imagemagick, args.matlab]) != 1:
+    if sum([args.dcmtk, args.imagemagick, args.matlab, args.numpy]) != 1:
         print('Exactly one conversion type must be specified')
         exit()
 
+    if (args.shard_dir is not None or args.no_png) and not args.numpy:
+        print('Shards are only supported with --numpy')
+        exit()
+    if args.no_png and args.shard_dir is None:
+        print('--no_png requires --shard_dir')
+        exit()
+    pyramid = {'factors': sorted(set(args.downsample_factors) - {1}), 'thumbnail_sizes': sorted(set(args.thumbnail_sizes))}
+    pyramid = pyramid if pyramid['factors'] or pyramid['thumbnail_sizes'] else None
+    if pyramid and (not args.numpy or args.frames or args.no_png):
+        print('--downsample_factors and --thumbnail_sizes are only supported with --numpy, without --frames or --no_png')
+        exit()
+    if args.bundle_dir is not None and (not args.numpy or args.metadata_database is None or args.manifest or args.frames
+                                        or args.shard_dir is not None or pyramid):
+        print('--bundle_dir is only supported with --numpy and --metadata_database, without --manifest, --frames, '
+              '--shard_dir, --downsample_factors or --thumbnail_sizes')
+        exit()
+    if args.dedup and args.bundle_dir is not None:
+        print('--dedup is not supported with --bundle_dir')
+        exit()
+    if args.frames and (not args.numpy or args.shard_dir is not None):
+        print('--frames is only supported with --numpy and without --shard_dir')
+        exit()
+
     # Create png_dir if it doesn't already exist
     if not os.path.exists(args.png_dir):
         os.makedirs(args.png_dir)
 
-    main(args.dicom_dir, args.dicom_list_json, args.png_dir, args.dcmtk, args.imagemagick, args.matlab, args.dicom_types, args.dicom_ext)
+    main(args.dicom_dir, args.dicom_list_json, args.png_dir, args.dcmtk, args.imagemagick, args.matlab, args.numpy, args.dicom_types, args.dicom_ext, args.manifest,
+         args.index_path, not args.no_sniff, args.allow_no_preamble,
+         {'timeout': args.timeout, 'chunksize': args.chunksize, 'max_tasks_per_child': args.max_tasks_per_child,
+          'max_in_flight': args.max_in_flight, 'report_path': args.report_path, 'quiet': args.quiet,
+          'metrics_path': args.metrics_path, 'metrics_every': args.metrics_every, 'profile_files': args.profile,
+          'profile_path': args.profile_path or os.path.normpath(args.png_dir) + '.prof',
+          'prefetch_bytes': args.prefetch_size * 2 ** 20, 'prefetch_threads': args.prefetch_threads},
+         {'shard_dir': args.shard_dir, 'shard_format': args.shard_format, 'shard_bytes': args.shard_size * 2 ** 20,
+          'levels': args.shard_levels, 'png': not args.no_png} if args.shard_dir is not None else None,
+         {'compression_level': args.png_compression_level, 'png_filter': args.png_filter,
+          'strategy': args.png_strategy, 'num_threads': args.png_threads} if args.numpy else None,
+         {'frame_range': args.frame_range, 'volume': args.frames_volume} if args.frames else None,
+         pyramid, args.metadata_database, args.bundle_dir,
+         {'verify_pixels': args.dedup_verify_pixels, 'link': args.link_duplicates,
+          'map_path': args.duplicate_map_path or os.path.normpath(args.png_dir) + DUPLICATE_MAP_SUFFIX}
+         if args.dedup else None)
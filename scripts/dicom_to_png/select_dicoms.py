@@ -0,0 +1,122 @@
+"""Selects the DICOM files in a directory which fit the selection criteria and saves their paths as a JSON list.
+
+The JSON list can be passed to dicom_to_png.py with --dicom_list_json so
+that conversion only touches selected DICOMs. With --database, DICOMs are
+selected from metadata saved by dicom_metadata_to_sql.py without reading
+any DICOM.
+"""
+
+import argparse
+from functools import partial
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+
+from p_tqdm import p_map
+
+from oncodata.dicom_metadata.query import select_paths
+from oncodata.dicom_to_png.selection import DICOM_TYPES, get_selection_criteria, get_selection_tags, select_dicom
+from oncodata.utils.discovery import discover_paths
+from oncodata.utils.sniff import is_dicom_file
+
+
+def main(dicom_dir, results_path, dicom_types, dicom_ext, index_path, sniff, allow_no_preamble, database=None,
+         start_date=None, end_date=None):
+    """Selects DICOM files by reading only the tags named in the selection criteria, or from their metadata.
+
+    Arguments:
+        dicom_dir(str): Path to a directory containing DICOM files, or None if database is given.
+        results_path(str): Path to the JSON where the selected paths will be saved.
+        dicom_types(list): Names of dicom types in DICOM_TYPES.
+        dicom_ext(str): The extension of the dicom files.
+        index_path(str): Optional path to a persistent file index used to
+            skip listing unchanged directories.
+        sniff(bool): True to only select files whose first bytes show they are DICOMs.
+        allow_no_preamble(bool): True to also accept DICOMs without a preamble when sniffing.
+        database(str): Optional path to a SQLite file or a mssql:// URL of DICOM
+            metadata to select from instead of reading the DICOMs.
+        start_date(str): Optional first StudyDate (YYYYMMDD) of DICOMs selected from the database.
+        end_date(str): Optional last StudyDate (YYYYMMDD) of DICOMs selected from the database.
+    """
+
+    if database is not None:
+        selected_paths = select_paths(database, get_selection_criteria(dicom_types), start_date, end_date)
+        print('Selected {} DICOMs from {}'.format(len(selected_paths), database))
+
+        with open(results_path, 'w') as results_file:
+            json.dump(selected_paths, results_file, indent=4)
+        return
+
+    print('Extracting DICOM paths')
+    classify = partial(is_dicom_file, allow_no_preamble=allow_no_preamble) if sniff else None
+    dicom_paths = list(discover_paths(dicom_dir, dicom_ext, index_path, classify))
+
+    selection_criteria = get_selection_criteria(dicom_types)
+    tags = get_selection_tags(selection_criteria)
+
+    print('Selecting DICOMs')
+    selected = p_map(partial(select_dicom, selection_criteria=selection_criteria, tags=tags, verbose=False), dicom_paths)
+    selected_paths = [dicom_path for dicom_path, is_selected in zip(dicom_paths, selected) if is_selected]
+    print('Selected {} of {} DICOMs'.format(len(selected_paths), len(dicom_paths)))
+
+    with open(results_path, 'w') as results_file:
+        json.dump(selected_paths, results_file, indent=4)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument(
+        '--dicom_dir',
+        type=str,
+        help='Path to a directory containing DICOM files.')
+    inputs.add_argument(
+        '--database',
+        type=str,
+        help='Path to a SQLite file, or a mssql:// URL, of DICOM metadata saved by dicom_metadata_to_sql.py, '
+             'to select from instead of reading the DICOMs.')
+    parser.add_argument(
+        '--results_path',
+        type=str,
+        required=True,
+        help='Path to the JSON where the list of selected DICOM paths will be saved.')
+    parser.add_argument(
+        '--dicom_ext',
+        default='',
+        type=str,
+        help='The extension of the dicom files. For filtering all other files. Default as "", no filtering')
+    parser.add_argument(
+        '--dicom_types',
+        nargs='*', default=['bpe_mri', 'mammo'],
+        help='List of dicom types to select. Available types are: {}.'.format(sorted(DICOM_TYPES.keys())))
+    parser.add_argument(
+        '--index_path',
+        type=str,
+        default=None,
+        help='Optional path to a SQLite file index, created if it does not exist, so later runs only list changed directories.')
+    parser.add_argument(
+        '--no_sniff',
+        default=False,
+        action='store_true',
+        help='Set flag to read every file with dicom_ext instead of only files starting with the DICOM preamble and DICM magic')
+    parser.add_argument(
+        '--allow_no_preamble',
+        default=False,
+        action='store_true',
+        help='Set flag to also select files without a preamble which start with a plausible DICOM element (older implicit VR files)')
+    parser.add_argument(
+        '--start_date',
+        type=str,
+        default=None,
+        help='Optional first StudyDate (YYYYMMDD) of the DICOMs selected with --database.')
+    parser.add_argument(
+        '--end_date',
+        type=str,
+        default=None,
+        help='Optional last StudyDate (YYYYMMDD) of the DICOMs selected with --database.')
+    args = parser.parse_args()
+
+    main(args.dicom_dir, args.results_path, args.dicom_types, args.dicom_ext, args.index_path, not args.no_sniff,
+         args.allow_no_preamble, args.database, args.start_date, args.end_date)
@@ -0,0 +1,129 @@
+"""Benchmarks conversion and metadata extraction on a synthetic (or real) DICOM corpus at several worker counts."""
+
+import argparse
+import os
+from os.path import dirname, realpath
+import sys
+from tempfile import TemporaryDirectory
+sys.path.append(dirname(dirname(dirname(realpath(__file__)))))
+
+import pandas as pd
+
+from oncodata.utils.benchmark import TASKS, run_benchmarks
+from oncodata.utils.discovery import discover_paths
+from oncodata.utils.synthetic import CORPUS_SPECS, make_corpus
+
+
+def run_on_corpus(corpus_dir, dicom_dir, num_files, specs, seed, tasks, worker_counts, chunksize):
+    """Synthesizes a corpus unless a DICOM directory is given and benchmarks it.
+
+    Arguments:
+        corpus_dir(str): Directory where the synthetic corpus is written.
+        dicom_dir(str): Directory of real DICOMs to benchmark instead, or None.
+        num_files(int): Number of synthetic DICOMs per spec.
+        specs(list): Names of the specs in CORPUS_SPECS to synthesize.
+        seed(int): Seed of the synthetic corpus.
+        tasks(list): Names of the tasks in TASKS to benchmark.
+        worker_counts(list): Numbers of worker processes.
+        chunksize(int): Number of files sent to a worker at a time.
+    Returns:
+        A pandas DataFrame of results.
+    """
+
+    if dicom_dir is not None:
+        paths = sorted(discover_paths(dicom_dir))
+    else:
+        print('Synthesizing corpus in {}'.format(corpus_dir))
+        corpus = make_corpus(corpus_dir, num_files, [spec for spec in CORPUS_SPECS if spec['name'] in specs],
+                             seed=seed)
+        paths = [entry['path'] for entry in corpus]
+    assert len(paths) > 0, "No files to benchmark."
+
+    return run_benchmarks(paths, tasks, worker_counts, chunksize)
+
+
+def main(corpus_dir, dicom_dir, num_files, specs, seed, tasks, worker_counts, chunksize, results_path):
+    """Benchmarks tasks at several worker counts and prints a table of the results.
+
+    Arguments:
+        corpus_dir(str): Directory where the synthetic corpus is written, or
+            None to use a temporary directory.
+        dicom_dir(str): Directory of real DICOMs to benchmark instead, or None.
+        num_files(int): Number of synthetic DICOMs per spec.
+        specs(list): Names of the specs in CORPUS_SPECS to synthesize.
+        seed(int): Seed of the synthetic corpus.
+        tasks(list): Names of the tasks in TASKS to benchmark.
+        worker_counts(list): Numbers of worker processes.
+        chunksize(int): Number of files sent to a worker at a time.
+        results_path(str): Optional path where results are saved, as JSON
+            if it ends in '.json' and as CSV otherwise.
+    """
+
+    if corpus_dir is None and dicom_dir is None:
+        with TemporaryDirectory() as temp_dir:
+            results = run_on_corpus(temp_dir, dicom_dir, num_files, specs, seed, tasks, worker_counts, chunksize)
+    else:
+        results = run_on_corpus(corpus_dir, dicom_dir, num_files, specs, seed, tasks, worker_counts, chunksize)
+
+    with pd.option_context('display.float_format', '{:.2f}'.format, 'display.width', 120):
+        print(results.to_string(index=False))
+
+    if results_path is not None:
+        if results_path.endswith('.json'):
+            results.to_json(results_path, orient='records', indent=2)
+        else:
+            results.to_csv(results_path, index=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--corpus_dir',
+        type=str,
+        default=None,
+        help='Directory where the synthetic corpus is written and kept. Defaults to a temporary directory.')
+    parser.add_argument(
+        '--dicom_dir',
+        type=str,
+        default=None,
+        help='Optional directory of real DICOMs to benchmark instead of a synthetic corpus.')
+    parser.add_argument(
+        '--num_files',
+        type=int,
+        default=8,
+        help='Number of synthetic DICOMs per spec.')
+    parser.add_argument(
+        '--specs',
+        nargs='*',
+        default=[spec['name'] for spec in CORPUS_SPECS],
+        help='Specs of the synthetic corpus. Available specs are: {}.'.format([spec['name'] for spec in CORPUS_SPECS]))
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Seed of the synthetic corpus.')
+    parser.add_argument(
+        '--tasks',
+        nargs='*',
+        default=sorted(TASKS.keys()),
+        help='Tasks to benchmark. Available tasks are: {}.'.format(sorted(TASKS.keys())))
+    parser.add_argument(
+        '--workers',
+        type=int,
+        nargs='*',
+        default=[1, 2, 4, os.cpu_count()],
+        help='Numbers of worker processes to run each task with.')
+    parser.add_argument(
+        '--chunksize',
+        type=int,
+        default=1,
+        help='Number of files sent to a worker at a time.')
+    parser.add_argument(
+        '--results_path',
+        type=str,
+        default=None,
+        help='Optional path where the results table is saved, as JSON if it ends in .json and as CSV otherwise.')
+    args = parser.parse_args()
+
+    main(args.corpus_dir, args.dicom_dir, args.num_files, args.specs, args.seed, args.tasks,
+         sorted(set(args.workers)), args.chunksize, args.results_path)
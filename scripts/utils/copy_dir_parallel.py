@@ -1,46 +1,38 @@
 """Copies all files from one directory to another, preserving directory structure"""
 
 import argparse
-import os
-from shutil import copyfile
+from os.path import dirname, realpath
+import sys
+sys.path.append(dirname(dirname(dirname(realpath(__file__)))))
 
-from p_tqdm import p_umap
+from oncodata.utils.copy_dir import COPIED, DEFAULT_BATCH_BYTES, DEFAULT_BATCH_FILES, FAILED, SKIPPED, \
+    copy_dir_parallel
+from oncodata.utils.parallel import DEFAULT_MAX_IN_FLIGHT
 
-def main(source_dir, dest_dir):
+def main(source_dir, dest_dir, journal_path, verify_hash, overwrite, batch_files, batch_bytes, max_in_flight, index_path):
     """Copies all files from one directory to another
     while preserving the underlying directory structure.
 
     Arguments:
         source_dir(str): The directory with files to copy.
         dest_dir(str): The directory where the files will be copied to.
+        journal_path(str): Path to the resume journal, or None to keep
+            it next to dest_dir.
+        verify_hash(bool): True to verify copies by hash as well as size.
+        overwrite(bool): True to copy files which already exist at the
+            destination and are not in the journal.
+        batch_files(int): Maximum number of small files copied per task.
+        batch_bytes(int): Number of bytes after which a batch is closed.
+        max_in_flight(int): Maximum number of batches queued at once.
+        index_path(str): Optional path to a persistent index of source_dir
+            used to skip listing unchanged directories.
     """
 
-    paths = []
-    for root, _, files in os.walk(source_dir):
-        paths.extend([os.path.join(root, f) for f in files])
+    counts = copy_dir_parallel(source_dir, dest_dir, journal_path, verify_hash, not overwrite,
+                               batch_files, batch_bytes, max_in_flight, index_path=index_path)
 
-    def copy(source_path, skip_existing=True):
-        """Copies a file from source_path to source_path with
-        source_dir replaced by dest_dir.
-
-        Arguments:
-            source_path(str): Path to a file to be copied.
-            skip_existing(bool): True to skip copying files
-                when the destination file already exists.
-        """
-
-        dest_path = source_path.replace(source_dir.strip('/'), dest_dir.strip('/'))
-
-        # Skip if dest file already exists
-        if skip_existing and os.path.exists(dest_path):
-            return
-
-        # Create directory if necessary
-        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-
-        copyfile(source_path, dest_path)
-
-    p_umap(copy, paths)
+    print('Copied {} files ({:.1f} MB), skipped {} and failed to copy {}.'.format(
+        counts[COPIED], counts['bytes'] / 2 ** 20, counts[SKIPPED], counts[FAILED]))
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -54,6 +46,42 @@ if __name__ == '__main__':
         type=str,
         required=True,
         help='Destination directory')
+    parser.add_argument(
+        '--journal_path',
+        type=str,
+        default=None,
+        help='Path to the JSON Lines journal of copied files used to resume. Defaults to <dest_dir>.copy_journal.jsonl.')
+    parser.add_argument(
+        '--verify_hash',
+        action='store_true',
+        default=False,
+        help='Verify each copy by SHA-1 hash as well as size.')
+    parser.add_argument(
+        '--overwrite',
+        action='store_true',
+        default=False,
+        help='Copy files which already exist at the destination unless the journal records them as copied.')
+    parser.add_argument(
+        '--batch_files',
+        type=int,
+        default=DEFAULT_BATCH_FILES,
+        help='Maximum number of small files copied by one worker task.')
+    parser.add_argument(
+        '--batch_bytes',
+        type=int,
+        default=DEFAULT_BATCH_BYTES,
+        help='Number of bytes after which a batch is closed. Larger files are copied on their own.')
+    parser.add_argument(
+        '--max_in_flight',
+        type=int,
+        default=DEFAULT_MAX_IN_FLIGHT,
+        help='Maximum number of batches queued for copying while the source tree is walked.')
+    parser.add_argument(
+        '--index_path',
+        type=str,
+        default=None,
+        help='Optional path to a SQLite index of the source directory, created if it does not exist, so later runs only list changed directories.')
     args = parser.parse_args()
 
-    main(args.source_dir, args.dest_dir)
+    main(args.source_dir, args.dest_dir, args.journal_path, args.verify_hash, args.overwrite,
+         args.batch_files, args.batch_bytes, args.max_in_flight, args.index_path)
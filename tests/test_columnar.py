@@ -0,0 +1,68 @@
+from os.path import dirname, join, realpath
+import sys
+sys.path.append(dirname(dirname(realpath(__file__))))
+from tempfile import TemporaryDirectory
+import unittest
+
+from oncodata.dicom_metadata.columnar import read_columnar, write_columnar
+from oncodata.dicom_metadata.jsonl import MetadataWriter
+from oncodata.dicom_metadata.summarize import SUMMARY_COLUMNS, finalize_summary, init_summary, merge_summaries, \
+    summarize, summarize_paths, update_summary
+
+METADATA = [
+    {'dicom_path': '1.dcm', 'dicom_metadata': {'AccessionNumber': '1', 'StudyDate': '20061207', 'Modality': 'MG', 'Rows': '3328'}},
+    {'dicom_path': '2.dcm', 'dicom_metadata': {'AccessionNumber': '1', 'StudyDate': '20061207', 'Modality': 'MG', 'WindowCenter': '540'}},
+    {'dicom_path': '3.dcm', 'dicom_metadata': {'AccessionNumber': '2', 'StudyDate': '20120101', 'Modality': 'MR'}},
+    {'dicom_path': '4.dcm', 'dicom_metadata': {'Modality': 'MG'}},
+    {'dicom_path': '5.dcm', 'dicom_metadata': {}, 'errors': ['Invalid DICOM']}
+]
+
+
+class ColumnarTests(unittest.TestCase):
+    def test_round_trip(self):
+        with TemporaryDirectory() as dataset_dir:
+            self.assertEqual(len(METADATA), write_columnar(METADATA, dataset_dir, batch_size=2))
+            metadata_frame = read_columnar(dataset_dir).sort_values('dicom_path')
+
+        self.assertEqual(['1.dcm', '2.dcm', '3.dcm', '4.dcm', '5.dcm'], list(metadata_frame['dicom_path']))
+        self.assertEqual(3328, metadata_frame['Rows'].iloc[0])
+        self.assertEqual('2006', metadata_frame['year'].iloc[0])
+        self.assertEqual('{"WindowCenter": "540"}', metadata_frame['other_metadata'].iloc[1])
+
+    def test_summarize_columns(self):
+        with TemporaryDirectory() as dataset_dir:
+            write_columnar(METADATA, dataset_dir, partition_by='accession_prefix')
+            metadata_frame = read_columnar(dataset_dir, columns=SUMMARY_COLUMNS)
+
+        self.assertEqual(summarize(METADATA), summarize(metadata_frame))
+
+    def test_merge_summaries(self):
+        partial_summaries = []
+        for row in METADATA:
+            partial_summary = init_summary()
+            update_summary(partial_summary, row['dicom_metadata'])
+            partial_summaries.append(partial_summary)
+
+        merged = init_summary()
+        for partial_summary in partial_summaries:
+            merge_summaries(merged, partial_summary)
+
+        self.assertEqual(summarize(METADATA), finalize_summary(merged))
+        self.assertEqual({2: 1, 1: 1}, finalize_summary(merged)['num_dicoms_to_count'])
+
+    def test_summarize_paths(self):
+        with TemporaryDirectory() as temp_dir:
+            dataset_dir = join(temp_dir, 'metadata')
+            write_columnar(METADATA, dataset_dir, batch_size=2)
+            metadata_path = join(temp_dir, 'metadata.jsonl')
+            with MetadataWriter(metadata_path) as writer:
+                for row in METADATA:
+                    writer.write(row)
+
+            summary = summarize_paths([dataset_dir, metadata_path], shard_size=50, num_cpus=2)
+
+        self.assertEqual(summarize(METADATA + METADATA), summary)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+from os.path import dirname, realpath, join
+import sys
+sys.path.append(dirname(dirname(realpath(__file__))))
+import os
+from tempfile import TemporaryDirectory
+import unittest
+
+from oncodata.utils.copy_dir import COPIED, SKIPPED, copy_dir_parallel
+
+
+class CopyDirTests(unittest.TestCase):
+    def test_copy_and_resume(self):
+        with TemporaryDirectory() as temp_dir:
+            source_dir = join(temp_dir, 'dicoms')
+            dest_dir = join(temp_dir, 'copy')
+            # A subdirectory with the name of the source directory must not be renamed
+            os.makedirs(join(source_dir, 'dicoms'))
+            paths = [join('dicoms', '1.dcm'), '2.dcm']
+            for i, path in enumerate(paths):
+                with open(join(source_dir, path), 'wb') as f:
+                    f.write(os.urandom(1000 * (i + 1)))
+
+            counts = copy_dir_parallel(source_dir, dest_dir, verify_hash=True, batch_bytes=1500, num_processes=2)
+            self.assertEqual(2, counts[COPIED])
+            for path in paths:
+                with open(join(source_dir, path), 'rb') as source, open(join(dest_dir, path), 'rb') as dest:
+                    self.assertEqual(source.read(), dest.read())
+
+            counts = copy_dir_parallel(source_dir, dest_dir, skip_existing=False, num_processes=2)
+            self.assertEqual(0, counts[COPIED])
+            self.assertEqual(2, counts[SKIPPED])
+
+
+if __name__ == '__main__':
+    unittest.main()
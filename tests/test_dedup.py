@@ -0,0 +1,73 @@
+from os.path import dirname, realpath, join
+import sys
+sys.path.append(dirname(dirname(realpath(__file__))))
+import os
+from tempfile import TemporaryDirectory
+import unittest
+
+import numpy as np
+
+from oncodata.dicom_to_png.dedup import find_duplicates, get_instance_key, get_output_pairs, report_duplicates
+from oncodata.dicom_to_png.manifest import CONVERTED, NOT_SELECTED
+from oncodata.utils.files import link_or_copy
+from oncodata.utils.synthetic import CORPUS_SPECS, make_dicom
+
+
+class DedupTests(unittest.TestCase):
+    def test_find_duplicates(self):
+        spec = [spec for spec in CORPUS_SPECS if spec['name'] == 'mammo_small'][0]
+        with TemporaryDirectory() as dicom_dir:
+            paths = [join(dicom_dir, name) for name in ['a.dcm', 'b.dcm', 'c.dcm', 'd.dcm', 'e.dcm', 'f.dcm']]
+            dicom_data = make_dicom(spec, 0, np.random.default_rng(0))
+            dicom_data.save_as(paths[0], enforce_file_format=True)
+            dicom_data.PatientID = 'EDITED'
+            dicom_data.save_as(paths[1], enforce_file_format=True)
+            make_dicom(spec, 1, np.random.default_rng(1)).save_as(paths[2], enforce_file_format=True)
+
+            # Without SOPInstanceUIDs, copies are found by their pixel data
+            del dicom_data.SOPInstanceUID
+            dicom_data.save_as(paths[3], enforce_file_format=True)
+            dicom_data.PatientID = 'EDITED AGAIN'
+            dicom_data.save_as(paths[4], enforce_file_format=True)
+            with open(paths[5], 'wb') as noise_file:
+                noise_file.write(b'not a dicom')
+
+            rows = [get_instance_key(path) for path in paths]
+            self.assertIsNotNone(rows[5]['error'])
+            self.assertEqual({paths[1]: paths[0], paths[4]: paths[3]}, find_duplicates(rows))
+
+            verified_rows = [get_instance_key(path, verify_pixels=True) for path in paths]
+            self.assertEqual({paths[1]: paths[0], paths[4]: paths[3]}, find_duplicates(verified_rows))
+
+            link_path = join(dicom_dir, 'links', 'b.dcm')
+            os.makedirs(dirname(link_path))
+            link_or_copy(paths[0], link_path)
+            self.assertTrue(os.path.samefile(paths[0], link_path))
+
+    def test_duplicate_outputs(self):
+        with TemporaryDirectory() as png_dir:
+            for name in ['a.png', 'a_x2.png', 'a_thumb256.png', join('frames', '0000.png'), join('frames', '0001.png')]:
+                os.makedirs(dirname(join(png_dir, name)), exist_ok=True)
+                open(join(png_dir, name), 'wb').close()
+
+            pyramid = {'factors': [2, 4], 'thumbnail_sizes': [256]}
+            self.assertEqual([(join(png_dir, 'a.png'), 'b.png'), (join(png_dir, 'a_x2.png'), 'b_x2.png'),
+                              (join(png_dir, 'a_thumb256.png'), 'b_thumb256.png')],
+                             get_output_pairs(join(png_dir, 'a.png'), 'b.png', pyramid))
+            self.assertEqual([(join(png_dir, 'frames', '0000.png'), join('b', '0000.png')),
+                              (join(png_dir, 'frames', '0001.png'), join('b', '0001.png'))],
+                             get_output_pairs(join(png_dir, 'frames'), 'b'))
+            self.assertEqual([], get_output_pairs(join(png_dir, 'missing.png'), 'b.png', pyramid))
+
+    def test_report_duplicates(self):
+        rows = [{'source_path': 'a.dcm', 'status': CONVERTED, 'reason': None, 'error': None},
+                {'source_path': 'c.dcm', 'status': NOT_SELECTED, 'reason': 'wrong_Modality', 'error': 'Got "MR"'}]
+        duplicate_map = {'b.dcm': 'a.dcm', 'd.dcm': 'c.dcm', 'e.dcm': 'c.dcm'}
+        reported = list(report_duplicates(rows, duplicate_map))
+        self.assertEqual(['a.dcm', 'c.dcm', 'd.dcm', 'e.dcm'], [row['source_path'] for row in reported])
+        self.assertEqual(['wrong_Modality'] * 3, [row['reason'] for row in reported[1:]])
+        self.assertEqual('Duplicate of c.dcm: Got "MR"', reported[2]['error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
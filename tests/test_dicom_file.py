@@ -0,0 +1,95 @@
+from os.path import dirname, realpath, getsize, join
+import sys
+sys.path.append(dirname(dirname(realpath(__file__))))
+import os
+import subprocess
+from tempfile import TemporaryDirectory
+import unittest
+from unittest import mock
+
+import numpy as np
+import pydicom
+
+from oncodata.dicom_to_png.dicom_file import DicomFile
+from oncodata.dicom_to_png.dicom_to_png import DicomRejectedError, dicom_to_frames_numpy, dicom_to_png_numpy, \
+    window_dicom
+from oncodata.utils.synthetic import CORPUS_SPECS, make_dicom
+
+test_dir = dirname(realpath(__file__))
+
+
+class DicomFileTests(unittest.TestCase):
+    def test_header_does_not_read_pixels(self):
+        dicom_path = join(test_dir, 'test_data', 'test.dcm')
+        with DicomFile(dicom_path) as dicom_file:
+            self.assertEqual('SIEMENS', dicom_file.header.Manufacturer)
+            self.assertNotIn('PixelData', dicom_file.header)
+            self.assertLess(dicom_file.bytes_read, getsize(dicom_path) / 100)
+
+    def test_pixels_read_once(self):
+        dicom_path = join(test_dir, 'test_data', 'test.dcm')
+        correct_pixels = pydicom.dcmread(dicom_path).pixel_array
+        with DicomFile(dicom_path) as dicom_file:
+            dicom_file.header
+            pixels = dicom_file.dicom_data.pixel_array
+            self.assertLess(dicom_file.bytes_read, 2 * getsize(dicom_path))
+        self.assertTrue(np.array_equal(correct_pixels, pixels))
+
+    def test_iter_frames(self):
+        spec = [spec for spec in CORPUS_SPECS if spec['name'] == 'tomosynthesis'][0]
+        with TemporaryDirectory() as tmp_dir:
+            dicom_path = join(tmp_dir, 'volume.dcm')
+            dicom_data = make_dicom(spec, 0, np.random.default_rng(0))
+            # A darker first frame has a narrower min-max window than the volume
+            pixels = dicom_data.pixel_array.copy()
+            pixels[0] //= 2
+            dicom_data.PixelData = pixels.tobytes()
+            dicom_data.save_as(dicom_path, enforce_file_format=True)
+            correct_pixels = pydicom.dcmread(dicom_path).pixel_array
+
+            with DicomFile(dicom_path) as dicom_file:
+                frames = list(dicom_file.iter_frames(range(14, 20)))
+            self.assertEqual([14, 15], [index for index, _ in frames])
+            self.assertTrue(np.array_equal(correct_pixels[15], frames[1][1]))
+
+            result = dicom_to_frames_numpy(dicom_path, join(tmp_dir, 'frames'), frame_range=(2, 5))
+            self.assertEqual(3, result['num_frames'])
+            self.assertEqual(['0002.png', '0003.png', '0004.png'], sorted(os.listdir(join(tmp_dir, 'frames'))))
+
+            dicom_to_frames_numpy(dicom_path, join(tmp_dir, 'volume.npy'))
+            volume = np.load(join(tmp_dir, 'volume.npy'))
+            self.assertEqual((16, spec['rows'], spec['columns']), volume.shape)
+            # Every frame is windowed with the min-max window of the whole volume
+            self.assertTrue(np.array_equal(window_dicom(pydicom.dcmread(dicom_path)), volume))
+
+    def test_reject_volume_before_decoding(self):
+        spec = [spec for spec in CORPUS_SPECS if spec['name'] == 'tomosynthesis'][0]
+        with TemporaryDirectory() as tmp_dir:
+            dicom_path = join(tmp_dir, 'volume.dcm')
+            make_dicom(spec, 0, np.random.default_rng(0)).save_as(dicom_path, enforce_file_format=True)
+
+            with mock.patch.object(DicomFile, 'dicom_data', new_callable=mock.PropertyMock) as dicom_data:
+                with self.assertRaises(DicomRejectedError) as context:
+                    dicom_to_png_numpy(dicom_path, join(tmp_dir, 'volume.png'))
+            self.assertEqual('multiple_slices', context.exception.reason)
+            self.assertEqual(0, dicom_data.call_count)
+
+    def test_convert_tomosynthesis_frames(self):
+        specs = {spec['name']: spec for spec in CORPUS_SPECS}
+        with TemporaryDirectory() as tmp_dir:
+            os.makedirs(join(tmp_dir, 'dicoms'))
+            for name in ['tomosynthesis', 'mammo_small']:
+                make_dicom(specs[name], 0, np.random.default_rng(0)).save_as(
+                    join(tmp_dir, 'dicoms', name + '.dcm'), enforce_file_format=True)
+
+            subprocess.check_output([sys.executable, join(dirname(test_dir), 'scripts', 'dicom_to_png', 'dicom_to_png.py'),
+                                     '--dicom_dir', join(tmp_dir, 'dicoms'), '--png_dir', join(tmp_dir, 'pngs'),
+                                     '--dicom_ext', '.dcm', '--dicom_types', 'tomosynthesis', '--numpy', '--frames'],
+                                    stderr=subprocess.STDOUT)
+            self.assertEqual(['tomosynthesis'], os.listdir(join(tmp_dir, 'pngs')))
+            self.assertEqual(['{:04d}.png'.format(i) for i in range(16)],
+                             sorted(os.listdir(join(tmp_dir, 'pngs', 'tomosynthesis'))))
+
+
+if __name__ == '__main__':
+    unittest.main()
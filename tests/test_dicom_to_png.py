@@ -2,27 +2,124 @@ from os.path import dirname, realpath, join
 import sys
 
 sys.path.append(dirname(dirname(realpath(__file__))))
-from tempfile import NamedTemporaryFile
+import shutil
+from tempfile import NamedTemporaryFile, TemporaryDirectory
 import unittest
 
+from imageio.v2 import imread
 import numpy as np
-from scipy.misc import imread
+import pydicom
+from pydicom.dataset import Dataset
+from pydicom.sequence import Sequence
 
-from oncodata.dicom_to_png.dicom_to_png import dicom_to_png_dcmtk
+try:
+    from pydicom.pixels import apply_voi_lut, apply_windowing
+except ImportError:
+    from pydicom.pixel_data_handlers.util import apply_voi_lut, apply_windowing
+
+from oncodata.dicom_to_png.dicom_to_png import DEFAULT_WINDOW_LEVEL, DEFAULT_WINDOW_WIDTH, dicom_to_png_dcmtk, \
+    dicom_to_png_numpy
 
 test_dir = dirname(realpath(__file__))
+TEST_DICOM_PATH = join(test_dir, 'test_data', 'test.dcm')
+TEST_PNG_PATH = join(test_dir, 'test_data', 'test.png')
+OUTPUT_RANGE = 2 ** 16 - 1
+VOI_LUT_BITS = 12
+
+
+def write_voi_lut_dicom(path):
+    """Writes a GE copy of the test dicom with a non-linear 12-bit VOI LUT."""
+
+    dicom_data = pydicom.dcmread(TEST_DICOM_PATH)
+    num_entries = 2 ** dicom_data.BitsStored
+    item = Dataset()
+    item.LUTDescriptor = [num_entries, 0, VOI_LUT_BITS]
+    lut = np.sqrt(np.arange(num_entries) / (num_entries - 1)) * (2 ** VOI_LUT_BITS - 1)
+    item.LUTData = lut.astype('<u2').tobytes()
+    dicom_data.VOILUTSequence = Sequence([item])
+    dicom_data.Manufacturer = 'GE MEDICAL SYSTEMS'
+    dicom_data.save_as(path)
+
+    return dicom_data
+
+
+def write_sigmoid_dicom(path):
+    """Writes a GE copy of the test dicom with a window but no VOI LUT, which is windowed with a sigmoid."""
+
+    dicom_data = pydicom.dcmread(TEST_DICOM_PATH)
+    dicom_data.Manufacturer = 'GE MEDICAL SYSTEMS'
+    dicom_data.save_as(path)
+    # Tells pydicom to compute the reference with the sigmoid of DICOM PS3.3 C.11.2.1.3.1
+    dicom_data.VOILUTFunction = 'SIGMOID'
+
+    return dicom_data
+
+
+def write_linear_dicom(path):
+    """Writes a C-View copy of the test dicom, which is windowed linearly with the default window."""
+
+    dicom_data = pydicom.dcmread(TEST_DICOM_PATH)
+    dicom_data.SeriesDescription = 'L CC C-View'
+    dicom_data.save_as(path)
+    dicom_data.WindowCenter = DEFAULT_WINDOW_LEVEL
+    dicom_data.WindowWidth = DEFAULT_WINDOW_WIDTH
+
+    return dicom_data
+
+
+def get_reference_image(dicom_data, window_function, bits):
+    """Windows a dicom with pydicom and scales the result from bits to 16 bits."""
+
+    windowed = window_function(dicom_data.pixel_array, dicom_data).astype(np.float64)
+
+    return np.floor(windowed * OUTPUT_RANGE / (2 ** bits - 1) + 0.5)
 
 
 class DicomToPngTests(unittest.TestCase):
+    @unittest.skipUnless(shutil.which('dcmj2pnm'), 'dcmtk is not installed')
     def test_dicom_to_png_dcmtk(self):
-        correct_png = imread(join(test_dir, 'test_data', 'test.png'))
+        correct_png = imread(TEST_PNG_PATH)
+        selection_criteria = []
+        with NamedTemporaryFile(suffix='.png') as png_file:
+            dicom_to_png_dcmtk(TEST_DICOM_PATH, png_file.name, selection_criteria, skip_existing=False)
+            png = imread(png_file.name)
+        self.assertTrue(np.array_equal(correct_png, png))
+
+    def test_dicom_to_png_numpy(self):
+        correct_png = imread(TEST_PNG_PATH)
         selection_criteria = []
-        dicom_path = join(test_dir, 'test_data', 'test.dcm')
         with NamedTemporaryFile(suffix='.png') as png_file:
-            dicom_to_png_dcmtk(dicom_path, png_file.name, selection_criteria, skip_existing=False)
+            dicom_to_png_numpy(TEST_DICOM_PATH, png_file.name, selection_criteria, skip_existing=False)
             png = imread(png_file.name)
+        self.assertEqual(correct_png.dtype, png.dtype)
         self.assertTrue(np.array_equal(correct_png, png))
 
+    def test_dicom_to_png_numpy_windows(self):
+        variants = [(write_voi_lut_dicom, apply_voi_lut, VOI_LUT_BITS), (write_sigmoid_dicom, apply_windowing, None),
+                    (write_linear_dicom, apply_windowing, None)]
+        with TemporaryDirectory() as temp_dir:
+            dicom_path = join(temp_dir, 'test.dcm')
+            png_path = join(temp_dir, 'test.png')
+            for write_dicom, window_function, bits in variants:
+                dicom_data = write_dicom(dicom_path)
+                dicom_to_png_numpy(dicom_path, png_path, [], skip_existing=False)
+                png = imread(png_path)
+                reference = get_reference_image(dicom_data, window_function, bits or dicom_data.BitsStored)
+
+                self.assertEqual(np.uint16, png.dtype)
+                self.assertTrue(np.array_equal(reference, png), write_dicom.__name__)
+
+    @unittest.skipUnless(shutil.which('dcmj2pnm'), 'dcmtk is not installed')
+    def test_dicom_to_png_numpy_windows_match_dcmtk(self):
+        with TemporaryDirectory() as temp_dir:
+            dicom_path = join(temp_dir, 'test.dcm')
+            for write_dicom in [write_voi_lut_dicom, write_sigmoid_dicom, write_linear_dicom]:
+                write_dicom(dicom_path)
+                dcmtk_path, numpy_path = join(temp_dir, 'dcmtk.png'), join(temp_dir, 'numpy.png')
+                dicom_to_png_dcmtk(dicom_path, dcmtk_path, [], skip_existing=False)
+                dicom_to_png_numpy(dicom_path, numpy_path, [], skip_existing=False)
+                self.assertTrue(np.array_equal(imread(dcmtk_path), imread(numpy_path)), write_dicom.__name__)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,66 @@
+from os.path import dirname, realpath, join
+import sys
+sys.path.append(dirname(dirname(realpath(__file__))))
+import os
+from tempfile import TemporaryDirectory
+import unittest
+from functools import partial
+from unittest import mock
+
+from oncodata.utils import discovery
+from oncodata.utils.discovery import discover_paths
+from oncodata.utils.sniff import is_dicom_file
+
+
+class DiscoveryTests(unittest.TestCase):
+    def test_index_skips_unchanged_directories(self):
+        with TemporaryDirectory() as temp_dir:
+            root = join(temp_dir, 'dicoms')
+            for directory in ['a', join('a', 'b'), 'c']:
+                os.makedirs(join(root, directory))
+            paths = [join(root, 'a', '1.dcm'), join(root, 'a', 'b', '2.dcm'), join(root, 'c', '3.dcm'), join(root, 'c', 'notes.txt')]
+            for path in paths:
+                open(path, 'w').close()
+            index_path = join(temp_dir, 'index.sqlite')
+
+            self.assertEqual(sorted(paths[:3]), sorted(discover_paths(root, '.dcm', index_path)))
+
+            with mock.patch.object(discovery.os, 'scandir', wraps=os.scandir) as scandir:
+                self.assertEqual(sorted(paths[:3]), sorted(discover_paths(root, '.dcm', index_path)))
+                self.assertEqual(0, scandir.call_count)
+
+            os.remove(paths[2])
+            with mock.patch.object(discovery.os, 'scandir', wraps=os.scandir) as scandir:
+                self.assertEqual(sorted(paths[:2]), sorted(discover_paths(root, '.dcm', index_path)))
+                self.assertEqual(1, scandir.call_count)
+
+    def test_index_reclassifies_when_classifier_changes(self):
+        with TemporaryDirectory() as temp_dir:
+            root = join(temp_dir, 'dicoms')
+            os.makedirs(root)
+            # A DICOM without the 128 byte preamble and DICM prefix, starting with a (0008,0005) element
+            no_preamble_path = join(root, 'no_preamble.dcm')
+            with open(no_preamble_path, 'wb') as f:
+                f.write(b'\x08\x00\x05\x00CS\x0a\x00ISO_IR 100')
+            text_path = join(root, 'notes.txt')
+            with open(text_path, 'w') as f:
+                f.write('notes')
+            index_path = join(temp_dir, 'index.sqlite')
+
+            # Only the paths with the extension are sniffed
+            with mock.patch('oncodata.utils.sniff.open', wraps=open, create=True) as sniffed:
+                self.assertEqual([], list(discover_paths(root, '.dcm', index_path, is_dicom_file)))
+                self.assertEqual([mock.call(no_preamble_path, 'rb')], sniffed.call_args_list)
+
+            allow_no_preamble = partial(is_dicom_file, allow_no_preamble=True)
+            self.assertEqual([no_preamble_path], list(discover_paths(root, '.dcm', index_path, allow_no_preamble)))
+
+            with mock.patch.object(discovery.os, 'scandir', wraps=os.scandir) as scandir:
+                self.assertEqual([no_preamble_path], list(discover_paths(root, '.dcm', index_path, allow_no_preamble)))
+                self.assertEqual(0, scandir.call_count)
+                self.assertEqual([], list(discover_paths(root, '.dcm', index_path, is_dicom_file)))
+                self.assertEqual(1, scandir.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+from os.path import dirname, realpath, exists, join
+import sys
+sys.path.append(dirname(dirname(realpath(__file__))))
+import os
+from shutil import copyfile
+from tempfile import TemporaryDirectory
+import unittest
+
+import imageio
+import numpy as np
+
+from oncodata.dicom_to_png.dicom_to_png import dicom_to_png_numpy
+from oncodata.dicom_to_png.exams import ExamBundle, ExamBundleWriter, get_bundle_path, group_exams, write_bundles
+from oncodata.dicom_to_png.manifest import convert_and_record
+
+test_dir = dirname(realpath(__file__))
+
+METADATA = [
+    {'dicom_path': '3.dcm', 'AccessionNumber': '1', 'ImageLaterality': 'R', 'ViewPosition': 'CC'},
+    {'dicom_path': '1.dcm', 'AccessionNumber': '1', 'ImageLaterality': 'L', 'ViewPosition': 'MLO'},
+    {'dicom_path': '2.dcm', 'AccessionNumber': None, 'StudyInstanceUID': '1.2.3', 'Laterality': 'L'},
+    {'dicom_path': '4.dcm'}
+]
+
+
+class ExamTests(unittest.TestCase):
+    def test_group_exams(self):
+        self.assertEqual({'1': [{'dicom_path': '1.dcm', 'view': 'L MLO'}, {'dicom_path': '3.dcm', 'view': 'R CC'}],
+                          '1.2.3': [{'dicom_path': '2.dcm', 'view': 'L'}]},
+                         group_exams(METADATA))
+
+    def test_write_and_read_bundles(self):
+        dicom_path = join(test_dir, 'test_data', 'test.dcm')
+        convert = lambda *args, **kwargs: dicom_to_png_numpy(*args, return_png=True, **kwargs)
+        row = convert_and_record(convert, dicom_path, None, [])
+
+        with TemporaryDirectory() as bundle_dir:
+            copy_path = join(bundle_dir, 'copy.dcm')
+            copyfile(dicom_path, copy_path)
+            bundle_path = get_bundle_path(bundle_dir, '1')
+            self.assertNotEqual(get_bundle_path(bundle_dir, 'A/1'), get_bundle_path(bundle_dir, 'A_1'))
+
+            # An exam with a DICOM which failed is not bundled, so that it is converted again
+            exams = {'1': [{'dicom_path': dicom_path, 'view': 'L CC'}, {'dicom_path': 'missing.dcm', 'view': 'R CC'}]}
+            with ExamBundleWriter(bundle_dir, exams) as writer:
+                writer.write(dict(row))
+                writer.write(convert_and_record(convert, 'missing.dcm', None, []))
+            self.assertEqual((0, 1), (writer.num_bundles, writer.num_failed))
+            self.assertEqual(['copy.dcm'], os.listdir(bundle_dir))
+
+            exams = {'1': [{'dicom_path': dicom_path, 'view': 'L CC'}, {'dicom_path': copy_path, 'view': 'R CC'}]}
+            with ExamBundleWriter(bundle_dir, exams) as writer:
+                rows = list(write_bundles([dict(row)], writer))
+                self.assertNotIn('png_data', rows[0])
+                self.assertFalse(exists(bundle_path))
+                writer.write(convert_and_record(convert, copy_path, None, []))
+            self.assertEqual(1, writer.num_bundles)
+
+            with ExamBundle(bundle_path) as bundle:
+                self.assertEqual(2, bundle.num_dicoms)
+                image = bundle.get_images('L CC')[0]
+                pixels = bundle.read(image)
+            self.assertTrue(np.array_equal(dicom_to_png_numpy(dicom_path, None, return_image=True)['image'], pixels))
+
+            with open(bundle_path, 'rb') as bundle_file:
+                bundle_file.seek(image['offset'])
+                self.assertTrue(np.array_equal(pixels, imageio.v2.imread(bundle_file.read(image['size']))))
+
+            # An exam none of whose DICOMs is selected gets an empty bundle, so that it is skipped by the next run
+            exams = {'2': [{'dicom_path': dicom_path, 'view': 'L CC'}]}
+            with ExamBundleWriter(bundle_dir, exams) as writer:
+                writer.write(convert_and_record(convert, dicom_path, None, [{'Modality': 'MG'}]))
+            self.assertEqual(1, writer.num_bundles)
+            with ExamBundle(get_bundle_path(bundle_dir, '2')) as bundle:
+                self.assertEqual((1, []), (bundle.num_dicoms, bundle.images))
+
+if __name__ == '__main__':
+    unittest.main()
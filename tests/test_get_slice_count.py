@@ -1,9 +1,45 @@
-from os.path import dirname, realpath
+from os.path import dirname, realpath, join
 import sys
 sys.path.append(dirname(dirname(realpath(__file__))))
+from tempfile import NamedTemporaryFile
 import unittest
 
-from oncodata.dicom_to_png.get_slice_count import get_slice_count
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileDataset, FileMetaDataset
+from pydicom.encaps import encapsulate
+from pydicom.uid import ExplicitVRLittleEndian, JPEG2000Lossless, generate_uid
+
+from oncodata.dicom_to_png.get_slice_count import get_slice_count, resolve_slice_count
+
+test_dir = dirname(realpath(__file__))
+
+
+def write_multi_frame_dicom(dicom_path, num_frames, transfer_syntax, number_of_frames=True, fragments_per_frame=1,
+                            has_bot=True):
+    file_meta = FileMetaDataset()
+    file_meta.TransferSyntaxUID = transfer_syntax
+    file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.7'
+    file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    dicom_data = FileDataset(dicom_path, Dataset(), file_meta=file_meta, preamble=b'\0' * 128)
+    if int(pydicom.__version__.split('.')[0]) < 3:
+        dicom_data.is_little_endian = True
+        dicom_data.is_implicit_VR = False
+    dicom_data.Rows = 4
+    dicom_data.Columns = 4
+    dicom_data.SamplesPerPixel = 1
+    dicom_data.BitsAllocated = 16
+    if number_of_frames is not False:
+        dicom_data.NumberOfFrames = num_frames if number_of_frames is True else number_of_frames
+    frames = [np.full((4, 4), i, dtype=np.uint16).tobytes() for i in range(num_frames)]
+    if transfer_syntax == ExplicitVRLittleEndian:
+        dicom_data.PixelData = b''.join(frames)
+    else:
+        dicom_data.PixelData = encapsulate(frames, fragments_per_frame=fragments_per_frame, has_bot=has_bot)
+        dicom_data['PixelData'].is_undefined_length = True
+    dicom_data['PixelData'].VR = 'OW' if transfer_syntax == ExplicitVRLittleEndian else 'OB'
+    dicom_data.save_as(dicom_path)
+
 
 class SliceCountTests(unittest.TestCase):
     def test_slice_count(self):
@@ -12,5 +48,26 @@ class SliceCountTests(unittest.TestCase):
 
         self.assertEqual(correct_slice_count, slice_count)
 
+    def test_resolve_slice_count(self):
+        self.assertEqual((1, 'pixel_data_length'), resolve_slice_count(join(test_dir, 'test_data', 'test.dcm')))
+
+        with NamedTemporaryFile(suffix='.dcm') as dicom_file:
+            write_multi_frame_dicom(dicom_file.name, 12, ExplicitVRLittleEndian)
+            self.assertEqual((12, 'number_of_frames'), resolve_slice_count(dicom_file.name))
+
+            write_multi_frame_dicom(dicom_file.name, 12, ExplicitVRLittleEndian, number_of_frames=False)
+            self.assertEqual((12, 'pixel_data_length'), resolve_slice_count(dicom_file.name))
+
+            write_multi_frame_dicom(dicom_file.name, 12, JPEG2000Lossless, number_of_frames=False)
+            self.assertEqual((12, 'encapsulated_fragments'), resolve_slice_count(dicom_file.name))
+
+            # A single frame split into fragments, without a basic offset table
+            write_multi_frame_dicom(dicom_file.name, 1, JPEG2000Lossless, number_of_frames=False,
+                                    fragments_per_frame=3, has_bot=False)
+            self.assertEqual((1, 'encapsulated_fragments'), resolve_slice_count(dicom_file.name))
+
+            write_multi_frame_dicom(dicom_file.name, 12, ExplicitVRLittleEndian, number_of_frames='')
+            self.assertEqual((12, 'pixel_data_length'), resolve_slice_count(dicom_file.name))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,75 @@
+from os.path import dirname, realpath, join
+import sys
+sys.path.append(dirname(dirname(realpath(__file__))))
+import os
+from tempfile import TemporaryDirectory
+import unittest
+
+from oncodata.dicom_metadata.jsonl import MetadataWriter, get_json_lines_ranges, read_dicom_paths, read_metadata, \
+    read_metadata_range
+
+ROWS = [{'dicom_path': '/dicoms/{}.dcm'.format(i), 'dicom_metadata': {'Modality': 'MG'}, 'errors': []} for i in range(3)]
+
+
+class JsonLinesTests(unittest.TestCase):
+    def test_round_trip(self):
+        with TemporaryDirectory() as temp_dir:
+            for filename in ['metadata.jsonl', 'metadata.jsonl.gz']:
+                path = join(temp_dir, filename)
+                with MetadataWriter(path) as writer:
+                    writer.write(ROWS[0])
+                with MetadataWriter(path, append=True) as writer:
+                    for row in ROWS[1:]:
+                        writer.write(row)
+
+                self.assertEqual(ROWS, list(read_metadata(path)))
+
+    def test_read_ranges(self):
+        with TemporaryDirectory() as temp_dir:
+            path = join(temp_dir, 'metadata.jsonl')
+            with MetadataWriter(path) as writer:
+                for row in ROWS:
+                    writer.write(row)
+
+            for range_size in [1, 7, 10000]:
+                rows = []
+                for start, end in get_json_lines_ranges(path, range_size):
+                    rows.extend(read_metadata_range(path, start, end))
+                self.assertEqual(ROWS, rows)
+
+    def test_resume_after_truncated_line(self):
+        with TemporaryDirectory() as temp_dir:
+            path = join(temp_dir, 'metadata.jsonl')
+            with MetadataWriter(path) as writer:
+                writer.write(ROWS[0])
+            with open(path, 'a') as metadata_file:
+                metadata_file.write('{"dicom_path": "/dic')
+
+            self.assertEqual(set([ROWS[0]['dicom_path']]), read_dicom_paths(path))
+            with MetadataWriter(path, append=True) as writer:
+                writer.write(ROWS[1])
+            self.assertEqual(ROWS[:2], list(read_metadata(path)))
+
+    def test_resume_after_truncated_compressed_stream(self):
+        with TemporaryDirectory() as temp_dir:
+            for filename in ['metadata.jsonl.gz', 'metadata.jsonl.zst']:
+                path = join(temp_dir, filename)
+                with MetadataWriter(path) as writer:
+                    writer.write(ROWS[0])
+                    writer.metadata_file.flush()
+                    flushed_size = os.path.getsize(path)
+                    writer.write(ROWS[1])
+                with open(path, 'rb') as metadata_file:
+                    data = metadata_file.read()
+                # Cut just after the compressed data of the first row
+                with open(path, 'wb') as metadata_file:
+                    metadata_file.write(data[:flushed_size + 1])
+
+                self.assertEqual(set([ROWS[0]['dicom_path']]), read_dicom_paths(path))
+                with MetadataWriter(path, append=True) as writer:
+                    writer.write(ROWS[2])
+                self.assertEqual([ROWS[0], ROWS[2]], list(read_metadata(path)))
+
+
+if __name__ == '__main__':
+    unittest.main()
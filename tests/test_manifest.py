@@ -0,0 +1,79 @@
+from os.path import dirname, realpath, exists, join
+import sys
+sys.path.append(dirname(dirname(realpath(__file__))))
+import os
+from shutil import copyfile
+from tempfile import TemporaryDirectory
+import unittest
+
+from oncodata.dicom_to_png.dicom_to_png import dicom_to_png_numpy
+from oncodata.dicom_to_png.manifest import CONVERTED, FAILED, NOT_SELECTED, ConversionManifest, convert_and_record
+from oncodata.dicom_to_png.report import report_outcomes
+from oncodata.dicom_metadata.jsonl import read_metadata
+from oncodata.utils.files import atomic_output_path, hash_output
+
+test_dir = dirname(realpath(__file__))
+
+
+class ManifestTests(unittest.TestCase):
+    def test_atomic_output_path(self):
+        with TemporaryDirectory() as temp_dir:
+            image_path = join(temp_dir, 'image.png')
+            with self.assertRaises(ValueError):
+                with atomic_output_path(image_path) as temp_path:
+                    open(temp_path, 'w').write('partial')
+                    raise ValueError()
+            self.assertEqual([], os.listdir(temp_dir))
+
+            with atomic_output_path(image_path) as temp_path:
+                open(temp_path, 'w').write('complete')
+            self.assertEqual(['image.png'], os.listdir(temp_dir))
+
+    def test_get_pending(self):
+        with TemporaryDirectory() as temp_dir:
+            dicom_path = join(temp_dir, 'test.dcm')
+            image_path = join(temp_dir, 'png', 'test.png')
+            copyfile(join(test_dir, 'test_data', 'test.dcm'), dicom_path)
+            parameters = {'window_level': '540'}
+
+            with ConversionManifest(join(temp_dir, 'manifest.sqlite')) as manifest:
+                self.assertEqual([(dicom_path, image_path)],
+                                 list(manifest.get_pending([dicom_path], [image_path], 'numpy', parameters)))
+
+                row = convert_and_record(dicom_to_png_numpy, dicom_path, image_path, [])
+                self.assertEqual(CONVERTED, row['status'])
+                self.assertTrue(exists(image_path))
+                self.assertIsNone(row['output_hash'])
+                row = convert_and_record(dicom_to_png_numpy, dicom_path, image_path, [], hash_image=True)
+                self.assertEqual(hash_output(image_path), row['output_hash'])
+                manifest.record(row, 'numpy', parameters)
+
+                self.assertEqual([], list(manifest.get_pending([dicom_path], [image_path], 'numpy', parameters)))
+                self.assertEqual(1, len(list(manifest.get_pending([dicom_path], [image_path], 'dcmtk', parameters))))
+                self.assertEqual(1, len(list(manifest.get_pending([dicom_path], [image_path], 'numpy', {}))))
+
+                os.utime(dicom_path, (0, 0))
+                self.assertEqual(1, len(list(manifest.get_pending([dicom_path], [image_path], 'numpy', parameters))))
+
+    def test_outcome_report(self):
+        with TemporaryDirectory() as temp_dir:
+            dicom_path = join(test_dir, 'test_data', 'test.dcm')
+            rejected = convert_and_record(dicom_to_png_numpy, dicom_path, join(temp_dir, 'rejected.png'),
+                                          [{'Modality': 'XX'}])
+            self.assertEqual(NOT_SELECTED, rejected['status'])
+            self.assertEqual('wrong_Modality', rejected['reason'])
+
+            failed = convert_and_record(dicom_to_png_numpy, join(temp_dir, 'missing.dcm'),
+                                        join(temp_dir, 'failed.png'), [])
+            self.assertEqual(FAILED, failed['status'])
+            self.assertEqual('FileNotFoundError', failed['reason'])
+
+            report_path = join(temp_dir, 'report.jsonl')
+            rollup = report_outcomes([rejected, failed], report_path, quiet=True)
+            self.assertEqual({NOT_SELECTED: 1, FAILED: 1}, dict(rollup['status_counts']))
+            self.assertEqual(['wrong_Modality', 'FileNotFoundError'],
+                             [row['reason'] for row in read_metadata(report_path)])
+
+
+if __name__ == '__main__':
+    unittest.main()
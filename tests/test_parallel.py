@@ -0,0 +1,33 @@
+from os.path import dirname, realpath
+import sys
+sys.path.append(dirname(dirname(realpath(__file__))))
+from subprocess import check_output
+import time
+import unittest
+
+from oncodata.utils.parallel import TaskTimeoutError, bounded_imap_unordered, time_limit
+
+
+def square(x):
+    return x * x
+
+
+class ParallelTests(unittest.TestCase):
+    def test_bounded_imap_unordered(self):
+        results = bounded_imap_unordered(square, iter(range(100)), max_in_flight=8, num_processes=2, chunksize=4,
+                                         max_tasks_per_child=2)
+        self.assertEqual([x * x for x in range(100)], sorted(results))
+
+    def test_time_limit(self):
+        start = time.time()
+        with self.assertRaises(TaskTimeoutError):
+            with time_limit(0.2):
+                check_output(['sleep', '10'])
+        self.assertLess(time.time() - start, 5)
+
+        with time_limit(None):
+            time.sleep(0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+from os.path import dirname, realpath
+import sys
+sys.path.append(dirname(dirname(realpath(__file__))))
+import io
+import unittest
+from unittest import mock
+import zlib
+
+import imageio
+import numpy as np
+
+from oncodata.dicom_to_png import png
+from oncodata.dicom_to_png.png import PNG_FILTERS, compress_parallel, encode_png
+
+
+class PngTests(unittest.TestCase):
+    def test_compress_parallel(self):
+        data = np.random.default_rng(0).integers(0, 16, 100000, dtype=np.uint8).tobytes()
+        with mock.patch.object(png, 'MIN_CHUNK_SIZE', 10000):
+            compressed = compress_parallel(data, num_threads=4)
+        self.assertEqual(data, zlib.decompress(compressed))
+
+    def test_encode_png_options(self):
+        image = np.random.default_rng(0).integers(0, 2 ** 12, (300, 200), dtype=np.uint16)
+        with mock.patch.object(png, 'MIN_CHUNK_SIZE', 10000):
+            for png_filter in PNG_FILTERS:
+                png_data = encode_png(image, compression_level=1, png_filter=png_filter, strategy='rle', num_threads=3)
+                self.assertTrue(np.array_equal(image, imageio.v2.imread(io.BytesIO(png_data))))
+
+
+if __name__ == '__main__':
+    unittest.main()
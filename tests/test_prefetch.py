@@ -0,0 +1,44 @@
+from os.path import dirname, realpath
+import sys
+sys.path.append(dirname(dirname(realpath(__file__))))
+import os
+import tempfile
+import unittest
+
+from oncodata.utils.prefetch import Prefetcher
+from oncodata.utils.timing import WorkerUtilization
+
+
+class PrefetchTests(unittest.TestCase):
+    def test_prefetch_budget(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = []
+            for i, size in enumerate([100, 300, 200, 1000, 50, 250]):
+                paths.append(os.path.join(temp_dir, '{}.dcm'.format(i)))
+                with open(paths[-1], 'wb') as f:
+                    f.write(os.urandom(size))
+            paths.append(os.path.join(temp_dir, 'missing.dcm'))
+
+            with Prefetcher(budget_bytes=500, num_threads=2) as prefetcher:
+                prefetched = []
+                for path in prefetcher.prefetch(paths):
+                    prefetched.append(path)
+                    prefetcher.release(path)
+
+        self.assertEqual(paths, prefetched)
+        self.assertEqual(7, prefetcher.stats['files'])
+        self.assertEqual(1900, prefetcher.stats['bytes'])
+        # Only the file larger than the budget is held beyond it
+        self.assertEqual(1000, prefetcher.stats['peak_bytes'])
+        self.assertEqual(0, prefetcher.held_bytes)
+
+    def test_worker_utilization(self):
+        utilization = WorkerUtilization()
+        for row in [{'worker': 1, 'started': 10.0, 'seconds': 2.0}, {'worker': 1, 'started': 13.0, 'seconds': 1.0},
+                    {'worker': 2, 'started': 10.0, 'seconds': 1.0}, {'worker': 2, 'started': 11.0, 'seconds': 1.0}]:
+            utilization.update(row)
+        self.assertEqual({'workers': 2, 'busy_seconds': 5.0, 'starved_seconds': 1.0}, utilization.get_totals())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+from os.path import dirname, realpath, exists, join
+import sys
+sys.path.append(dirname(dirname(realpath(__file__))))
+from tempfile import TemporaryDirectory
+import unittest
+
+import imageio
+import numpy as np
+
+from oncodata.dicom_to_png.dicom_to_png import dicom_to_png_numpy
+from oncodata.dicom_to_png.pyramid import downsample_image, get_thumbnail_shape, iter_pyramid, resize_area
+
+test_dir = dirname(realpath(__file__))
+
+
+class PyramidTests(unittest.TestCase):
+    def test_resize_area(self):
+        image = np.random.default_rng(0).integers(0, 2 ** 12, (60, 45)).astype(np.uint16)
+        self.assertTrue(np.allclose(resize_area(image, (20, 15)), image.reshape(20, 3, 15, 3).mean(axis=(1, 3))))
+
+        resized = resize_area(image, (7, 11))
+        self.assertEqual((7, 11), resized.shape)
+        self.assertAlmostEqual(image.mean(), resized.mean())
+
+    def test_iter_pyramid(self):
+        image = np.random.default_rng(0).integers(0, 2 ** 12, (203, 130)).astype(np.uint16)
+        levels = dict(iter_pyramid(image, factors=[4, 2], thumbnail_sizes=[64]))
+        self.assertEqual(['x2', 'x4', 'thumb64'], list(levels))
+        self.assertTrue(np.array_equal(downsample_image(image, 4), levels['x4']))
+        self.assertEqual(get_thumbnail_shape(image.shape, 64), levels['thumb64'].shape)
+        self.assertEqual((64, 41), levels['thumb64'].shape)
+
+    def test_dicom_to_png_pyramid(self):
+        dicom_path = join(test_dir, 'test_data', 'test.dcm')
+        with TemporaryDirectory() as png_dir:
+            image_path = join(png_dir, 'test.png')
+            dicom_to_png_numpy(dicom_path, image_path, pyramid={'factors': [2], 'thumbnail_sizes': [256]})
+            image = imageio.v2.imread(image_path)
+            self.assertTrue(np.array_equal(downsample_image(image, 2), imageio.v2.imread(join(png_dir, 'test_x2.png'))))
+            self.assertEqual(256, max(imageio.v2.imread(join(png_dir, 'test_thumb256.png')).shape))
+            self.assertFalse(exists(join(png_dir, 'test_x4.png')))
+
+
+if __name__ == '__main__':
+    unittest.main()
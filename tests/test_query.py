@@ -0,0 +1,59 @@
+from os.path import dirname, join, realpath
+import sys
+sys.path.append(dirname(dirname(realpath(__file__))))
+import sqlite3
+from tempfile import TemporaryDirectory
+import unittest
+
+from oncodata.dicom_metadata.query import select_paths
+from oncodata.dicom_metadata.sql import SqlMetadataWriter, read_sql
+
+METADATA = [
+    {'dicom_path': '/dicoms/1.dcm', 'dicom_metadata': {'SOPClassUID': 'MR Image Storage', 'SeriesNumber': '2000',
+                                                       'InstanceNumber': '8', 'StudyDate': '20061207'}},
+    {'dicom_path': '/dicoms/2.dcm', 'dicom_metadata': {'SOPClassUID': 'MR Image Storage', 'SeriesNumber': '2000',
+                                                       'InstanceNumber': '9', 'StudyDate': '20061207'}},
+    {'dicom_path': '/dicoms/3.dcm', 'dicom_metadata': {'SOPClassUID': 'Mammography', 'ImageType': 'ORIGINAL',
+                                                       'StudyDate': '20120101'}},
+    {'dicom_path': '/dicoms/4.dcm', 'dicom_metadata': {'SOPClassUID': 'Mammography', 'ImageType': 'DERIVED'}}
+]
+BPE_MRI = {'SOPClassUID': 'MR Image Storage', 'SeriesNumber': '2000', 'InstanceNumber': '8'}
+
+
+class QueryTests(unittest.TestCase):
+    def test_select_paths(self):
+        with TemporaryDirectory() as temp_dir:
+            database = join(temp_dir, 'metadata.sqlite')
+            with SqlMetadataWriter(database) as writer:
+                for row in METADATA:
+                    writer.write(row)
+
+            self.assertEqual(['/dicoms/1.dcm'], select_paths(database, [BPE_MRI]))
+            self.assertEqual(['/dicoms/1.dcm', '/dicoms/3.dcm'],
+                             select_paths(database, [BPE_MRI, {'SOPClassUID': 'Mammography', 'ImageType': 'ORIGINAL'}]))
+            self.assertEqual(['/dicoms/3.dcm'], select_paths(database, [], start_date='20100101', end_date='20121231'))
+            self.assertEqual(4, len(select_paths(database, [])))
+
+            plan = read_sql(database, 'EXPLAIN QUERY PLAN SELECT * FROM dicoms WHERE SOPClassUID = ?', ('1',))
+            self.assertIn('dicoms_SOPClassUID', plan['detail'].iloc[0])
+
+    def test_select_paths_is_read_only(self):
+        with TemporaryDirectory() as temp_dir:
+            database = join(temp_dir, 'metadata.sqlite')
+            with SqlMetadataWriter(database) as writer:
+                for row in METADATA:
+                    writer.write(row)
+            with sqlite3.connect(database) as connection:
+                connection.execute('DROP INDEX dicoms_SOPClassUID')
+
+            get_indexes = "SELECT name FROM sqlite_master WHERE type = 'index' AND name = 'dicoms_SOPClassUID'"
+            self.assertEqual(['/dicoms/1.dcm'], select_paths(database, [BPE_MRI]))
+            self.assertEqual(0, len(read_sql(database, get_indexes)))
+
+            # Opening a writer, as dicom_metadata_to_sql.py --migrate does, creates the missing index
+            SqlMetadataWriter(database).close()
+            self.assertEqual(1, len(read_sql(database, get_indexes)))
+
+
+if __name__ == '__main__':
+    unittest.main()
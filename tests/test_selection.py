@@ -0,0 +1,32 @@
+from os.path import dirname, realpath, join
+import sys
+sys.path.append(dirname(dirname(realpath(__file__))))
+import unittest
+
+from oncodata.dicom_to_png.selection import MAMMOGRAM_SELECTION_CRITERIA, get_selection_tags, read_tags, select_dicom
+
+test_dir = dirname(realpath(__file__))
+
+FLUOROSCOPY_SELECTION_CRITERIA = {'Modality': 'RF', 'SeriesNumber': '1'}
+
+
+class SelectionTests(unittest.TestCase):
+    def test_read_tags(self):
+        tags = get_selection_tags([FLUOROSCOPY_SELECTION_CRITERIA])
+        dicom_data = read_tags(join(test_dir, 'test_data', 'test.dcm'), tags)
+
+        self.assertEqual('RF', dicom_data.Modality)
+        self.assertNotIn('Manufacturer', dicom_data)
+        self.assertNotIn('PixelData', dicom_data)
+
+    def test_select_dicom(self):
+        dicom_path = join(test_dir, 'test_data', 'test.dcm')
+
+        self.assertTrue(select_dicom(dicom_path, []))
+        self.assertTrue(select_dicom(dicom_path, [MAMMOGRAM_SELECTION_CRITERIA, FLUOROSCOPY_SELECTION_CRITERIA], verbose=False))
+        self.assertFalse(select_dicom(dicom_path, [MAMMOGRAM_SELECTION_CRITERIA], verbose=False))
+        self.assertFalse(select_dicom(join(test_dir, 'test_data', 'test.png'), [], verbose=False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+from os.path import dirname, realpath, join
+import sys
+sys.path.append(dirname(dirname(realpath(__file__))))
+import os
+import sqlite3
+from tempfile import TemporaryDirectory
+import unittest
+
+import numpy as np
+
+from oncodata.dicom_to_png.dicom_to_png import dicom_to_png_numpy
+from oncodata.dicom_to_png.manifest import CONVERTED, ConversionManifest, convert_and_record, record_rows
+from oncodata.dicom_to_png.shards import ShardReader, ShardWriter, downsample_image, write_shards
+
+test_dir = dirname(realpath(__file__))
+
+
+class ShardTests(unittest.TestCase):
+    def test_downsample_image(self):
+        image = np.arange(20, dtype=np.uint16).reshape(4, 5)
+        self.assertEqual([[3, 5], [13, 15]], downsample_image(image, 2).tolist())
+
+    def test_write_and_read_shards(self):
+        dicom_path = join(test_dir, 'test_data', 'test.dcm')
+        row = convert_and_record(lambda *args, **kwargs: dicom_to_png_numpy(*args, return_image=True, **kwargs),
+                                 dicom_path, None, [])
+        image = row['image']
+
+        for shard_format in ['npy', 'hdf5']:
+            with TemporaryDirectory() as shard_dir:
+                with ShardWriter(shard_dir, shard_format, shard_bytes=image.nbytes, levels=[1, 2]) as writer:
+                    rows = list(write_shards([dict(row), dict(row, source_path='copy.dcm')], writer))
+                self.assertNotIn('image', rows[0])
+
+                with ShardReader(shard_dir) as reader:
+                    index_rows = reader.get_rows(sop_instance_uid=row['sop_instance_uid'])
+                    self.assertEqual(2, len(index_rows))
+                    self.assertNotEqual(index_rows[0]['shard_path'], index_rows[1]['shard_path'])
+                    self.assertTrue(np.array_equal(image, reader.read(index_rows[1])[:]))
+                    downsampled = reader.read(reader.get_rows(level=2)[0])
+                    self.assertEqual((image.shape[0] // 2, image.shape[1] // 2), downsampled.shape)
+
+    def test_interrupted_export(self):
+        dicom_path = join(test_dir, 'test_data', 'test.dcm')
+        row = convert_and_record(lambda *args, **kwargs: dicom_to_png_numpy(*args, return_image=True, **kwargs),
+                                 dicom_path, None, [])
+
+        def interrupted_rows():
+            for i in range(3):
+                yield dict(row, source_path='{}.dcm'.format(i))
+            raise KeyboardInterrupt()
+
+        for shard_format in ['npy', 'hdf5']:
+            with TemporaryDirectory() as temp_dir:
+                # Neither the writer nor the manifest is closed, as if the process was killed after the second row
+                writer = ShardWriter(join(temp_dir, 'shards'), shard_format)
+                manifest = ConversionManifest(join(temp_dir, 'manifest.sqlite'))
+                rows = record_rows(write_shards(interrupted_rows(), writer), manifest, 'numpy', {}, commit_every=2,
+                                   before_commit=writer.flush)
+                with self.assertRaises(KeyboardInterrupt):
+                    list(rows)
+
+                converted_paths = [path for path, in sqlite3.connect(join(temp_dir, 'manifest.sqlite')).execute(
+                    'SELECT source_path FROM conversions WHERE status = ?', [CONVERTED])]
+                self.assertEqual(['0.dcm', '1.dcm'], sorted(converted_paths))
+                with ShardReader(join(temp_dir, 'shards')) as reader:
+                    index_rows = reader.get_rows()
+                    self.assertEqual(['0.dcm', '1.dcm'], [index_row['source_path'] for index_row in index_rows])
+                    self.assertTrue(np.array_equal(row['image'], reader.read(index_rows[1])[:]))
+                writer.close()
+                # The third row, recorded but not committed, is rolled back rather than committed by close
+                manifest.close()
+                converted_paths = [path for path, in sqlite3.connect(join(temp_dir, 'manifest.sqlite')).execute(
+                    'SELECT source_path FROM conversions WHERE status = ?', [CONVERTED])]
+                self.assertEqual(['0.dcm', '1.dcm'], sorted(converted_paths))
+
+    def test_new_shards_never_overwrite_existing_ones(self):
+        image = np.arange(12, dtype=np.uint16).reshape(3, 4)
+        for shard_format in ['npy', 'hdf5']:
+            with TemporaryDirectory() as shard_dir:
+                with ShardWriter(shard_dir, shard_format, shard_bytes=image.nbytes) as writer:
+                    for i in range(3):
+                        writer.write(image, '{}.dcm'.format(i), str(i), 'accession')
+                    # Flushing keeps the current shard open
+                    shard_path = writer.shard_path
+                    writer.flush()
+                    self.assertEqual(shard_path, writer.shard_path)
+                    self.assertIsNotNone(writer.shard)
+                extension = '.npy' if shard_format == 'npy' else '.h5'
+                os.remove(join(shard_dir, 'shard-00001' + extension))
+
+                with ShardWriter(shard_dir, shard_format, shard_bytes=image.nbytes) as writer:
+                    writer.write(image + 1, '3.dcm', '3', 'accession')
+                self.assertEqual(['shard-00000', 'shard-00002', 'shard-00003'],
+                                 sorted(name[:-len(extension)] for name in os.listdir(shard_dir)
+                                        if name.endswith(extension)))
+                with ShardReader(shard_dir) as reader:
+                    self.assertTrue(np.array_equal(image, reader.read(reader.get_rows(sop_instance_uid='2')[0])[:]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+from os.path import dirname, realpath, join
+import sys
+sys.path.append(dirname(dirname(realpath(__file__))))
+from tempfile import TemporaryDirectory
+import unittest
+
+from oncodata.utils.sniff import SNIFF_LENGTH, is_dicom_file
+
+test_dir = dirname(realpath(__file__))
+
+
+class SniffTests(unittest.TestCase):
+    def test_is_dicom_file(self):
+        dicom_path = join(test_dir, 'test_data', 'test.dcm')
+        self.assertTrue(is_dicom_file(dicom_path))
+
+        with TemporaryDirectory() as temp_dir:
+            text_path = join(temp_dir, 'notes.txt')
+            with open(text_path, 'w') as text_file:
+                text_file.write('Not a DICOM' * 20)
+            self.assertFalse(is_dicom_file(text_path))
+            self.assertFalse(is_dicom_file(text_path, allow_no_preamble=True))
+
+            no_preamble_path = join(temp_dir, 'no_preamble.dcm')
+            with open(dicom_path, 'rb') as dicom_file, open(no_preamble_path, 'wb') as no_preamble_file:
+                no_preamble_file.write(dicom_file.read()[SNIFF_LENGTH:])
+            self.assertFalse(is_dicom_file(no_preamble_path))
+            self.assertTrue(is_dicom_file(no_preamble_path, allow_no_preamble=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
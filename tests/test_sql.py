@@ -0,0 +1,60 @@
+from os.path import dirname, join, realpath
+import sys
+sys.path.append(dirname(dirname(realpath(__file__))))
+from tempfile import TemporaryDirectory
+import unittest
+
+from oncodata.dicom_metadata.sql import SqlMetadataWriter, read_sql
+
+METADATA = [
+    {'dicom_path': '1.dcm', 'slice_count': 1, 'dicom_metadata': {'AccessionNumber': '1', 'StudyDate': '20061207',
+                                                                'Rows': '3328', 'WindowCenter': '540'}},
+    {'dicom_path': '2.dcm', 'dicom_metadata': {'AccessionNumber': '1', 'Modality': 'MG'}},
+    {'dicom_path': '3.dcm', 'dicom_metadata': {}, 'errors': ['Invalid DICOM']}
+]
+
+
+class SqlTests(unittest.TestCase):
+    def test_upsert(self):
+        with TemporaryDirectory() as temp_dir:
+            database = join(temp_dir, 'metadata.sqlite')
+            for metadata in [METADATA, METADATA[:1] + [dict(METADATA[1], dicom_metadata={'AccessionNumber': '2'})]]:
+                with SqlMetadataWriter(database, batch_size=2, num_connections=2) as writer:
+                    for row in metadata:
+                        writer.write(row)
+                    # SQLite has a single writer
+                    self.assertEqual(1, writer.pool.size)
+
+            self.assertEqual('wal', read_sql(database, 'PRAGMA journal_mode').iloc[0, 0])
+            dicoms = read_sql(database, 'SELECT * FROM dicoms ORDER BY dicom_path')
+            self.assertEqual(['1.dcm', '2.dcm', '3.dcm'], list(dicoms['dicom_path']))
+            self.assertEqual(['1', '2'], list(dicoms['AccessionNumber'].dropna()))
+            self.assertEqual('2006-12-07', dicoms['StudyDate'].iloc[0])
+            self.assertEqual(3328, dicoms['Rows'].iloc[0])
+            self.assertTrue(dicoms['Modality'].isnull().all())
+
+            tags = read_sql(database, 'SELECT * FROM dicom_tags WHERE dicom_path = ?', ('1.dcm',))
+            self.assertEqual([('1.dcm', 'WindowCenter', '540')], list(tags.itertuples(index=False, name=None)))
+            errors = read_sql(database, 'SELECT error FROM dicom_errors')
+            self.assertEqual(['Invalid DICOM'], list(errors['error']))
+
+            plan = read_sql(database, 'EXPLAIN QUERY PLAN SELECT * FROM dicoms WHERE PatientID = ?', ('1',))
+            self.assertIn('dicoms_PatientID', plan['detail'].iloc[0])
+
+    def test_duplicate_paths_in_batch(self):
+        with TemporaryDirectory() as temp_dir:
+            database = join(temp_dir, 'metadata.sqlite')
+            rewritten = dict(METADATA[0], dicom_metadata={'AccessionNumber': '2', 'WindowCenter': '600'})
+            with SqlMetadataWriter(database, batch_size=10) as writer:
+                for row in METADATA + [rewritten]:
+                    writer.write(row)
+
+            dicoms = read_sql(database, 'SELECT dicom_path, AccessionNumber FROM dicoms ORDER BY dicom_path')
+            self.assertEqual(['1.dcm', '2.dcm', '3.dcm'], list(dicoms['dicom_path']))
+            self.assertEqual(['2', '1'], list(dicoms['AccessionNumber'].dropna()))
+            tags = read_sql(database, 'SELECT * FROM dicom_tags WHERE dicom_path = ?', ('1.dcm',))
+            self.assertEqual([('1.dcm', 'WindowCenter', '600')], list(tags.itertuples(index=False, name=None)))
+
+
+if __name__ == '__main__':
+    unittest.main()
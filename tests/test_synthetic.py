@@ -0,0 +1,28 @@
+from os.path import dirname, realpath
+import sys
+sys.path.append(dirname(dirname(realpath(__file__))))
+from tempfile import TemporaryDirectory
+import unittest
+
+from oncodata.dicom_to_png.get_slice_count import get_slice_count
+from oncodata.utils.benchmark import run_benchmarks
+from oncodata.utils.synthetic import CORPUS_SPECS, make_corpus
+from oncodata.utils.sniff import is_dicom_file
+
+
+class SyntheticTests(unittest.TestCase):
+    def test_make_corpus(self):
+        specs = [spec for spec in CORPUS_SPECS if spec['name'] in ('mammo_rle', 'mr', 'tomosynthesis')]
+        with TemporaryDirectory() as corpus_dir:
+            corpus = make_corpus(corpus_dir, num_files=1, specs=specs, num_noise_files=1)
+            # Truncated DICOMs still start with the magic bytes
+            sniffed = [entry for entry in corpus if entry['spec'] != 'noise_truncated']
+            self.assertEqual([entry['is_dicom'] for entry in sniffed], [is_dicom_file(entry['path']) for entry in sniffed])
+            self.assertEqual([1, 1, 16], [get_slice_count(entry['path']) for entry in corpus if entry['is_dicom']])
+
+            results = run_benchmarks([entry['path'] for entry in corpus], ['slice_count'], [1])
+            self.assertEqual([6], results['files'].tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+from os.path import dirname, realpath, join
+import sys
+sys.path.append(dirname(dirname(realpath(__file__))))
+from tempfile import TemporaryDirectory
+import unittest
+
+from oncodata.dicom_to_png.dicom_to_png import dicom_to_png_numpy
+from oncodata.dicom_to_png.manifest import convert_and_record
+from oncodata.utils.timing import StageHistograms, add_stage, collect_stages, stage
+
+test_dir = dirname(realpath(__file__))
+
+
+class TimingTests(unittest.TestCase):
+    def test_stages_only_collected_when_instrumented(self):
+        with stage('decode'):
+            add_stage('decode', num_bytes=10)
+
+        with collect_stages() as stages:
+            with stage('decode'):
+                add_stage('decode', num_bytes=10)
+        self.assertEqual(['decode'], list(stages.keys()))
+        self.assertEqual(10, stages['decode']['bytes'])
+
+    def test_conversion_histograms(self):
+        with TemporaryDirectory() as temp_dir:
+            row = convert_and_record(dicom_to_png_numpy, join(test_dir, 'test_data', 'test.dcm'),
+                                     join(temp_dir, 'test.png'), [], instrument=True)
+            self.assertEqual({'header', 'select', 'decode', 'window', 'encode', 'write'}, set(row['stages'].keys()))
+
+            histograms = StageHistograms()
+            histograms.update(row)
+            histograms.update(row)
+            self.assertEqual([2] * 6, [histogram['count'] for histogram in histograms.to_json()])
+            self.assertIn('oncodata_stage_seconds_count{{stage="write",worker="{}"}} 2'.format(row['worker']),
+                          histograms.to_prometheus())
+
+
+if __name__ == '__main__':
+    unittest.main()